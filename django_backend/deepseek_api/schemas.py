@@ -12,6 +12,16 @@ class LoginOut(Schema):
     expiry: int
 
 
+class LogFilterIn(Schema):
+    levels: Optional[List[str]] = None  # 日志级别，如 ["ERROR", "WARN"]
+    services: Optional[List[str]] = None  # 服务名
+    hosts: Optional[List[str]] = None  # 主机名
+    since: Optional[str] = None  # 起始时间，时间字符串或相对时间 "30m" / "1h" / "2d"
+    until: Optional[str] = None  # 结束时间
+    around: Optional[str] = None  # 故障时间点，检索其前后 window 内的日志
+    window: Optional[str] = None  # around 前后的时长，如 "15m"（默认）/ "1h"
+
+
 class ChatIn(Schema):
     session_id: str = "默认对话"
     user_input: str
@@ -19,6 +29,26 @@ class ChatIn(Schema):
     use_db_search: bool = True  # (新增) 默认开启数据库
     use_web_search: bool = False  # (新增) 默认关闭联网
     model_name: Optional[str] = None  # (新增) 前端选择的模型
+    knowledge_bases: Optional[List[str]] = None  # 指定检索的知识库，为空时按问题自动路由
+    filters: Optional[LogFilterIn] = None  # 日志元数据过滤条件，下推到向量库检索
+
+
+class RetrieveBatchIn(Schema):
+    queries: List[str]  # 多条检索内容（如一批告警文本），每条分别返回结果
+    top_k: int = 5
+    use_keyword: bool = True  # 融合关键词检索
+    knowledge_bases: Optional[List[str]] = None  # 指定检索的知识库，为空时逐条自动路由
+    filters: Optional[LogFilterIn] = None  # 日志元数据过滤条件，对每条查询生效
+    context_lines: Optional[int] = None  # 展开上下文行数，为空时使用 LOG_CONTEXT_LINES
+
+
+class TimelineIn(Schema):
+    since: str  # 起始时间，时间字符串或相对时间 "30m" / "1h" / "2d"
+    until: str  # 结束时间
+    knowledge_bases: Optional[List[str]] = None  # 限定的知识库，为空时统计全部
+    gap: str = "1m"  # 相邻错误日志间隔超过该时长即切分为新的突发
+    limit: int = 5  # 返回最密集的突发次数
+    samples: int = 3  # 每次突发附带的样例日志条数
 
 
 class ChatOut(Schema):
@@ -31,5 +61,9 @@ class HistoryOut(Schema):
     history: str
 
 
+class IndexBuildIn(Schema):
+    rebuild: bool = False  # True: 全量重建到新集合后切换；False: 增量同步
+
+
 class ErrorResponse(Schema):
     error: str
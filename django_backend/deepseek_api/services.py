@@ -4,8 +4,10 @@ from typing import Dict, Any, Optional, List
 from django.core.cache import cache
 import hashlib
 from .models import APIKey, RateLimit, ConversationSession
+from .glossary import GLOSSARY_ENTRIES
 from django.conf import settings
 from topklogsystem import TopKLogSystem
+from log_tailer import LogTailer
 import logging
 import json
 from ddgs import DDGS
@@ -58,12 +60,27 @@ try:
         log_path="./data/log",
         llm="deepseek-r1:7b",  # DeepSeek-R1:7B - 基于 Qwen2 架构，支持思考过程 (thinking)
         embedding_model="bge-large:latest",  # BGE-Large 嵌入模型，用于向量检索
+        # 术语表用于知识库路由和关键词分词，在启动同步之前传入
+        glossary=GLOSSARY_ENTRIES,
+        **getattr(settings, "LOG_SYSTEM_OPTIONS", {}),
     )
     logger.info("TopKLogSystem 全局初始化成功。使用模型: DeepSeek-R1:7B")
 except Exception as e:
     log_system = None
     logger.error(f"TopKLogSystem 全局初始化失败: {e}")
 
+# 实时跟踪日志：在后台线程中把新追加的日志记录写入向量库
+log_tailer = None
+_tailer_options = dict(getattr(settings, "LOG_TAILER", {}))
+if log_system is not None and _tailer_options.pop("enabled", False):
+    try:
+        log_tailer = LogTailer(log_system, **_tailer_options)
+        log_tailer.start()
+        logger.info("日志实时跟踪已启动。")
+    except Exception as e:
+        log_tailer = None
+        logger.error(f"日志实时跟踪启动失败: {e}")
+
 
 def real_web_search(query: str, max_results: int = 3) -> List[Dict]:
     logger.info(f"[REAL-WEB-SEARCH] 正在执行联网搜索: {query}")
@@ -96,9 +113,13 @@ def model_api_call(
     use_db_search: bool = True,
     use_web_search: bool = False,
     model_name: Optional[str] = None,
+    knowledge_bases: Optional[List[str]] = None,
+    log_filters: Optional[Dict] = None,
+    prompt_usage: Optional[Dict] = None,
 ):
     """
     调用 模型 API 函数 - 流式响应。
+    prompt_usage 传入字典时填入 prompt 各部分的 token 数（见 generate_response）。
     ... (函数文档保持不变) ...
     """
 
@@ -122,7 +143,13 @@ def model_api_call(
 
         if use_db_search:
             logger.info(f"执行数据库日志检索: {prompt}")
-            log_results = log_system.retrieve_logs(prompt, top_k=5)
+            log_results = log_system.retrieve_logs(
+                prompt,
+                top_k=5,
+                context_lines=getattr(settings, "LOG_CONTEXT_LINES", 0),
+                knowledge_bases=knowledge_bases,
+                filters=log_filters,
+            )
 
         if use_web_search:
             logger.info(f"执行联网搜索: {prompt}")
@@ -138,6 +165,7 @@ def model_api_call(
             context=combined_context,
             history=conversation_history,
             model_name=model_name,
+            usage=prompt_usage,
         ):
             yield chunk
 
@@ -112,3 +112,58 @@ RATE_LIMIT_MAX = 5000  # 每分钟最大请求数
 RATE_LIMIT_INTERVAL = 60
 CACHE_MAX_SIZE = 200
 CACHE_EXPIRY = 300
+
+# TopKLogSystem 额外参数（透传给构造函数）
+LOG_SYSTEM_OPTIONS = {
+    "incremental": True,  # 启动时增量同步 data/log，只嵌入新增/变更文件
+    "parse_workers": max(1, (os.cpu_count() or 2) - 1),  # 文档解析进程数
+    # 超过该大小的文件在主进程内流式解析，避免子进程一次性返回整个文件的文档
+    "parse_worker_max_bytes": 32 * 1024 * 1024,
+    "template_mining": [".log"],  # 对 .log 做模板挖掘；CSV 日志源可加入 ".csv"
+    "background_build": True,  # 启动时的同步放到后台任务，进度见 /api/index/status
+    "kb_depth": 2,  # 按 data/log 下前两级目录（如 数据库类/mysql）划分知识库集合
+    # 向量/关键词两路结果的融合策略："rrf" 按排名融合；"weighted" 按归一化分加权，
+    # 可配合 "fusion_weights": {"vector": 1.0, "keyword": 0.5}
+    "fusion": "rrf",
+    # 查询向量/检索结果缓存的条目数和有效期（秒），入库或重建后结果缓存自动失效
+    "query_cache_size": 1024,
+    "query_cache_ttl": 600,
+    # 检索结果中只是时间戳/ID/数值不同的近似重复日志只保留一条（SimHash 汉明距离阈值）；
+    # 设置 "mmr_lambda": 0.7 可再按 MMR 做多样性重排
+    "dedupe_distance": 3,
+    # 向量后端："chroma"；单机百万条以内可用 "flat"（内存映射的 float16 矩阵，精确检索，
+    # 多个 worker 进程共享页缓存），切换后启动时自动全量重建
+    "vector_backend": "chroma",
+    # flat 后端的向量压缩（内存放不下全部向量时启用）："int8" 每维 1 字节，
+    # "pq" 每条 pq_subspaces 字节；rerank_factor 为精确重打分的候选倍数，越大召回越高
+    "flat_quantization": None,
+    "rerank_factor": 4,
+    # filters 带 around/window 或 since/until 时，时间戳索引命中的候选不超过该条数
+    # 则只对候选做向量打分，否则在向量库内按时间过滤
+    "time_candidate_limit": 20000,
+    # 查询改写词表 {"rewrites": {"口语/错拼/缩写": "标准词"}, "synonyms": {"主词": [...]}}，
+    # 在内置词表基础上覆盖/补充；修改文件后几秒内自动生效，文件不存在时只用内置词表
+    "query_rewrite_path": os.path.join(BASE_DIR, "data", "query_rewrite.json"),
+    # 各模型的 prompt token 预算（不含生成）：total 为总数，history / logs / web 为
+    # 扣除系统提示和问题后的份额，超出时丢弃最早的历史、相关度最低的日志和网页；
+    # 模型名可不带标签（"qwen3"），未列出的模型使用 "default"
+    "prompt_budgets": {
+        "default": {"total": 8192, "history": 0.3, "logs": 0.5, "web": 0.2},
+        "deepseek-r1": {"total": 16384},
+        "qwen3": {"total": 16384},
+    },
+}
+
+# 检索命中日志时，从原文件展开的前后行数（0 表示不展开）
+LOG_CONTEXT_LINES = 3
+
+# /api/retrieve/batch 一次最多接受的查询条数
+RETRIEVE_BATCH_MAX = 100
+
+# 实时跟踪 data/log 下的日志文件，新记录以微批写入向量库（参数透传给 LogTailer）
+# 也可以单独运行: python log_tailer.py --log-path ./data/log
+LOG_TAILER = {
+    "enabled": False,
+    "patterns": ["*.log"],  # 相对 data/log 的 glob 模式
+    "interval": 2.0,  # 轮询间隔（秒）
+}
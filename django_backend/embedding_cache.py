@@ -0,0 +1,189 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from array import array
+from typing import Dict, List
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """
+    持久化的内容寻址嵌入缓存（SQLite）。
+
+    键为 sha256(模型名 + 用途 + 规范化文本)，值为 float32 向量。
+    条目数超过 max_entries 时按最近访问时间淘汰最旧的 10%。
+    SQLite 使用 WAL 模式，多个 Django 进程可以共享同一个缓存文件。
+    """
+
+    def __init__(self, path: str, max_entries: int = 2_000_000) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_access"
+            " ON embeddings(last_access)"
+        )
+        self._conn.commit()
+        self._entries = self._count()
+
+    def _count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """规范化文本：去掉首尾空白，合并连续空白"""
+        return re.sub(r"\s+", " ", text).strip()
+
+    @staticmethod
+    def make_key(model: str, kind: str, text: str) -> str:
+        raw = f"{model}\x00{kind}\x00{EmbeddingCache.normalize(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        if not keys:
+            return found
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            # SQLite 单条语句的参数个数有上限，分段查询
+            for i in range(0, len(unique_keys), 500):
+                part = unique_keys[i : i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    part,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self._conn.commit()
+            hits = sum(1 for key in keys if key in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access)"
+                " VALUES (?, ?, ?)",
+                [
+                    (key, array("f", vector).tobytes(), now)
+                    for key, vector in items.items()
+                ],
+            )
+            self._conn.commit()
+            self._entries += len(items)
+            if self._entries > self.max_entries:
+                self._evict()
+
+    def _evict(self) -> None:
+        """淘汰最久未访问的条目，直到条目数降到上限的 90%"""
+        self._entries = self._count()
+        excess = self._entries - int(self.max_entries * 0.9)
+        if excess <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            " SELECT key FROM embeddings ORDER BY last_access LIMIT ?)",
+            (excess,),
+        )
+        self._conn.commit()
+        self._entries -= excess
+        self.evictions += excess
+        logger.info(f"嵌入缓存淘汰 {excess} 条，剩余 {self._entries} 条")
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "entries": self._entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    为任意 LangChain Embeddings 加一层 EmbeddingCache。
+
+    入库（embed_documents）和检索（embed_query）都先查缓存，
+    只把未命中的文本发给底层模型；同一批次中的重复文本只嵌入一次。
+    """
+
+    def __init__(
+        self, embeddings: Embeddings, model_name: str, cache: EmbeddingCache
+    ) -> None:
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache
+
+    def _embed(self, texts: List[str], kind: str) -> List[List[float]]:
+        keys = [EmbeddingCache.make_key(self.model_name, kind, text) for text in texts]
+        try:
+            found = self.cache.get_many(keys)
+        except Exception as e:
+            logger.error(f"读取嵌入缓存失败: {e}")
+            found = {}
+
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+
+        if missing:
+            if kind == "query" and len(missing) == 1:
+                vectors = [self.embeddings.embed_query(next(iter(missing.values())))]
+            else:
+                # 多条查询也一次批量请求：OllamaEmbeddings.embed_query 即单条的 embed_documents
+                vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            try:
+                self.cache.put_many(computed)
+            except Exception as e:
+                logger.error(f"写入嵌入缓存失败: {e}")
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, "document")
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text], "query")[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """批量嵌入查询，按查询类型读写缓存，未命中的查询一次发给底层模型"""
+        return self._embed(texts, "query")
+
+    def stats(self) -> Dict[str, float]:
+        return self.cache.stats()
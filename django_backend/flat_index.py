@@ -0,0 +1,622 @@
+import os
+import json
+import bisect
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from ingest_lock import IngestLock
+from log_metadata import matches_where
+from vector_quantization import (
+    QUANTIZATIONS,
+    Quantizer,
+    load_quantizer,
+    save_quantizer,
+    train_quantizer,
+)
+
+logger = logging.getLogger(__name__)
+
+# 支持的向量存储精度
+FLAT_DTYPES = {"float16": np.float16, "float32": np.float32}
+# 各类数据文件名，{} 为压缩代数
+FLAT_FILES = {
+    "vectors": "vectors.{}.bin",
+    "docs": "docs.{}.jsonl",
+    "idx": "docs.{}.idx",
+    "codes": "codes.{}.bin",
+}
+
+
+class FlatVectorIndex:
+    """
+    单个知识库的平铺向量索引：连续的向量矩阵（默认 float16，写入前已归一化，
+    点积即余弦相似度），以 np.memmap 只读映射，按块做精确的批量点积检索。
+
+    目录下的文件（gen 为压缩代数，压缩时写新文件，旧文件随后删除）：
+    - meta.json：知识库名、精度、维度、行数、代数、来源 → 行区间、已删除行区间
+    - vectors.<gen>.bin：向量矩阵，按行追加
+    - docs.<gen>.jsonl / docs.<gen>.idx：每行的 {id, text, metadata} 及字节偏移（uint64）
+    - quantizer.npz / codes.<gen>.bin：启用压缩时的量化器参数和每行的压缩编码
+
+    写入（追加、删除、改名、压缩）持有目录下 write.lock 的进程间文件锁，
+    并在锁内按 meta.json 刷新行数，多个进程的写入不会基于过期的 count 截断文件；
+    其他进程检索前检查 meta.json 是否变化，变化后重新映射。
+    矩阵是只读映射的普通文件，多个 Django worker 通过操作系统页缓存共享同一份数据。
+
+    quantization 为 "int8"（每维 1 字节）或 "pq"（每条 pq_subspaces 字节）时，
+    行数达到 train_size 后用随机样本训练量化器并为全部行编码，此后检索分两段：
+    先在压缩编码上粗排取 top_k * rerank_factor 个候选，再读取这些行的原始向量精确重打分。
+    常驻内存的只有编码，原始向量只按候选行读取；rerank_factor 越大召回越高、越慢。
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        knowledge_base: str = "",
+        dtype: str = "float16",
+        block_rows: int = 65536,
+        max_deleted_ratio: float = 0.5,
+        quantization: Optional[str] = None,
+        pq_subspaces: int = 64,
+        train_size: int = 20000,
+        rerank_factor: int = 4,
+    ) -> None:
+        if dtype not in FLAT_DTYPES:
+            raise ValueError(f"不支持的向量精度: {dtype}")
+        if quantization is not None and quantization not in QUANTIZATIONS:
+            raise ValueError(f"不支持的向量压缩方式: {quantization}")
+        self.directory = directory
+        self.block_rows = block_rows
+        self.max_deleted_ratio = max_deleted_ratio
+        self.pq_subspaces = pq_subspaces
+        self.train_size = max(256, train_size)
+        self.rerank_factor = max(1, rerank_factor)
+        self._lock = threading.RLock()
+        self._meta: Dict[str, Any] = {
+            "knowledge_base": knowledge_base,
+            "dtype": dtype,
+            "dim": 0,
+            "count": 0,
+            "generation": 0,
+            "sources": {},
+            "deleted": [],
+            "quantization": quantization,
+            # 已训练量化器时为每行编码的字节数，0 表示尚未训练
+            "code_size": 0,
+        }
+        self._meta_stamp: Optional[Tuple[int, int]] = None
+        self._quantizer: Optional[Quantizer] = None
+        self._vectors: Optional[np.memmap] = None
+        self._codes: Optional[np.memmap] = None
+        self._offsets: Optional[np.memmap] = None
+        self._docs: Optional[np.memmap] = None
+        self._deleted_mask: Optional[np.ndarray] = None
+        # 节点 id → 行号（含已删除行），同一代内行数增长时只解析新增的行，
+        # 压缩换代后按新行号重建
+        self._id_rows: Optional[Dict[str, int]] = None
+        self._id_rows_scanned = 0
+        self._id_rows_generation = 0
+        self._write_lock = IngestLock(os.path.join(directory, "write.lock"))
+        # (起始行, 结束行, 来源) 按起始行排序，文件改名后按行号取当前来源
+        self._source_ranges: List[Tuple[int, int, str]] = []
+        self._source_starts: List[int] = []
+        os.makedirs(directory, exist_ok=True)
+        self._refresh()
+
+    @property
+    def knowledge_base(self) -> str:
+        return self._meta["knowledge_base"]
+
+    @property
+    def dtype(self):
+        return FLAT_DTYPES[self._meta["dtype"]]
+
+    def _meta_path(self) -> str:
+        return os.path.join(self.directory, "meta.json")
+
+    def _path(self, kind: str, generation: Optional[int] = None) -> str:
+        generation = self._meta["generation"] if generation is None else generation
+        return os.path.join(self.directory, FLAT_FILES[kind].format(generation))
+
+    def _refresh(self, force: bool = False) -> None:
+        """meta.json 变化（本进程或其他进程写入）后重新加载并映射文件"""
+        try:
+            stat = os.stat(self._meta_path())
+        except FileNotFoundError:
+            return
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if not force and stamp == self._meta_stamp:
+            return
+        with open(self._meta_path(), "r", encoding="utf-8") as f:
+            self._meta = json.load(f)
+        self._meta_stamp = stamp
+        self._close_maps()
+        if self._meta["generation"] != self._id_rows_generation or (
+            self._id_rows_scanned > self._meta["count"]
+        ):
+            self._id_rows = None
+        count, dim = self._meta["count"], self._meta["dim"]
+        if count:
+            self._vectors = np.memmap(
+                self._path("vectors"), dtype=self.dtype, mode="r", shape=(count, dim)
+            )
+            self._offsets = np.memmap(
+                self._path("idx"), dtype=np.uint64, mode="r", shape=(count + 1,)
+            )
+            self._docs = np.memmap(self._path("docs"), dtype=np.uint8, mode="r")
+        code_size = self._meta.get("code_size", 0)
+        if code_size:
+            if self._quantizer is None:
+                self._quantizer = load_quantizer(self._quantizer_path())
+            if count:
+                self._codes = np.memmap(
+                    self._path("codes"),
+                    dtype=np.uint8,
+                    mode="r",
+                    shape=(count, code_size),
+                )
+        self._deleted_mask = self._build_deleted_mask()
+        self._source_ranges = sorted(
+            (start, end, source)
+            for source, ranges in self._meta["sources"].items()
+            for start, end in ranges
+        )
+        self._source_starts = [start for start, _, _ in self._source_ranges]
+
+    def _build_deleted_mask(self) -> np.ndarray:
+        mask = np.zeros(self._meta["count"], dtype=bool)
+        for start, end in self._meta["deleted"]:
+            mask[start:end] = True
+        return mask
+
+    def _close_maps(self) -> None:
+        # Windows 上映射中的文件不能截断/替换，写入前先释放本进程的映射
+        self._vectors = self._offsets = self._docs = self._codes = None
+
+    def _quantizer_path(self) -> str:
+        return os.path.join(self.directory, "quantizer.npz")
+
+    def _save_meta(self) -> None:
+        tmp_path = f"{self._meta_path()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self._meta_path())
+        self._refresh(force=True)
+
+    @property
+    def count(self) -> int:
+        return self._meta["count"]
+
+    @property
+    def live_count(self) -> int:
+        """未删除的行数（先按 meta.json 刷新，反映其他进程的写入）"""
+        with self._lock:
+            self._refresh()
+            deleted = sum(end - start for start, end in self._meta["deleted"])
+            return self.count - deleted
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+    def add(
+        self,
+        ids: Sequence[str],
+        texts: Sequence[str],
+        metadatas: Sequence[Dict[str, Any]],
+        embeddings: Sequence[Sequence[float]],
+    ) -> None:
+        if not ids:
+            return
+        vectors = self._normalize(np.asarray(embeddings, dtype=np.float32))
+        with self._write_lock, self._lock:
+            self._refresh()
+            meta = self._meta
+            if meta["dim"] and vectors.shape[1] != meta["dim"]:
+                raise ValueError(
+                    f"向量维度不一致: 索引为 {meta['dim']}，写入为 {vectors.shape[1]}"
+                )
+            count = meta["count"]
+            docs_end = int(self._offsets[count]) if count else 0
+            self._close_maps()
+
+            # 先截掉上次中途退出时可能残留的、未登记到 meta.json 的尾部数据
+            row_bytes = vectors.shape[1] * np.dtype(self.dtype).itemsize
+            with open(self._path("vectors"), "a+b") as f:
+                f.truncate(count * row_bytes)
+                f.write(vectors.astype(self.dtype).tobytes())
+            offsets = []
+            with open(self._path("docs"), "a+b") as f:
+                f.truncate(docs_end)
+                position = docs_end
+                for node_id, text, metadata in zip(ids, texts, metadatas):
+                    line = json.dumps(
+                        {"id": node_id, "text": text, "metadata": metadata},
+                        ensure_ascii=False,
+                        default=str,
+                    )
+                    data = (line + "\n").encode("utf-8")
+                    f.write(data)
+                    position += len(data)
+                    offsets.append(position)
+            with open(self._path("idx"), "a+b") as f:
+                f.truncate((count + 1) * 8 if count else 0)
+                if not count:
+                    offsets.insert(0, 0)
+                f.write(np.asarray(offsets, dtype=np.uint64).tobytes())
+            if meta.get("code_size"):
+                with open(self._path("codes"), "a+b") as f:
+                    f.truncate(count * meta["code_size"])
+                    f.write(self._quantizer.encode(vectors).tobytes())
+            elif meta.get("quantization") and count + len(ids) >= self.train_size:
+                self._train_quantizer(count + len(ids), vectors.shape[1])
+
+            for row, metadata in enumerate(metadatas, count):
+                ranges = meta["sources"].setdefault(metadata.get("source", ""), [])
+                if ranges and ranges[-1][1] == row:
+                    ranges[-1][1] = row + 1
+                else:
+                    ranges.append([row, row + 1])
+            meta["dim"] = vectors.shape[1]
+            meta["count"] = count + len(ids)
+            self._save_meta()
+            if self._id_rows is not None and self._id_rows_scanned == count:
+                self._id_rows.update(zip(ids, range(count, count + len(ids))))
+                self._id_rows_scanned = meta["count"]
+
+    def _train_quantizer(self, count: int, dim: int) -> None:
+        """从已写入的向量中随机抽样训练量化器，再分块为全部行编码"""
+        vectors = np.memmap(
+            self._path("vectors"), dtype=self.dtype, mode="r", shape=(count, dim)
+        )
+        rng = np.random.default_rng(0)
+        rows = np.sort(rng.choice(count, min(count, self.train_size), replace=False))
+        sample = np.asarray(vectors[rows], dtype=np.float32)
+        quantizer = train_quantizer(
+            self._meta["quantization"], sample, subspaces=self.pq_subspaces
+        )
+        with open(self._path("codes"), "wb") as f:
+            for start in range(0, count, self.block_rows):
+                block = np.asarray(vectors[start : start + self.block_rows], np.float32)
+                f.write(quantizer.encode(block).tobytes())
+        del vectors
+        save_quantizer(self._quantizer_path(), quantizer)
+        self._quantizer = quantizer
+        self._meta["code_size"] = quantizer.code_size
+        logger.info(
+            f"向量量化器训练完成 {self.directory}：{quantizer.name}，"
+            f"每行 {quantizer.code_size} 字节，样本 {len(rows)} 行"
+        )
+
+    def delete_source(self, source: str) -> None:
+        with self._write_lock, self._lock:
+            self._refresh()
+            ranges = self._meta["sources"].pop(source, None)
+            if not ranges:
+                return
+            self._meta["deleted"].extend(ranges)
+            if self.count and (
+                (self.count - self.live_count) / self.count >= self.max_deleted_ratio
+            ):
+                self._compact()
+            else:
+                self._save_meta()
+
+    def rename_source(self, old: str, new: str) -> None:
+        """
+        文件改名（如日志轮转）：只把 meta.json 中 old 的行区间改到 new 名下，
+        向量和文档行不重写，读取时按行号取当前来源
+        """
+        with self._write_lock, self._lock:
+            self._refresh()
+            ranges = self._meta["sources"].pop(old, None)
+            if not ranges:
+                return
+            merged = sorted(self._meta["sources"].get(new, []) + ranges)
+            self._meta["sources"][new] = merged
+            self._save_meta()
+
+    def _compact(self) -> None:
+        """把未删除的行复制到新一代文件，行号整体前移"""
+        meta = self._meta
+        live = ~self._build_deleted_mask()
+        new_rows = np.cumsum(live) - 1
+        generation = meta["generation"] + 1
+        offsets = [0]
+        code_file = None
+        if self._codes is not None:
+            code_file = open(self._path("codes", generation), "wb")
+        with open(self._path("vectors", generation), "wb") as vector_file, open(
+            self._path("docs", generation), "wb"
+        ) as docs_file:
+            for start in range(0, meta["count"], self.block_rows):
+                end = min(meta["count"], start + self.block_rows)
+                block_live = live[start:end]
+                vector_file.write(
+                    np.ascontiguousarray(self._vectors[start:end][block_live]).tobytes()
+                )
+                if code_file is not None:
+                    codes = self._codes[start:end][block_live]
+                    code_file.write(np.ascontiguousarray(codes).tobytes())
+                for row in np.nonzero(block_live)[0] + start:
+                    begin, finish = int(self._offsets[row]), int(self._offsets[row + 1])
+                    docs_file.write(self._docs[begin:finish].tobytes())
+                    offsets.append(offsets[-1] + finish - begin)
+        with open(self._path("idx", generation), "wb") as f:
+            f.write(np.asarray(offsets, dtype=np.uint64).tobytes())
+        if code_file is not None:
+            code_file.close()
+
+        old_generation = meta["generation"]
+        id_rows = None
+        if self._id_rows is not None and self._id_rows_scanned == meta["count"]:
+            id_rows = {
+                node_id: int(new_rows[row])
+                for node_id, row in self._id_rows.items()
+                if live[row]
+            }
+        meta["sources"] = {
+            source: [[int(new_rows[s]), int(new_rows[e - 1]) + 1] for s, e in ranges]
+            for source, ranges in meta["sources"].items()
+        }
+        meta["count"] = int(live.sum())
+        meta["deleted"] = []
+        meta["generation"] = generation
+        self._save_meta()
+        if id_rows is not None:
+            self._id_rows = id_rows
+            self._id_rows_scanned = meta["count"]
+            self._id_rows_generation = generation
+        for kind in FLAT_FILES:
+            try:
+                os.remove(self._path(kind, old_generation))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                # 其他进程仍在映射旧文件（Windows），下次压缩时再清理
+                logger.warning(f"删除旧向量文件失败: {e}")
+        logger.info(f"平铺向量索引压缩完成 {self.directory}，剩余 {meta['count']} 行")
+
+    def _doc(self, row: int) -> Dict[str, Any]:
+        start, end = int(self._offsets[row]), int(self._offsets[row + 1])
+        doc = json.loads(self._docs[start:end].tobytes())
+        # 文档行写入后不再修改，改名后的来源以 meta.json 的行区间为准
+        position = bisect.bisect_right(self._source_starts, row) - 1
+        if position >= 0 and row < self._source_ranges[position][1]:
+            doc["metadata"]["source"] = self._source_ranges[position][2]
+        return doc
+
+    def _top_rows(
+        self, queries: np.ndarray, k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """每个查询得分最高的 k 行，返回按得分降序的 (行号, 得分)"""
+        if self._codes is None:
+            return self._scan(
+                len(queries),
+                k,
+                lambda start, end: queries
+                @ np.asarray(self._vectors[start:end], dtype=np.float32).T,
+            )
+        # 两段检索：压缩编码粗排，候选行读取原始向量精确重打分
+        prepared = self._quantizer.prepare(queries)
+        candidates, _ = self._scan(
+            len(queries),
+            min(self.count, k * self.rerank_factor),
+            lambda start, end: self._quantizer.scores(prepared, self._codes[start:end]),
+        )
+        return self._rescore(queries, candidates, k)
+
+    def _rescore(
+        self, queries: np.ndarray, candidates: np.ndarray, k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # 候选行按行号排序后读取，减少随机 IO
+        candidates = np.sort(candidates, axis=1)
+        scores = np.empty(candidates.shape, dtype=np.float32)
+        for i, (query, rows) in enumerate(zip(queries, candidates)):
+            scores[i] = np.asarray(self._vectors[rows], dtype=np.float32) @ query
+        scores[self._deleted_mask[candidates]] = -np.inf
+        order = np.argsort(-scores, axis=1)[:, :k]
+        return (
+            np.take_along_axis(candidates, order, axis=1),
+            np.take_along_axis(scores, order, axis=1),
+        )
+
+    def _scan(
+        self,
+        query_count: int,
+        k: int,
+        score_block: Callable[[int, int], np.ndarray],
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """逐块打分并保留每个查询的前 k 行，返回按得分降序的 (行号, 得分)"""
+        deleted, count = self._deleted_mask, self.count
+        best_rows = np.empty((query_count, 0), dtype=np.int64)
+        best_scores = np.empty((query_count, 0), dtype=np.float32)
+        for start in range(0, count, self.block_rows):
+            end = min(count, start + self.block_rows)
+            scores = score_block(start, end).astype(np.float32, copy=False)
+            scores[:, deleted[start:end]] = -np.inf
+            rows = np.broadcast_to(np.arange(start, end), scores.shape)
+            best_rows = np.concatenate([best_rows, rows], axis=1)
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        return (
+            np.take_along_axis(best_rows, order, axis=1),
+            np.take_along_axis(best_scores, order, axis=1),
+        )
+
+    def search(
+        self,
+        embeddings: Sequence[Sequence[float]],
+        top_k: int,
+        where: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        批量精确检索，每个查询返回最多 top_k 个 {"id", "text", "metadata", "score"}。
+        有 where 条件时先多取候选再按元数据过滤，候选不足时扩大候选数重试。
+        """
+        queries = self._normalize(np.asarray(embeddings, dtype=np.float32))
+        with self._lock:
+            self._refresh()
+            if not self.count or top_k <= 0:
+                return [[] for _ in range(len(queries))]
+            results: List[List[Dict[str, Any]]] = []
+            pending = list(range(len(queries)))
+            k = top_k if where is None else top_k * 10
+            hits: Dict[int, List[Dict[str, Any]]] = {}
+            while pending:
+                k = min(k, self.count)
+                rows, scores = self._top_rows(queries[pending], k)
+                retry = []
+                for position, query_index in enumerate(pending):
+                    found = []
+                    for row, score in zip(rows[position], scores[position]):
+                        if not np.isfinite(score):
+                            break
+                        doc = self._doc(int(row))
+                        if not matches_where(doc["metadata"], where):
+                            continue
+                        doc["score"] = float(score)
+                        found.append(doc)
+                        if len(found) >= top_k:
+                            break
+                    if len(found) < top_k and k < self.count:
+                        retry.append(query_index)
+                    else:
+                        hits[query_index] = found
+                pending = retry
+                k *= 4
+            for query_index in range(len(queries)):
+                results.append(hits[query_index])
+            return results
+
+    def _rows_by_id(self) -> Dict[str, int]:
+        """
+        节点 id → 行号（含已删除行，查找时用 _live_rows 过滤）。首次调用时扫描文档建立，
+        之后只解析新追加的行；本进程的追加和压缩直接更新，不重新扫描
+        """
+        if self._id_rows is None:
+            self._id_rows = {}
+            self._id_rows_scanned = 0
+            self._id_rows_generation = self._meta["generation"]
+        for row in range(self._id_rows_scanned, self.count):
+            start, end = int(self._offsets[row]), int(self._offsets[row + 1])
+            self._id_rows[json.loads(self._docs[start:end].tobytes())["id"]] = row
+        self._id_rows_scanned = self.count
+        return self._id_rows
+
+    def _live_rows(self, ids: Sequence[str]) -> Dict[str, int]:
+        """给定节点中已写入且未删除的 id → 行号"""
+        rows_by_id = self._rows_by_id()
+        rows = {}
+        for node_id in ids:
+            row = rows_by_id.get(node_id)
+            if row is not None and not self._deleted_mask[row]:
+                rows[node_id] = row
+        return rows
+
+    def existing_ids(self, ids: Sequence[str]) -> Set[str]:
+        """已写入且未删除的节点 id"""
+        with self._lock:
+            self._refresh()
+            if not self.count:
+                return set()
+            return set(self._live_rows(ids))
+
+    def embeddings(self, ids: Sequence[str]) -> Dict[str, List[float]]:
+        """按节点 id 读取向量（MMR 重排使用），不存在的 id 不返回"""
+        with self._lock:
+            self._refresh()
+            if not self.count:
+                return {}
+            rows = self._live_rows(ids)
+            return {
+                node_id: np.asarray(self._vectors[row], np.float32).tolist()
+                for node_id, row in rows.items()
+            }
+
+    def documents(self, ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        """按节点 id 读取 {"id", "text", "metadata"}，不存在的 id 不返回"""
+        with self._lock:
+            self._refresh()
+            if not self.count:
+                return {}
+            rows = self._live_rows(ids)
+            return {node_id: self._doc(row) for node_id, row in rows.items()}
+
+    def search_ids(
+        self,
+        embeddings: Sequence[Sequence[float]],
+        ids: Sequence[str],
+        top_k: int,
+        where: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """只在给定节点中精确检索（如时间索引圈定的候选），返回格式同 search"""
+        queries = self._normalize(np.asarray(embeddings, dtype=np.float32))
+        with self._lock:
+            self._refresh()
+            if not self.count or top_k <= 0:
+                return [[] for _ in range(len(queries))]
+            rows = np.array(sorted(set(self._live_rows(ids).values())), np.int64)
+            if not len(rows):
+                return [[] for _ in range(len(queries))]
+            scores = queries @ np.asarray(self._vectors[rows], dtype=np.float32).T
+            results = []
+            for query_scores in scores:
+                found = []
+                for position in np.argsort(-query_scores):
+                    doc = self._doc(int(rows[position]))
+                    if not matches_where(doc["metadata"], where):
+                        continue
+                    doc["score"] = float(query_scores[position])
+                    found.append(doc)
+                    if len(found) >= top_k:
+                        break
+                results.append(found)
+            return results
+
+    def stats(self) -> Dict[str, Any]:
+        """行数、压缩方式和各文件大小；resident_bytes 为检索时需要全量扫描的数据量"""
+        with self._lock:
+            self._refresh()
+            sizes = {}
+            for kind in FLAT_FILES:
+                try:
+                    sizes[kind] = os.path.getsize(self._path(kind))
+                except OSError:
+                    sizes[kind] = 0
+            code_size = self._meta.get("code_size", 0)
+            return {
+                "rows": self.count,
+                "live_rows": self.live_count,
+                "dim": self._meta["dim"],
+                "dtype": self._meta["dtype"],
+                "quantization": self._meta.get("quantization") if code_size else None,
+                "bytes_per_row": code_size or self._meta["dim"] * self.dtype().itemsize,
+                "vector_bytes": sizes["vectors"],
+                "code_bytes": sizes["codes"],
+                "doc_bytes": sizes["docs"] + sizes["idx"],
+                "resident_bytes": sizes["codes"] if code_size else sizes["vectors"],
+            }
+
+    def drop(self) -> None:
+        with self._lock:
+            self._close_maps()
+            self._quantizer = None
+            self._id_rows = None
+            for name in os.listdir(self.directory):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError as e:
+                    logger.warning(f"删除向量文件失败 {name}: {e}")
+            try:
+                os.rmdir(self.directory)
+            except OSError:
+                pass
@@ -0,0 +1,110 @@
+import time
+import uuid
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class IndexBuildCancelled(Exception):
+    """索引构建任务被取消"""
+
+
+class IndexBuildJob:
+    """
+    后台索引构建任务。
+
+    在守护线程中执行 target(progress_callback, cancel_event)，
+    target 为 TopKLogSystem.sync_vectorstore 或 rebuild_vectorstore；
+    每写入一个批次更新一次进度，snapshot() 计算吞吐量和预计剩余时间。
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        target: Callable[
+            [Callable[[Dict[str, Any]], None], threading.Event], Dict[str, Any]
+        ],
+    ) -> None:
+        self.job_id = uuid.uuid4().hex[:12]
+        self.mode = mode
+        self.target = target
+        # pending / running / succeeded / failed / cancelled
+        self.status = "pending"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.progress: Dict[str, Any] = {}
+        self.report: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.cancel_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name=f"index-build-{self.job_id}", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        self.status = "running"
+        self.started_at = time.time()
+        logger.info(f"索引构建任务开始: {self.job_id} ({self.mode})")
+        try:
+            self.report = self.target(self._update, self.cancel_event)
+            cancelled = self.report.get("cancelled") or self.cancel_event.is_set()
+            self.status = "cancelled" if cancelled else "succeeded"
+        except Exception as e:
+            logger.error(f"索引构建任务失败 {self.job_id}: {e}")
+            self.error = str(e)
+            self.status = "failed"
+        self.finished_at = time.time()
+        logger.info(f"索引构建任务结束: {self.job_id}，状态 {self.status}")
+
+    def _update(self, progress: Dict[str, Any]) -> None:
+        self.progress = progress
+
+    def cancel(self) -> None:
+        self.cancel_event.set()
+
+    def is_running(self) -> bool:
+        return self.status in ("pending", "running")
+
+    def snapshot(self) -> Dict[str, Any]:
+        progress = self.progress
+        files_total = progress.get("files_total", 0)
+        files_done = progress.get("files_done", 0)
+        documents = progress.get("documents", 0)
+        if self.started_at is None:
+            elapsed = 0.0
+        else:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+
+        eta = None
+        if self.is_running() and files_done and files_total:
+            eta = round(elapsed / files_done * (files_total - files_done), 1)
+
+        report = self.report or {}
+        return {
+            "job_id": self.job_id,
+            "mode": self.mode,
+            "status": self.status,
+            "cancel_requested": self.cancel_event.is_set(),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed": round(elapsed, 1),
+            "files_total": files_total,
+            "files_done": files_done,
+            "files_failed": len(progress.get("failed", [])),
+            "documents": documents,
+            "batches": progress.get("batches", 0),
+            "documents_per_second": round(documents / elapsed, 2) if elapsed else 0.0,
+            "eta_seconds": eta,
+            "report": {
+                key: len(value) if isinstance(value, list) else value
+                for key, value in report.items()
+            },
+            "error": self.error,
+        }
@@ -0,0 +1,103 @@
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # Windows 使用 msvcrt
+    fcntl = None
+    import msvcrt
+
+
+class IngestLock:
+    """
+    进程间互斥的写入锁：进程内可重入的线程锁 + 锁文件上的操作系统文件锁
+    （POSIX 为 fcntl.flock，Windows 为 msvcrt.locking）。
+
+    多个 Django worker、独立运行的 LogTailer 共用同一个向量库目录时，
+    同一时刻只有一个进程在同步、重建或追加写入；同一线程可以嵌套获取。
+    持有锁的进程退出时由操作系统释放文件锁，不会留下死锁。
+    """
+
+    def __init__(self, path: str, poll_interval: float = 0.1) -> None:
+        self.path = path
+        self.poll_interval = poll_interval
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """获取锁；blocking=False 时其他线程/进程持有锁则立即返回 False"""
+        if not self._lock.acquire(blocking):
+            return False
+        if self._depth == 0:
+            try:
+                locked = self._lock_file(blocking)
+            except BaseException:
+                self._lock.release()
+                raise
+            if not locked:
+                self._lock.release()
+                return False
+        self._depth += 1
+        return True
+
+    def release(self) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            self._unlock_file()
+        self._lock.release()
+
+    def __enter__(self) -> "IngestLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+    def _lock_file(self, blocking: bool) -> bool:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        f = open(self.path, "a+b")
+        try:
+            if fcntl is not None:
+                flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+                try:
+                    fcntl.flock(f.fileno(), flags)
+                except BlockingIOError:
+                    f.close()
+                    return False
+            else:
+                # msvcrt 的阻塞模式最多重试 10 秒，这里自行轮询
+                f.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        if not blocking:
+                            f.close()
+                            return False
+                        time.sleep(self.poll_interval)
+        except BaseException:
+            f.close()
+            raise
+        self._file = f
+        return True
+
+    def _unlock_file(self) -> None:
+        f, self._file = self._file, None
+        if f is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        except OSError as e:
+            logger.warning(f"释放锁文件失败 {self.path}: {e}")
+        finally:
+            f.close()
@@ -0,0 +1,185 @@
+import os
+import json
+import hashlib
+import logging
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class IngestManifest:
+    """
+    已入库文件清单，用于向量数据库的增量入库。
+
+    以相对于知识库根目录的路径为键，记录每个文件入库时的 size / mtime / sha256。
+    扫描时先比较 size 和 mtime，只有两者变化时才计算内容哈希，
+    避免 touch 之类不改变内容的操作触发重新嵌入。
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.files: Dict[str, Dict] = {}
+        # 入库时使用的解析选项；选项变化后已入库文件需要重新解析
+        self.options: Dict = {}
+        # scan() 计算出的新条目，commit() 之后才写入 files
+        self._pending: Dict[str, Dict] = {}
+        # 最近一次读取/写入时清单文件的 (mtime_ns, size)，用于发现其他进程的更新
+        self._stamp: Optional[Tuple[int, int]] = None
+
+    @classmethod
+    def load(cls, path: str) -> "IngestManifest":
+        manifest = cls(path)
+        if not os.path.exists(path):
+            return manifest
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            manifest.files = data.get("files", {})
+            manifest.options = data.get("options", {})
+        except Exception as e:
+            logger.error(f"读取入库清单失败 {path}: {e}，将按空清单处理")
+        manifest._stamp = manifest._file_stamp()
+        return manifest
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def changed_on_disk(self) -> bool:
+        """清单文件在本对象最近一次读取/写入之后被（其他进程）修改过"""
+        return self._file_stamp() != self._stamp
+
+    def save(self) -> None:
+        """原子写入：先写临时文件再替换，避免进程中断导致清单损坏"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": self.VERSION,
+                    "options": self.options,
+                    "files": self.files,
+                },
+                f,
+                ensure_ascii=False,
+                indent=1,
+            )
+        os.replace(tmp_path, self.path)
+        self._stamp = self._file_stamp()
+
+    @staticmethod
+    def file_hash(file_path: str, block_size: int = 1 << 20) -> str:
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            while block := f.read(block_size):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _stat_entry(file_path: str) -> Dict:
+        stat = os.stat(file_path)
+        return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+    def scan(
+        self, root: str, rel_paths: List[str], force: bool = False
+    ) -> Dict[str, List[str]]:
+        """
+        对比当前文件列表与清单，返回 added / modified / removed / unchanged 四类相对路径。
+        :param force: 为 True 时所有已入库文件都视为已变更（解析选项变化时使用）
+        """
+        self._pending = {}
+        diff: Dict[str, List[str]] = {
+            "added": [],
+            "modified": [],
+            "removed": [],
+            "unchanged": [],
+        }
+        for rel_path in rel_paths:
+            file_path = os.path.join(root, rel_path)
+            try:
+                entry = self._stat_entry(file_path)
+            except OSError as e:
+                logger.error(f"读取文件状态失败 {file_path}: {e}")
+                continue
+
+            old = self.files.get(rel_path)
+            if old is None:
+                entry["sha256"] = self.file_hash(file_path)
+                self._pending[rel_path] = entry
+                diff["added"].append(rel_path)
+                continue
+
+            if (
+                not force
+                and old.get("size") == entry["size"]
+                and old.get("mtime") == entry["mtime"]
+            ):
+                diff["unchanged"].append(rel_path)
+                continue
+
+            entry["sha256"] = self.file_hash(file_path)
+            if not force and entry["sha256"] == old.get("sha256"):
+                # 内容未变，只刷新 mtime
+                self.files[rel_path] = entry
+                diff["unchanged"].append(rel_path)
+            else:
+                self._pending[rel_path] = entry
+                diff["modified"].append(rel_path)
+
+        current = set(rel_paths)
+        diff["removed"] = sorted(p for p in self.files if p not in current)
+        return diff
+
+    def match_renames(self, diff: Dict[str, List[str]]) -> List[Tuple[str, str]]:
+        """
+        按内容哈希匹配改名的文件（如日志轮转 app.log → app.log.1 → app.log.2）：
+        新增/变更文件的当前内容与某个已移除/已变更文件入库时的内容相同。
+        返回 (旧路径, 新路径)，旧路径的向量可以直接改到新路径名下，不必重新嵌入。
+        """
+        by_hash: Dict[str, List[str]] = {}
+        for rel_path in diff["removed"] + diff["modified"]:
+            sha256 = self.files.get(rel_path, {}).get("sha256")
+            if sha256:
+                by_hash.setdefault(sha256, []).append(rel_path)
+        renames: List[Tuple[str, str]] = []
+        for rel_path in diff["added"] + diff["modified"]:
+            entry = self._pending.get(rel_path)
+            candidates = by_hash.get(entry["sha256"], []) if entry else []
+            old = next((p for p in candidates if p != rel_path), None)
+            if old is not None:
+                candidates.remove(old)
+                renames.append((old, rel_path))
+        return renames
+
+    def rename(self, old: str, new: str) -> None:
+        """
+        旧路径的向量已改到新路径名下：新路径按 scan() 计算的条目记为已入库，
+        旧路径移出清单（旧路径自身也有变更时，其待入库条目保留）
+        """
+        entry = self._pending.pop(new, None)
+        if entry is not None:
+            self.files[new] = entry
+        self.files.pop(old, None)
+
+    def pending(self, rel_path: str) -> Optional[Dict]:
+        """scan() 为新增/变更文件计算的、尚未提交的条目"""
+        return self._pending.get(rel_path)
+
+    def commit(self, rel_path: str, entry: Optional[Dict] = None) -> None:
+        """将文件标记为已入库（使用 scan() 时计算的条目）"""
+        entry = entry or self._pending.pop(rel_path, None)
+        if entry is None:
+            return
+        self.files[rel_path] = entry
+
+    def forget(self, rel_path: str) -> None:
+        self.files.pop(rel_path, None)
+        self._pending.pop(rel_path, None)
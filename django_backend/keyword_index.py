@@ -0,0 +1,553 @@
+import os
+import math
+import json
+import heapq
+import mmap
+import shutil
+import bisect
+import logging
+import threading
+from array import array
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from keyword_tokenizer import KeywordTokenizer
+from segment_merge import tiered_merge_groups
+
+logger = logging.getLogger(__name__)
+
+# 索引格式版本，写入 ingest_options；格式或分词规则变化时递增，已入库文件会重新解析
+KEYWORD_INDEX_VERSION = 2
+
+
+def _map_array(path: str, typecode: str):
+    """把二进制数组文件 mmap 为只读 memoryview；空文件返回空数组"""
+    if not os.path.getsize(path):
+        return None, memoryview(array(typecode)).toreadonly()
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return mapped, memoryview(mapped).cast(typecode)
+
+
+class KeywordSegment:
+    """
+    不可变的索引段，文件（seg_N.*）写入后不再修改，删除通过墓碑文件记录：
+    - seg_N.json：词典 {term: [起始下标, 文档数]}、来源/知识库 → 文档号区间、文档数
+    - seg_N.post：倒排表，uint32 的 (段内文档号, 词频) 对，按词依次排列
+    - seg_N.lens：每个文档的词数（uint32），BM25 长度归一化使用
+    - seg_N.docs / seg_N.dix：文档记录（JSON 行）及其字节偏移（uint64）
+    - seg_N.del：已删除的段内文档号（JSON 数组）
+    来源改名（日志轮转）时只重写 seg_N.json 中的来源 → 文档号区间，
+    文档记录中的来源在读取时按文档号改为当前来源。
+    """
+
+    def __init__(self, directory: str, segment_id: int) -> None:
+        self.directory = directory
+        self.segment_id = segment_id
+        with open(self.path("json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.terms: Dict[str, List[int]] = meta["terms"]
+        self.sources: Dict[str, List[List[int]]] = meta["sources"]
+        self.doc_count: int = meta["doc_count"]
+        # [[起始文档号, 结束文档号, 知识库], ...]，按文档号排列
+        self.kb_ranges: List[List[Any]] = meta["kb_ranges"]
+        self._kb_starts = [start for start, _, _ in self.kb_ranges]
+        self._index_sources()
+        self.deleted: Set[int] = set()
+        if os.path.exists(self.path("del")):
+            with open(self.path("del"), "r", encoding="utf-8") as f:
+                self.deleted = set(json.load(f))
+        self._maps = []
+        self.postings = self._map("post", "I")
+        self.lengths = self._map("lens", "I")
+        self.doc_offsets = self._map("dix", "Q")
+        self.doc_data = self._map("docs", "B")
+        total_length = meta.get("total_length")
+        if total_length is None:
+            total_length = sum(self.lengths)
+        self.total_length: int = total_length
+        self.deleted_length = sum(self.lengths[doc_no] for doc_no in self.deleted)
+
+    def _index_sources(self) -> None:
+        self._source_ranges = sorted(
+            (start, end, source)
+            for source, ranges in self.sources.items()
+            for start, end in ranges
+        )
+        self._source_starts = [start for start, _, _ in self._source_ranges]
+
+    def _map(self, ext: str, typecode: str):
+        mapped, view = _map_array(self.path(ext), typecode)
+        self._maps.append((mapped, view))
+        return view
+
+    def path(self, ext: str) -> str:
+        return os.path.join(self.directory, f"seg_{self.segment_id}.{ext}")
+
+    @property
+    def live_count(self) -> int:
+        return self.doc_count - len(self.deleted)
+
+    @property
+    def live_length(self) -> int:
+        return self.total_length - self.deleted_length
+
+    def postings_for(self, term: str) -> Iterable[Tuple[int, int]]:
+        entry = self.terms.get(term)
+        if entry is None:
+            return []
+        start, count = entry
+        pairs = self.postings[start * 2 : (start + count) * 2]
+        return zip(pairs[0::2], pairs[1::2])
+
+    def doc(self, doc_no: int) -> Dict[str, Any]:
+        start, end = self.doc_offsets[doc_no], self.doc_offsets[doc_no + 1]
+        doc = json.loads(bytes(self.doc_data[start:end]))
+        position = bisect.bisect_right(self._source_starts, doc_no) - 1
+        if position >= 0 and doc_no < self._source_ranges[position][1]:
+            source = self._source_ranges[position][2]
+            doc["source"] = source
+            doc["metadata"]["source"] = source
+        return doc
+
+    def kb_of(self, doc_no: int) -> str:
+        position = bisect.bisect_right(self._kb_starts, doc_no) - 1
+        return self.kb_ranges[position][2]
+
+    def delete_source(self, source: str) -> bool:
+        """把来源的全部文档加入墓碑；返回是否有变化"""
+        before = len(self.deleted)
+        for start, end in self.sources.get(source, []):
+            for doc_no in range(start, end):
+                if doc_no not in self.deleted:
+                    self.deleted.add(doc_no)
+                    self.deleted_length += self.lengths[doc_no]
+        if len(self.deleted) == before:
+            return False
+        tmp_path = f"{self.path('del')}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(sorted(self.deleted), f)
+        os.replace(tmp_path, self.path("del"))
+        return True
+
+    def rename_source(self, old: str, new: str) -> bool:
+        """把来源 old 的文档号区间改到 new 名下；返回是否有变化"""
+        ranges = self.sources.pop(old, None)
+        if not ranges:
+            return False
+        self.sources[new] = sorted(self.sources.get(new, []) + ranges)
+        self._index_sources()
+        with open(self.path("json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        meta["sources"] = self.sources
+        tmp_path = f"{self.path('json')}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path("json"))
+        return True
+
+    def close(self) -> None:
+        for mapped, view in self._maps:
+            view.release()
+            if mapped is not None:
+                mapped.close()
+        self._maps.clear()
+
+    def remove_files(self) -> None:
+        self.close()
+        for ext in ("json", "post", "lens", "docs", "dix", "del"):
+            if os.path.exists(self.path(ext)):
+                os.remove(self.path(ext))
+
+
+class KeywordIndex:
+    """
+    持久化的关键词倒排索引（词 → 文档倒排表），用于混合检索的关键词通道。
+
+    采用分段结构：add() 的文档先在内存中攒到 buffer_docs 条（或调用 flush()）
+    再写成一个不可变的段，倒排表以 mmap 读取，查询只访问查询词的倒排表，
+    与语料规模无关；缓冲中的文档在 flush() 后才能被检索到。
+    段按大小分层合并（见 segment_merge），同一层攒满 merge_factor 个段时合并，
+    删除写墓碑，段内删除比例过高时单独重写以清除已删除文档。
+    index.json 记录当前有效的段，段文件全部写完后才原子替换 index.json，
+    进程中断时未登记的段文件在下次写入时清理。
+    多个进程共用索引目录时，写入由调用方的进程间锁串行化（见 IngestLock）；
+    写入前和查询前检查 index.json，其他进程更新后重新加载段列表。
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        merge_factor: int = 8,
+        buffer_docs: int = 16384,
+        max_deleted_ratio: float = 0.5,
+        k1: float = 1.2,
+        b: float = 0.75,
+        tokenizer: Optional[KeywordTokenizer] = None,
+    ) -> None:
+        self.directory = directory
+        # 入库和查询共用同一个分词器
+        self.tokenizer = tokenizer or KeywordTokenizer()
+        # BM25 参数：k1 控制词频饱和速度，b 控制文档长度归一化强度
+        self.k1 = k1
+        self.b = b
+        self.merge_factor = max(2, merge_factor)
+        self.buffer_docs = max(1, buffer_docs)
+        self.max_deleted_ratio = max_deleted_ratio
+        self._lock = threading.RLock()
+        self._segments: List[KeywordSegment] = []
+        # 尚未写成段的记录
+        self._buffer: List[Dict[str, Any]] = []
+        self._next_segment = 0
+        # 最近一次加载/写入时 index.json 的 (mtime_ns, size)
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._orphans_removed = False
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, "index.json")
+
+    def _index_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self._index_path())
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _refresh(self) -> None:
+        """index.json 被其他进程更新后重新加载段列表"""
+        if self._index_stamp() == self._stamp:
+            return
+        for segment in self._segments:
+            segment.close()
+        self._segments = []
+        self._load()
+
+    def _load(self) -> None:
+        self._stamp = self._index_stamp()
+        segment_ids: List[int] = []
+        try:
+            with open(self._index_path(), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == KEYWORD_INDEX_VERSION:
+                segment_ids = data["segments"]
+                self._next_segment = data["next_segment"]
+            else:
+                logger.warning("关键词索引格式版本不一致，丢弃旧索引。")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"读取关键词索引失败 {self.directory}: {e}，将按空索引处理")
+
+        for segment_id in segment_ids:
+            try:
+                self._segments.append(KeywordSegment(self.directory, segment_id))
+            except Exception as e:
+                logger.error(f"加载关键词索引段失败 seg_{segment_id}: {e}")
+        self._next_segment = max(
+            [self._next_segment] + [s.segment_id + 1 for s in self._segments]
+        )
+
+    def _prepare_write(self) -> None:
+        """
+        写入前加载其他进程的更新；第一次写入时清理未登记的段文件（写入中途退出或
+        合并后遗留）。只在持有写入锁时清理，不会误删其他进程正在写的段。
+        """
+        self._refresh()
+        if self._orphans_removed:
+            return
+        active = {f"seg_{segment.segment_id}" for segment in self._segments}
+        for name in os.listdir(self.directory):
+            if name.startswith("seg_") and name.split(".", 1)[0] not in active:
+                os.remove(os.path.join(self.directory, name))
+        self._orphans_removed = True
+
+    def _save(self) -> None:
+        tmp_path = f"{self._index_path()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": KEYWORD_INDEX_VERSION,
+                    "next_segment": self._next_segment,
+                    "segments": [s.segment_id for s in self._segments],
+                },
+                f,
+            )
+        os.replace(tmp_path, self._index_path())
+        self._stamp = self._index_stamp()
+
+    def _write_segment(
+        self, docs: List[Dict[str, Any]], term_postings: Dict[str, array]
+    ) -> KeywordSegment:
+        """
+        写出一个新段。docs 为文档记录（含 "source"，按段内文档号排列，"length" 为词数），
+        term_postings 为词 → (段内文档号, 词频) 交错数组。
+        """
+        segment_id = self._next_segment
+        self._next_segment += 1
+
+        def path(ext: str) -> str:
+            return os.path.join(self.directory, f"seg_{segment_id}.{ext}")
+
+        terms: Dict[str, List[int]] = {}
+        postings = array("I")
+        for term in sorted(term_postings):
+            pairs = term_postings[term]
+            terms[term] = [len(postings) // 2, len(pairs) // 2]
+            postings.extend(pairs)
+
+        sources: Dict[str, List[List[int]]] = {}
+        kb_ranges: List[List[Any]] = []
+        lengths = array("I")
+        offsets = array("Q", [0])
+        with open(path("docs"), "wb") as f:
+            for doc_no, doc in enumerate(docs):
+                ranges = sources.setdefault(doc["source"], [])
+                if ranges and ranges[-1][1] == doc_no:
+                    ranges[-1][1] = doc_no + 1
+                else:
+                    ranges.append([doc_no, doc_no + 1])
+                if kb_ranges and kb_ranges[-1][2] == doc["kb"]:
+                    kb_ranges[-1][1] = doc_no + 1
+                else:
+                    kb_ranges.append([doc_no, doc_no + 1, doc["kb"]])
+                lengths.append(doc["length"])
+                line = json.dumps(doc, ensure_ascii=False, default=str) + "\n"
+                f.write(line.encode("utf-8"))
+                offsets.append(f.tell())
+        for ext, values in (("post", postings), ("lens", lengths), ("dix", offsets)):
+            with open(path(ext), "wb") as f:
+                values.tofile(f)
+        with open(path("json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "doc_count": len(docs),
+                    "terms": terms,
+                    "sources": sources,
+                    "kb_ranges": kb_ranges,
+                    "total_length": sum(lengths),
+                },
+                f,
+                ensure_ascii=False,
+            )
+        return KeywordSegment(self.directory, segment_id)
+
+    def add(self, records: List[Dict[str, Any]]) -> None:
+        """
+        写入一批文档（先进入缓冲，攒满 buffer_docs 条时写成一个段），每条记录为：
+        {"id": 节点 id, "kb": 知识库, "source": 来源文件, "text": 索引的原文,
+         "stored_text": 检索结果中返回的文本（懒加载时为空）, "metadata": 元数据}
+        """
+        if not records:
+            return
+        with self._lock:
+            self._buffer.extend(records)
+            if len(self._buffer) >= self.buffer_docs:
+                self.flush()
+
+    def flush(self) -> None:
+        """把缓冲中的文档写成一个段；入库清单保存前、追加写入后调用"""
+        with self._lock:
+            records, self._buffer = self._buffer, []
+            if not records:
+                return
+            self._prepare_write()
+            self._segments.append(self._build_segment(records))
+            self._save()
+            self._maybe_compact()
+
+    def _build_segment(self, records: List[Dict[str, Any]]) -> KeywordSegment:
+        docs: List[Dict[str, Any]] = []
+        term_postings: Dict[str, array] = {}
+        for doc_no, record in enumerate(records):
+            counts = Counter(self.tokenizer.tokenize(record["text"]))
+            for term, tf in counts.items():
+                term_postings.setdefault(term, array("I")).extend((doc_no, tf))
+            docs.append(
+                {
+                    "id": record["id"],
+                    "kb": record["kb"],
+                    "source": record["source"],
+                    "text": record.get("stored_text", record["text"]),
+                    "metadata": record["metadata"],
+                    "length": sum(counts.values()),
+                }
+            )
+        return self._write_segment(docs, term_postings)
+
+    def delete_source(self, source: str) -> None:
+        with self._lock:
+            self._buffer = [r for r in self._buffer if r["source"] != source]
+            self._prepare_write()
+            changed = [s for s in self._segments if s.delete_source(source)]
+            if changed:
+                # 墓碑不改变段列表，同样重写 index.json，其他进程据此重新加载
+                self._save()
+                self._maybe_compact()
+
+    def rename_source(self, old: str, new: str) -> None:
+        with self._lock:
+            self._buffer = [
+                (
+                    dict(r, source=new, metadata=dict(r["metadata"], source=new))
+                    if r["source"] == old
+                    else r
+                )
+                for r in self._buffer
+            ]
+            self._prepare_write()
+            changed = [s for s in self._segments if s.rename_source(old, new)]
+            if changed:
+                self._save()
+
+    def _maybe_compact(self) -> None:
+        """
+        删除比例过高的段单独重写以回收空间；之后按分层计划合并大小相近的段，
+        合并结果进入上一层后可能再次触发合并。
+        """
+        for segment in list(self._segments):
+            if (
+                segment.doc_count
+                and len(segment.deleted) / segment.doc_count >= self.max_deleted_ratio
+            ):
+                self._merge([segment])
+        while True:
+            groups = tiered_merge_groups(
+                [s.live_count for s in self._segments],
+                self.merge_factor,
+                self.buffer_docs,
+            )
+            if not groups:
+                return
+            self._merge([self._segments[position] for position in groups[0]])
+
+    def _merge(self, segments: List[KeywordSegment]) -> None:
+        docs: List[Dict[str, Any]] = []
+        term_postings: Dict[str, array] = {}
+        for segment in segments:
+            # 旧文档号 → 新文档号，已删除的文档丢弃
+            remap: Dict[int, int] = {}
+            for doc_no in range(segment.doc_count):
+                if doc_no in segment.deleted:
+                    continue
+                remap[doc_no] = len(docs)
+                docs.append(segment.doc(doc_no))
+            if not remap:
+                continue
+            for term in segment.terms:
+                for doc_no, tf in segment.postings_for(term):
+                    if doc_no in remap:
+                        term_postings.setdefault(term, array("I")).extend(
+                            (remap[doc_no], tf)
+                        )
+
+        merged = self._write_segment(docs, term_postings) if docs else None
+        position = min(self._segments.index(s) for s in segments)
+        remaining = [s for s in self._segments if s not in segments]
+        if merged is not None:
+            remaining.insert(position, merged)
+        self._segments = remaining
+        self._save()
+        for segment in segments:
+            segment.remove_files()
+        logger.info(
+            f"关键词索引合并 {len(segments)} 个段 → {1 if merged else 0} 个，"
+            f"保留文档 {len(docs)} 条"
+        )
+
+    def search(
+        self,
+        query: str,
+        knowledge_bases: Optional[Set[str]] = None,
+        limit: int = 10,
+    ) -> List[Dict[str, Any]]:
+        """
+        BM25 检索，返回得分最高的 limit 个文档（"score" 为 BM25 分，
+        "matched_terms" 为命中的查询词数）。
+        文档频率和平均文档长度按全部未删除文档统计，不受知识库限制影响。
+        :param knowledge_bases: 只返回这些知识库的文档，None 表示不限
+        """
+        terms = set(self.tokenizer.tokenize(query))
+        if not terms or limit <= 0:
+            return []
+        with self._lock:
+            self._refresh()
+            doc_total = sum(s.live_count for s in self._segments)
+            if not doc_total:
+                return []
+            avg_length = sum(s.live_length for s in self._segments) / doc_total
+
+            # 1. 读取查询词的倒排表，统计文档频率
+            document_frequency: Counter = Counter()
+            segment_hits = []
+            for segment in self._segments:
+                term_hits: Dict[str, List[Tuple[int, int]]] = {}
+                for term in terms:
+                    pairs = [
+                        (doc_no, tf)
+                        for doc_no, tf in segment.postings_for(term)
+                        if doc_no not in segment.deleted
+                    ]
+                    if pairs:
+                        term_hits[term] = pairs
+                        document_frequency[term] += len(pairs)
+                segment_hits.append((segment, term_hits))
+            idf = {
+                term: math.log(1 + (doc_total - df + 0.5) / (df + 0.5))
+                for term, df in document_frequency.items()
+            }
+
+            # 2. 累加各查询词的 BM25 分
+            scored: List[Tuple[float, int, KeywordSegment, int]] = []
+            for segment, term_hits in segment_hits:
+                scores: Dict[int, List[float]] = {}
+                for term, pairs in term_hits.items():
+                    for doc_no, tf in pairs:
+                        if (
+                            knowledge_bases is not None
+                            and segment.kb_of(doc_no) not in knowledge_bases
+                        ):
+                            continue
+                        length = segment.lengths[doc_no]
+                        norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                        hit = scores.setdefault(doc_no, [0.0, 0])
+                        hit[0] += idf[term] * tf * (self.k1 + 1) / (tf + norm)
+                        hit[1] += 1
+                scored.extend(
+                    (score, matched, segment, doc_no)
+                    for doc_no, (score, matched) in scores.items()
+                )
+
+            results = []
+            for score, matched, segment, doc_no in heapq.nlargest(
+                limit, scored, key=lambda item: item[0]
+            ):
+                doc = segment.doc(doc_no)
+                doc["score"] = score
+                doc["matched_terms"] = matched
+                results.append(doc)
+            return results
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            self._refresh()
+            return {
+                "segments": len(self._segments),
+                "documents": sum(s.live_count for s in self._segments),
+                "deleted": sum(len(s.deleted) for s in self._segments),
+                "buffered": len(self._buffer),
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            for segment in self._segments:
+                segment.close()
+            self._segments = []
+
+    def drop(self) -> None:
+        """删除整个索引目录"""
+        with self._lock:
+            self._buffer = []
+        self.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,65 @@
+import re
+import hashlib
+from typing import FrozenSet, Iterable, List, Tuple
+
+# 中日韩文字：假名、CJK 统一表意文字（含扩展 A、兼容区）、韩文音节
+CJK_RANGES = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+CJK_RUN = re.compile(rf"[{CJK_RANGES}]+")
+# 连续的 CJK 文字，或连续的其他单词字符（英文、数字、下划线）
+TOKEN_PATTERN = re.compile(rf"[{CJK_RANGES}]+|[^\W{CJK_RANGES}]+")
+
+
+class KeywordTokenizer:
+    """
+    关键词索引的中英文混合分词器，入库和查询必须使用同一个实例（同一套规则）。
+
+    - 英文/数字：小写后按单词切分，丢弃单个 ASCII 字符；
+    - 中文等 CJK 文字：输出字符二元组（"数据库连接" → 数据/据库/库连/连接），
+      单字成段时输出单字；
+    - 领域词典（同义词、术语表中的中文词）：在 CJK 片段中出现的词条额外作为整词输出，
+      使 "数据库" 这类三字以上的术语整体命中，得分高于零散的二元组。
+
+    词典只增加额外的整词，二元组不受影响；词典变化后已入库文档仍能按二元组命中。
+    """
+
+    def __init__(self, terms: Iterable[str] = ()) -> None:
+        self._dictionary: Tuple[FrozenSet[str], int] = (frozenset(), 0)
+        self.set_terms(terms)
+
+    def set_terms(self, terms: Iterable[str]) -> None:
+        """设置领域词典；词条中的 CJK 片段（两个字以上）作为词"""
+        words = set()
+        for term in terms:
+            words.update(
+                run for run in CJK_RUN.findall(term.lower()) if len(run) >= 2
+            )
+        # 词典和最大词长一起替换，分词时取快照，不需要加锁
+        self._dictionary = (frozenset(words), max(map(len, words), default=0))
+
+    def dictionary_digest(self) -> str:
+        """领域词典的摘要，写入入库选项：词典变化后已入库文档按新词典重新分词"""
+        words = "\n".join(sorted(self._dictionary[0]))
+        return hashlib.md5(words.encode("utf-8")).hexdigest()[:16]
+
+    def tokenize(self, text: str) -> List[str]:
+        tokens: List[str] = []
+        for run in TOKEN_PATTERN.findall(text.lower()):
+            if not CJK_RUN.match(run):
+                if len(run) > 1 or not run.isascii():
+                    tokens.append(run)
+            elif len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i : i + 2] for i in range(len(run) - 1))
+                tokens.extend(self._dictionary_words(run))
+        return tokens
+
+    def _dictionary_words(self, run: str) -> List[str]:
+        words, max_length = self._dictionary
+        found = []
+        # 两字词与二元组相同，只需查找三字以上的词条
+        for start in range(len(run) - 2):
+            for end in range(start + 3, min(len(run), start + max_length) + 1):
+                if run[start:end] in words:
+                    found.append(run[start:end])
+        return found
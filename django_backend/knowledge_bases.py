@@ -0,0 +1,747 @@
+import os
+import re
+import json
+import math
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Set
+
+import numpy as np
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+from llama_index.vector_stores.chroma import ChromaVectorStore
+
+from flat_index import FlatVectorIndex
+from keyword_index import KeywordIndex
+from keyword_tokenizer import KeywordTokenizer
+from time_index import TimeIndex
+
+logger = logging.getLogger(__name__)
+
+# 集合 metadata 中保存知识库名的键
+KB_METADATA_KEY = "knowledge_base"
+# 支持的向量后端，见 KnowledgeBaseStore / FlatKnowledgeBaseStore
+VECTOR_BACKENDS = ("chroma", "flat")
+# 来源改名时每次从 Chroma 读取、更新的记录数
+RENAME_BATCH_SIZE = 1000
+
+
+def knowledge_base_of(source: str, depth: int) -> str:
+    """文件相对路径 → 知识库名（前 depth 级目录）；根目录下的文件归入空知识库"""
+    parts = source.split("/")[:-1]
+    return "/".join(parts[:depth])
+
+
+class VectorHit(NamedTuple):
+    """向量检索的一条结果，与具体后端无关"""
+
+    node_id: str
+    text: str
+    metadata: Dict[str, Any]
+    score: float
+
+
+class BaseKnowledgeBaseStore:
+    """
+    按知识库（log_path 下前 depth 级目录，如 "数据库类/mysql"）拆分的向量存储基类。
+
+    子类实现向量的写入、删除和批量检索（_add_vectors / _delete_vectors / search 等），
+    按来源分组、关键词倒排索引和写入版本由基类统一维护，入库流程与后端无关。
+    prefix 在每次全量重建时更换，便于整体切换。
+    keyword_dir / time_dir 不为空时同时维护关键词倒排索引 / 按来源的时间戳索引，
+    与向量一起写入、删除和切换。
+    """
+
+    # 写入 active_collection.json 的后端名和向量压缩方式
+    backend = ""
+    quantization: Optional[str] = None
+
+    def __init__(
+        self,
+        prefix: str,
+        depth: int = 2,
+        legacy_name: Optional[str] = None,
+        keyword_dir: Optional[str] = None,
+        tokenizer: Optional[KeywordTokenizer] = None,
+        time_dir: Optional[str] = None,
+    ) -> None:
+        self.prefix = prefix
+        self.depth = depth
+        self.legacy_name = legacy_name
+        self._lock = threading.Lock()
+        # 写入版本：每次写入、删除后递增，检索结果缓存以 (prefix, version) 判断是否失效
+        self.version = 0
+        self.keywords = (
+            KeywordIndex(keyword_dir, tokenizer=tokenizer) if keyword_dir else None
+        )
+        self.times = TimeIndex(time_dir) if time_dir else None
+
+    @property
+    def is_legacy(self) -> bool:
+        return bool(self.legacy_name)
+
+    def knowledge_base_of(self, source: str) -> str:
+        return "" if self.is_legacy else knowledge_base_of(source, self.depth)
+
+    def knowledge_bases(self) -> List[str]:
+        raise NotImplementedError
+
+    def refresh(self) -> None:
+        """其他进程写入后调用：重新加载知识库列表，使检索结果缓存失效"""
+        self.version += 1
+
+    def counts(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    def count(self) -> int:
+        return sum(self.counts().values())
+
+    def index_stats(self) -> Dict[str, Dict[str, Any]]:
+        """各知识库的向量索引统计（行数，后端支持时还有压缩方式和占用字节数）"""
+        return {kb: {"rows": count} for kb, count in self.counts().items()}
+
+    def search(
+        self,
+        kb: str,
+        embeddings: Sequence[Sequence[float]],
+        top_k: int,
+        where: Optional[Dict[str, Any]] = None,
+    ) -> List[List[VectorHit]]:
+        """
+        在一个知识库中批量检索，每个查询向量返回按得分降序的最多 top_k 条结果；
+        知识库不存在时每个查询返回空列表。
+        :param where: Chroma 风格的元数据过滤条件，见 log_metadata.build_where
+        """
+        raise NotImplementedError
+
+    def search_ids(
+        self,
+        kb: str,
+        embeddings: Sequence[Sequence[float]],
+        ids: Sequence[str],
+        top_k: int,
+        where: Optional[Dict[str, Any]] = None,
+    ) -> List[List[VectorHit]]:
+        """只在给定节点（如时间索引圈定的候选）中精确检索，得分与 search 一致"""
+        raise NotImplementedError
+
+    def embeddings(self, kb: str, ids: List[str]) -> Dict[str, List[float]]:
+        """按节点 id 读取已入库的向量（MMR 重排使用），不存在的 id 不返回"""
+        raise NotImplementedError
+
+    def documents(self, kb: str, ids: List[str]) -> Dict[str, VectorHit]:
+        """按节点 id 读取文本和元数据（score 为 0），不存在的 id 不返回"""
+        raise NotImplementedError
+
+    def _existing_ids(self, kb: str, ids: List[str]) -> Set[str]:
+        raise NotImplementedError
+
+    def _add_vectors(self, kb: str, nodes: List) -> None:
+        raise NotImplementedError
+
+    def _delete_vectors(self, kb: str, source: str) -> None:
+        raise NotImplementedError
+
+    def _rename_vectors(self, kb: str, old: str, new: str) -> None:
+        raise NotImplementedError
+
+    def _drop_vectors(self) -> None:
+        raise NotImplementedError
+
+    def add(
+        self,
+        nodes: List,
+        texts: Optional[List[str]] = None,
+        occurrences: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        按节点的 source 元数据把节点（已带 embedding）写入各自的知识库。
+        :param texts: 节点原文，用于关键词索引（懒加载的节点文本已清空），默认取节点文本
+        :param occurrences: 节点 id → 模板每次出现的时间戳，只写入时间索引
+        """
+        occurrences = occurrences or {}
+        groups: Dict[str, List] = {}
+        for node in nodes:
+            kb = self.knowledge_base_of(node.metadata.get("source", ""))
+            groups.setdefault(kb, []).append(node)
+        for kb, group in groups.items():
+            self._add_vectors(kb, group)
+        self.version += 1
+        if texts is None:
+            texts = [node.get_content() for node in nodes]
+        records = [
+            {
+                "id": node.node_id,
+                "kb": self.knowledge_base_of(node.metadata.get("source", "")),
+                "source": node.metadata.get("source", ""),
+                "text": text,
+                "stored_text": node.get_content(),
+                "metadata": node.metadata,
+                "occurrences": occurrences.get(node.node_id),
+            }
+            for node, text in zip(nodes, texts)
+        ]
+        if self.keywords is not None:
+            self.keywords.add(records)
+        if self.times is not None:
+            self.times.add(records)
+
+    def flush(self) -> None:
+        """把关键词索引缓冲中的文档写入磁盘；一次入库结束、保存清单前调用"""
+        if self.keywords is not None:
+            self.keywords.flush()
+        self.version += 1
+
+    def existing_ids(self, nodes: List) -> Set[str]:
+        """节点中已写入（所属知识库内有相同 id）的节点 id，重复写入前据此去重"""
+        groups: Dict[str, List[str]] = {}
+        for node in nodes:
+            kb = self.knowledge_base_of(node.metadata.get("source", ""))
+            groups.setdefault(kb, []).append(node.node_id)
+        found: Set[str] = set()
+        for kb, ids in groups.items():
+            found |= self._existing_ids(kb, ids)
+        return found
+
+    def delete_source(self, source: str) -> None:
+        self._delete_vectors(self.knowledge_base_of(source), source)
+        self.version += 1
+        if self.keywords is not None:
+            self.keywords.delete_source(source)
+        if self.times is not None:
+            self.times.delete_source(source)
+
+    def rename_source(self, old: str, new: str) -> None:
+        """
+        文件改名（如日志轮转 app.log → app.log.1）：把 old 的向量和索引记录
+        改到 new 名下，不重新嵌入。只支持同一知识库内的改名。
+        """
+        kb = self.knowledge_base_of(old)
+        if kb != self.knowledge_base_of(new):
+            raise ValueError(f"不能跨知识库改名: {old} → {new}")
+        self._rename_vectors(kb, old, new)
+        self.version += 1
+        if self.keywords is not None:
+            self.keywords.rename_source(old, new)
+        if self.times is not None:
+            self.times.rename_source(old, new)
+
+    def drop(self) -> None:
+        """删除本布局下的全部向量、关键词索引和时间索引"""
+        with self._lock:
+            self._drop_vectors()
+            if self.keywords is not None:
+                self.keywords.drop()
+            if self.times is not None:
+                self.times.drop()
+
+
+class KnowledgeBaseStore(BaseKnowledgeBaseStore):
+    """
+    Chroma 后端：每个知识库一个集合。
+
+    Chroma 集合名只允许 ASCII，集合名取 {prefix}_{md5(知识库名)[:12]}，
+    知识库名保存在集合 metadata 中。
+    legacy_name 不为空时是旧版本的单集合布局：所有文件共用这一个集合。
+    """
+
+    backend = "chroma"
+
+    def __init__(
+        self,
+        client,
+        prefix: str,
+        depth: int = 2,
+        legacy_name: Optional[str] = None,
+        keyword_dir: Optional[str] = None,
+        tokenizer: Optional[KeywordTokenizer] = None,
+        time_dir: Optional[str] = None,
+    ) -> None:
+        super().__init__(prefix, depth, legacy_name, keyword_dir, tokenizer, time_dir)
+        self.client = client
+        self._collections: Dict[str, Any] = {}
+        self._vector_stores: Dict[str, ChromaVectorStore] = {}
+        if legacy_name:
+            self._collections[""] = client.get_collection(legacy_name)
+        else:
+            self._list_collections()
+
+    def _list_collections(self) -> None:
+        for collection in self.client.list_collections():
+            if collection.name.startswith(f"{self.prefix}_"):
+                kb = (collection.metadata or {}).get(KB_METADATA_KEY, "")
+                self._collections.setdefault(kb, collection)
+
+    def refresh(self) -> None:
+        # 其他进程新建的知识库集合
+        if not self.is_legacy:
+            with self._lock:
+                self._list_collections()
+        super().refresh()
+
+    def collection_name(self, kb: str) -> str:
+        digest = hashlib.md5(kb.encode("utf-8")).hexdigest()[:12]
+        return f"{self.prefix}_{digest}"
+
+    def knowledge_bases(self) -> List[str]:
+        return sorted(self._collections)
+
+    def collection(self, kb: str, create: bool = False):
+        with self._lock:
+            if self.is_legacy:
+                return self._collections[""]
+            collection = self._collections.get(kb)
+            if collection is None and create:
+                collection = self.client.get_or_create_collection(
+                    self.collection_name(kb), metadata={KB_METADATA_KEY: kb}
+                )
+                self._collections[kb] = collection
+            return collection
+
+    def vector_store(self, kb: str) -> ChromaVectorStore:
+        vector_store = self._vector_stores.get(kb)
+        if vector_store is None:
+            vector_store = ChromaVectorStore(
+                chroma_collection=self.collection(kb, create=True)
+            )
+            self._vector_stores[kb] = vector_store
+        return vector_store
+
+    def search(
+        self,
+        kb: str,
+        embeddings: Sequence[Sequence[float]],
+        top_k: int,
+        where: Optional[Dict[str, Any]] = None,
+    ) -> List[List[VectorHit]]:
+        collection = self.collection(kb)
+        if collection is None or not embeddings:
+            return [[] for _ in embeddings]
+        # 全部查询向量一次 collection.query，不再逐条经过 LlamaIndex 检索器
+        data = collection.query(
+            query_embeddings=[list(embedding) for embedding in embeddings],
+            n_results=top_k,
+            where=where or None,
+            include=["documents", "metadatas", "distances"],
+        )
+        return [
+            [
+                self._to_hit(node_id, text, metadata, distance)
+                for node_id, text, metadata, distance in zip(*columns)
+            ]
+            for columns in zip(
+                data["ids"], data["documents"], data["metadatas"], data["distances"]
+            )
+        ]
+
+    def search_ids(
+        self,
+        kb: str,
+        embeddings: Sequence[Sequence[float]],
+        ids: Sequence[str],
+        top_k: int,
+        where: Optional[Dict[str, Any]] = None,
+    ) -> List[List[VectorHit]]:
+        collection = self.collection(kb)
+        if collection is None or not ids:
+            return [[] for _ in embeddings]
+        data = collection.get(
+            ids=list(ids),
+            where=where or None,
+            include=["embeddings", "documents", "metadatas"],
+        )
+        if not data["ids"]:
+            return [[] for _ in embeddings]
+        # 候选集较小，读出向量后在内存中按集合的距离度量计算，换算方式与 search 相同
+        space = (collection.metadata or {}).get("hnsw:space", "l2")
+        distances = self._distances(
+            np.asarray(embeddings, dtype=np.float32),
+            np.asarray(data["embeddings"], dtype=np.float32),
+            space,
+        )
+        return [
+            [
+                self._to_hit(
+                    data["ids"][j],
+                    data["documents"][j],
+                    data["metadatas"][j],
+                    float(row[j]),
+                )
+                for j in np.argsort(row)[:top_k]
+            ]
+            for row in distances
+        ]
+
+    @staticmethod
+    def _distances(queries: np.ndarray, vectors: np.ndarray, space: str) -> np.ndarray:
+        """与 Chroma 相同的距离：l2 为欧氏距离的平方，cosine / ip 为 1 - 相似度"""
+        if space == "cosine":
+            queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+            vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+            return 1.0 - queries @ vectors.T
+        if space == "ip":
+            return 1.0 - queries @ vectors.T
+        return (
+            (queries**2).sum(axis=1)[:, None]
+            + (vectors**2).sum(axis=1)[None, :]
+            - 2.0 * queries @ vectors.T
+        )
+
+    def documents(self, kb: str, ids: List[str]) -> Dict[str, VectorHit]:
+        collection = self.collection(kb)
+        if collection is None or not ids:
+            return {}
+        data = collection.get(ids=list(ids), include=["documents", "metadatas"])
+        return {
+            node_id: self._to_hit(node_id, text, metadata, 0.0)._replace(score=0.0)
+            for node_id, text, metadata in zip(
+                data["ids"], data["documents"], data["metadatas"]
+            )
+        }
+
+    @staticmethod
+    def _to_hit(
+        node_id: str, text: Optional[str], metadata: Optional[Dict], distance: float
+    ) -> VectorHit:
+        """Chroma 结果 → VectorHit；元数据解析和得分换算与 ChromaVectorStore.query 一致"""
+        try:
+            metadata = metadata_dict_to_node(metadata, text=text).metadata
+        except Exception:
+            # 不是 LlamaIndex 写入的记录，直接使用原始元数据
+            metadata = metadata or {}
+        return VectorHit(node_id, text or "", dict(metadata), math.exp(-distance))
+
+    def embeddings(self, kb: str, ids: List[str]) -> Dict[str, List[float]]:
+        collection = self.collection(kb)
+        if collection is None or not ids:
+            return {}
+        data = collection.get(ids=ids, include=["embeddings"])
+        return dict(zip(data["ids"], data["embeddings"]))
+
+    def counts(self) -> Dict[str, int]:
+        return {kb: self.collection(kb).count() for kb in self.knowledge_bases()}
+
+    def _existing_ids(self, kb: str, ids: List[str]) -> Set[str]:
+        collection = self.collection(kb)
+        if collection is None or not ids:
+            return set()
+        return set(collection.get(ids=ids, include=[])["ids"])
+
+    def _add_vectors(self, kb: str, nodes: List) -> None:
+        self.vector_store(kb).add(nodes)
+
+    def _delete_vectors(self, kb: str, source: str) -> None:
+        collection = self.collection(kb)
+        if collection is not None:
+            collection.delete(where={"source": source})
+
+    def _rename_vectors(self, kb: str, old: str, new: str) -> None:
+        collection = self.collection(kb)
+        if collection is None:
+            return
+        # 已更新的记录不再匹配 where，每次都取第一批，直到没有剩余
+        while True:
+            data = collection.get(
+                where={"source": old}, include=["metadatas"], limit=RENAME_BATCH_SIZE
+            )
+            if not data["ids"]:
+                break
+            collection.update(
+                ids=data["ids"],
+                metadatas=[
+                    self._renamed_metadata(metadata, new)
+                    for metadata in data["metadatas"]
+                ],
+            )
+
+    @staticmethod
+    def _renamed_metadata(metadata: Dict[str, Any], source: str) -> Dict[str, Any]:
+        """改写平铺的 source 元数据和 LlamaIndex 序列化在 _node_content 中的副本"""
+        metadata = dict(metadata, source=source)
+        if "_node_content" in metadata:
+            content = json.loads(metadata["_node_content"])
+            content.setdefault("metadata", {})["source"] = source
+            metadata["_node_content"] = json.dumps(content, ensure_ascii=False)
+        return metadata
+
+    def _drop_vectors(self) -> None:
+        for collection in self._collections.values():
+            try:
+                self.client.delete_collection(collection.name)
+            except Exception as e:
+                logger.error(f"删除集合失败 {collection.name}: {e}")
+        self._collections.clear()
+        self._vector_stores.clear()
+
+
+class FlatKnowledgeBaseStore(BaseKnowledgeBaseStore):
+    """
+    进程内平铺向量后端：每个知识库一个 FlatVectorIndex（内存映射的 float16 矩阵，
+    NumPy 精确点积检索），子目录名取 md5(知识库名)[:12]，知识库名保存在 meta.json 中。
+
+    适合单机、百万条以内的日志库：没有 HNSW 的近似误差和图结构内存开销，
+    多个 worker 进程通过页缓存共享同一份矩阵。只允许一个进程写入。
+    quantization 为 "int8" / "pq" 时各知识库训练压缩编码，检索先粗排再精确重打分，
+    见 FlatVectorIndex。
+    """
+
+    backend = "flat"
+
+    def __init__(
+        self,
+        directory: str,
+        prefix: str,
+        depth: int = 2,
+        keyword_dir: Optional[str] = None,
+        tokenizer: Optional[KeywordTokenizer] = None,
+        time_dir: Optional[str] = None,
+        dtype: str = "float16",
+        quantization: Optional[str] = None,
+        pq_subspaces: int = 64,
+        train_size: int = 20000,
+        rerank_factor: int = 4,
+    ) -> None:
+        super().__init__(prefix, depth, None, keyword_dir, tokenizer, time_dir)
+        self.directory = directory
+        self.quantization = quantization
+        self._index_options = {
+            "dtype": dtype,
+            "quantization": quantization,
+            "pq_subspaces": pq_subspaces,
+            "train_size": train_size,
+            "rerank_factor": rerank_factor,
+        }
+        self._indexes: Dict[str, FlatVectorIndex] = {}
+        self._scanned_mtime: Optional[int] = None
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self) -> None:
+        """目录变化（其他进程新建了知识库）时重新加载知识库列表"""
+        mtime = os.stat(self.directory).st_mtime_ns
+        if mtime == self._scanned_mtime:
+            return
+        with self._lock:
+            for name in sorted(os.listdir(self.directory)):
+                path = os.path.join(self.directory, name)
+                if path in (index.directory for index in self._indexes.values()):
+                    continue
+                if os.path.exists(os.path.join(path, "meta.json")):
+                    index = FlatVectorIndex(path, **self._index_options)
+                    self._indexes[index.knowledge_base] = index
+            self._scanned_mtime = mtime
+
+    def flat_index(self, kb: str, create: bool = False) -> Optional[FlatVectorIndex]:
+        self._scan()
+        with self._lock:
+            index = self._indexes.get(kb)
+            if index is None and create:
+                digest = hashlib.md5(kb.encode("utf-8")).hexdigest()[:12]
+                index = FlatVectorIndex(
+                    os.path.join(self.directory, digest), kb, **self._index_options
+                )
+                self._indexes[kb] = index
+            return index
+
+    def knowledge_bases(self) -> List[str]:
+        self._scan()
+        return sorted(self._indexes)
+
+    def counts(self) -> Dict[str, int]:
+        self._scan()
+        return {kb: index.live_count for kb, index in sorted(self._indexes.items())}
+
+    def index_stats(self) -> Dict[str, Dict[str, Any]]:
+        self._scan()
+        return {kb: index.stats() for kb, index in sorted(self._indexes.items())}
+
+    def search(
+        self,
+        kb: str,
+        embeddings: Sequence[Sequence[float]],
+        top_k: int,
+        where: Optional[Dict[str, Any]] = None,
+    ) -> List[List[VectorHit]]:
+        index = self.flat_index(kb)
+        if index is None:
+            return [[] for _ in embeddings]
+        return [
+            [
+                VectorHit(hit["id"], hit["text"], hit["metadata"], hit["score"])
+                for hit in hits
+            ]
+            for hits in index.search(embeddings, top_k, where)
+        ]
+
+    def search_ids(
+        self,
+        kb: str,
+        embeddings: Sequence[Sequence[float]],
+        ids: Sequence[str],
+        top_k: int,
+        where: Optional[Dict[str, Any]] = None,
+    ) -> List[List[VectorHit]]:
+        index = self.flat_index(kb)
+        if index is None:
+            return [[] for _ in embeddings]
+        return [
+            [
+                VectorHit(hit["id"], hit["text"], hit["metadata"], hit["score"])
+                for hit in hits
+            ]
+            for hits in index.search_ids(embeddings, ids, top_k, where)
+        ]
+
+    def embeddings(self, kb: str, ids: List[str]) -> Dict[str, List[float]]:
+        index = self.flat_index(kb)
+        if index is None or not ids:
+            return {}
+        return index.embeddings(ids)
+
+    def documents(self, kb: str, ids: List[str]) -> Dict[str, VectorHit]:
+        index = self.flat_index(kb)
+        if index is None or not ids:
+            return {}
+        return {
+            node_id: VectorHit(node_id, doc["text"], doc["metadata"], 0.0)
+            for node_id, doc in index.documents(ids).items()
+        }
+
+    def _existing_ids(self, kb: str, ids: List[str]) -> Set[str]:
+        index = self.flat_index(kb)
+        if index is None or not ids:
+            return set()
+        return index.existing_ids(ids)
+
+    def _add_vectors(self, kb: str, nodes: List) -> None:
+        self.flat_index(kb, create=True).add(
+            [node.node_id for node in nodes],
+            [node.get_content() for node in nodes],
+            [node.metadata for node in nodes],
+            [node.embedding for node in nodes],
+        )
+
+    def _delete_vectors(self, kb: str, source: str) -> None:
+        index = self.flat_index(kb)
+        if index is not None:
+            index.delete_source(source)
+
+    def _rename_vectors(self, kb: str, old: str, new: str) -> None:
+        index = self.flat_index(kb)
+        if index is not None:
+            index.rename_source(old, new)
+
+    def _drop_vectors(self) -> None:
+        for index in self._indexes.values():
+            index.drop()
+        self._indexes.clear()
+        try:
+            os.rmdir(self.directory)
+        except OSError as e:
+            logger.warning(f"删除向量目录失败 {self.directory}: {e}")
+
+
+class KnowledgeBaseRouter:
+    """
+    根据查询内容选择要检索的知识库。
+
+    每个知识库的关键词包括：目录名（及去掉“类”后缀的类别名）、
+    与目录名相交的同义词组、解释中提到该目录名的术语表词条。
+    命中关键词的知识库全部被选中（按命中数从高到低），跨知识库的问题
+    （如“数据库连接超时导致应用报错”）不会漏掉得分较低的知识库；
+    没有命中任何关键词时检索全部知识库。
+    """
+
+    def __init__(
+        self,
+        synonyms: Dict[str, List[str]],
+        glossary: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.synonyms = synonyms
+        self.glossary = glossary or {}
+        self._terms: Dict[str, Set[str]] = {}
+
+    def set_glossary(self, glossary: Dict[str, str]) -> None:
+        self.glossary = glossary
+        self._terms.clear()
+
+    def set_synonyms(self, synonyms: Dict[str, List[str]]) -> None:
+        self.synonyms = synonyms
+        self._terms.clear()
+
+    @staticmethod
+    def _glossary_aliases(term: str) -> Set[str]:
+        """ "上下文窗口 (Context Window)" → {"上下文窗口", "context window"} """
+        aliases = {part.strip().lower() for part in re.split(r"[()（）]", term)}
+        return {alias for alias in aliases if alias}
+
+    def terms_for(self, kb: str) -> Set[str]:
+        terms = self._terms.get(kb)
+        if terms is not None:
+            return terms
+
+        components = [c for c in kb.lower().split("/") if c]
+        terms = set(components)
+        terms.update(c[:-1] for c in components if c.endswith("类"))
+
+        for main_word, syns in self.synonyms.items():
+            group = {main_word.lower()} | {s.lower() for s in syns}
+            if group & terms:
+                terms |= group
+
+        # 术语解释中提到产品名（如 "Linux 内核"）时，术语本身也能路由到该知识库
+        products = [c for c in components if len(c) >= 3]
+        for term, description in self.glossary.items():
+            text = f"{term} {description}".lower()
+            if any(self._contains(text, product) for product in products):
+                terms |= self._glossary_aliases(term)
+
+        terms = {t for t in terms if len(t) >= 2}
+        self._terms[kb] = terms
+        return terms
+
+    @staticmethod
+    def _contains(text: str, term: str) -> bool:
+        # ASCII 词按单词边界匹配，避免 "go" 命中 "google"
+        if term.isascii():
+            return (
+                re.search(rf"(?<![a-z0-9]){re.escape(term)}(?![a-z0-9])", text)
+                is not None
+            )
+        return term in text
+
+    def route(self, query: str, knowledge_bases: Iterable[str]) -> List[str]:
+        knowledge_bases = list(knowledge_bases)
+        if len(knowledge_bases) <= 1:
+            return knowledge_bases
+        text = query.lower()
+        scores = {
+            kb: sum(1 for term in self.terms_for(kb) if self._contains(text, term))
+            for kb in knowledge_bases
+        }
+        matched = [kb for kb in knowledge_bases if scores[kb] > 0]
+        if not matched:
+            return knowledge_bases
+        return sorted(matched, key=lambda kb: scores[kb], reverse=True)
+
+    @staticmethod
+    def resolve(names: Iterable[str], knowledge_bases: Iterable[str]) -> List[str]:
+        """
+        把请求中指定的知识库名解析为实际知识库：
+        可以是完整名称（"数据库类/mysql"）、类别（"数据库类"）或目录名（"mysql"），大小写不敏感。
+        """
+        knowledge_bases = list(knowledge_bases)
+        selected = []
+        for name in names:
+            name = name.strip().strip("/").lower()
+            if not name:
+                continue
+            for kb in knowledge_bases:
+                lowered = kb.lower()
+                if (
+                    lowered == name
+                    or lowered.startswith(f"{name}/")
+                    or name in lowered.split("/")
+                ) and kb not in selected:
+                    selected.append(kb)
+        return selected
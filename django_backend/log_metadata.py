@@ -0,0 +1,298 @@
+import re
+import time
+import operator
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+# 元数据键：ts / ts_end 为 Unix 时间戳（秒），便于在 Chroma 中做范围过滤。
+# 单条记录 ts == ts_end；模板文档为首次/末次出现时间。
+STRUCTURED_KEYS = ["ts", "ts_end", "level", "host", "service"]
+
+LEVEL_PATTERN = re.compile(
+    r"\b(TRACE|DEBUG|INFO|NOTICE|WARN(?:ING)?|ERR(?:OR)?|SEVERE|FATAL|"
+    r"CRIT(?:ICAL)?|EMERG(?:ENCY)?|ALERT)\b",
+    re.IGNORECASE,
+)
+
+# 统一级别名称，过滤时用户写 WARN 或 WARNING 都能命中
+LEVEL_ALIASES = {
+    "WARN": "WARNING",
+    "ERR": "ERROR",
+    "CRIT": "CRITICAL",
+    "EMERG": "EMERGENCY",
+}
+
+# 统计错误突发时视为错误的级别（归一化后的名称）
+ERROR_LEVELS = {"ERROR", "SEVERE", "FATAL", "CRITICAL", "EMERGENCY", "ALERT"}
+
+TIMESTAMP_FORMATS = [
+    # 2024-01-01 10:00:00.123 / 2024-01-01T10:00:00,123+08:00
+    (
+        re.compile(
+            r"(\d{4})[-/](\d{1,2})[-/](\d{1,2})[T ](\d{1,2}):(\d{2}):(\d{2})"
+            r"(?:[.,](\d{1,6}))?(Z|[+-]\d{2}:?\d{2})?"
+        ),
+        "iso",
+    ),
+    # Apache/Nginx 访问日志: [01/Jan/2024:10:00:00 +0000]
+    (
+        re.compile(
+            r"(\d{1,2})/([A-Z][a-z]{2})/(\d{4}):(\d{2}):(\d{2}):(\d{2})"
+            r"(?:\s([+-]\d{4}))?"
+        ),
+        "clf",
+    ),
+    # syslog: Jan  1 10:00:00（无年份，取当前年份）
+    (
+        re.compile(
+            r"\b(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+(\d{1,2})\s+"
+            r"(\d{2}):(\d{2}):(\d{2})\b"
+        ),
+        "syslog",
+    ),
+]
+
+MONTHS = {
+    name: index
+    for index, name in enumerate(
+        "Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split(), 1
+    )
+}
+
+# syslog 行首: [<PRI>]Jan  1 10:00:00 host service[pid]: message
+SYSLOG_HEADER = re.compile(
+    r"^(?:<\d+>)?[A-Z][a-z]{2}\s+\d{1,2}\s+\d{2}:\d{2}:\d{2}\s+"
+    r"(?P<host>[\w.\-]+)\s+(?P<service>[\w.\-/]+?)(?:\[\d+\])?:"
+)
+HOST_FIELD = re.compile(r"\b(?:host|hostname)[=:]\s*\"?(?P<host>[\w.\-]+)", re.I)
+SERVICE_FIELD = re.compile(
+    r"\b(?:service|svc|app|application)[=:]\s*\"?(?P<service>[\w.\-]+)", re.I
+)
+# 级别后紧跟的 [服务名]，如 "ERROR [order-service] ..."
+SERVICE_AFTER_LEVEL = re.compile(
+    r"\b(?:TRACE|DEBUG|INFO|NOTICE|WARN(?:ING)?|ERROR|FATAL|CRITICAL)\b"
+    r"\s*[:\-]?\s*\[(?P<service>[A-Za-z][\w.\-]*)\]"
+)
+
+RELATIVE_TIME = re.compile(r"^(\d+)\s*(s|m|min|h|d|w)$", re.I)
+RELATIVE_UNITS = {"s": 1, "m": 60, "min": 60, "h": 3600, "d": 86400, "w": 604800}
+
+COMPARATORS = {
+    "$gt": operator.gt,
+    "$gte": operator.ge,
+    "$lt": operator.lt,
+    "$lte": operator.le,
+}
+
+
+def normalize_level(level: str) -> str:
+    level = level.strip().upper()
+    return LEVEL_ALIASES.get(level, level)
+
+
+def parse_timestamp(text: str) -> Optional[float]:
+    """解析文本中第一个可识别的时间戳，返回 Unix 时间戳；无时区的按本地时间处理"""
+    for pattern, kind in TIMESTAMP_FORMATS:
+        match = pattern.search(text)
+        if not match:
+            continue
+        try:
+            if kind == "iso":
+                year, month, day, hour, minute, second = map(int, match.groups()[:6])
+                micro = int((match.group(7) or "0").ljust(6, "0"))
+                zone = match.group(8)
+                value = datetime(year, month, day, hour, minute, second, micro)
+                if zone:
+                    zone = "+0000" if zone == "Z" else zone.replace(":", "")
+                    value = datetime.strptime(
+                        value.strftime("%Y-%m-%d %H:%M:%S.%f") + zone,
+                        "%Y-%m-%d %H:%M:%S.%f%z",
+                    )
+            elif kind == "clf":
+                day, month_name, year, hour, minute, second, zone = match.groups()
+                value = datetime(
+                    int(year),
+                    MONTHS[month_name],
+                    int(day),
+                    int(hour),
+                    int(minute),
+                    int(second),
+                )
+                if zone:
+                    value = datetime.strptime(
+                        value.strftime("%Y-%m-%d %H:%M:%S") + zone,
+                        "%Y-%m-%d %H:%M:%S%z",
+                    )
+            else:
+                month_name, day, hour, minute, second = match.groups()
+                value = datetime(
+                    datetime.now().year,
+                    MONTHS[month_name],
+                    int(day),
+                    int(hour),
+                    int(minute),
+                    int(second),
+                )
+            return value.timestamp()
+        except (ValueError, OverflowError):
+            continue
+    return None
+
+
+def parse_time_bound(value: Any, now: Optional[float] = None) -> Optional[float]:
+    """
+    过滤条件中的时间：Unix 时间戳、时间字符串，或相对时间（"30m"、"1h"、"2d" 表示多久之前）。
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    match = RELATIVE_TIME.match(text)
+    if match:
+        seconds = int(match.group(1)) * RELATIVE_UNITS[match.group(2).lower()]
+        return (now if now is not None else time.time()) - seconds
+    timestamp = parse_timestamp(text)
+    if timestamp is None:
+        # 只有日期时按当天零点
+        try:
+            timestamp = datetime.strptime(text, "%Y-%m-%d").timestamp()
+        except ValueError:
+            raise ValueError(f"无法解析的时间: {value}")
+    return timestamp
+
+
+def parse_duration(value: Any) -> float:
+    """时长：秒数或 "30s" / "15m" / "2h" / "1d" 形式的字符串"""
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    else:
+        match = RELATIVE_TIME.match(str(value).strip())
+        if not match:
+            raise ValueError(f"无法解析的时长: {value}")
+        seconds = float(int(match.group(1)) * RELATIVE_UNITS[match.group(2).lower()])
+    if seconds < 0:
+        raise ValueError(f"时长不能为负数: {value}")
+    return seconds
+
+
+def time_range(
+    filters: Optional[Dict[str, Any]],
+) -> Tuple[Optional[float], Optional[float]]:
+    """
+    过滤条件中的时间区间 (since, until)，未限定的一端为 None。
+    around + window 表示 [around - window, around + window]，与 since / until 同时给出时取交集。
+    """
+    if not filters:
+        return None, None
+    since = parse_time_bound(filters.get("since"))
+    until = parse_time_bound(filters.get("until"))
+    around = parse_time_bound(filters.get("around"))
+    if around is not None:
+        window = parse_duration(filters.get("window") or "15m")
+        since = around - window if since is None else max(since, around - window)
+        until = around + window if until is None else min(until, around + window)
+    elif filters.get("window"):
+        raise ValueError("window 需要与 around 一起使用")
+    return since, until
+
+
+def extract_metadata(text: str) -> Dict[str, Any]:
+    """从一条日志记录（取首行）中提取 ts / ts_end / level / host / service"""
+    first_line = text.split("\n", 1)[0][:1000]
+    metadata: Dict[str, Any] = {}
+
+    timestamp = parse_timestamp(first_line)
+    if timestamp is not None:
+        metadata["ts"] = metadata["ts_end"] = timestamp
+
+    level = LEVEL_PATTERN.search(first_line)
+    if level:
+        metadata["level"] = normalize_level(level.group(1))
+
+    syslog = SYSLOG_HEADER.match(first_line)
+    if syslog:
+        metadata["host"] = syslog.group("host")
+        metadata["service"] = syslog.group("service")
+    host = HOST_FIELD.search(first_line)
+    if host and "host" not in metadata:
+        metadata["host"] = host.group("host")
+    service = SERVICE_FIELD.search(first_line) or SERVICE_AFTER_LEVEL.search(
+        first_line
+    )
+    if service and "service" not in metadata:
+        metadata["service"] = service.group("service")
+    return metadata
+
+
+def build_where(filters: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    把声明式过滤条件转换为 Chroma where 子句：
+    {"levels": [...], "services": [...], "hosts": [...], "since": ..., "until": ...,
+     "around": ..., "window": ...}
+    时间范围见 time_range，按区间相交判断（ts <= until 且 ts_end >= since），
+    模板文档也能命中。
+    """
+    if not filters:
+        return None
+    clauses: List[Dict[str, Any]] = []
+    levels = [normalize_level(l) for l in filters.get("levels") or [] if l]
+    if levels:
+        clauses.append({"level": {"$in": levels}})
+    for key, field in (("services", "service"), ("hosts", "host")):
+        values = [v.strip() for v in filters.get(key) or [] if v and v.strip()]
+        if values:
+            clauses.append({field: {"$in": values}})
+    since, until = time_range(filters)
+    if since is not None:
+        clauses.append({"ts_end": {"$gte": since}})
+    if until is not None:
+        clauses.append({"ts": {"$lte": until}})
+
+    if not clauses:
+        return None
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
+
+
+def matches_where(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """
+    在内存中按 Chroma where 子句判断一条元数据是否命中（不使用 Chroma 的后端用）。
+    支持 $and / $or 以及 $eq / $ne / $in / $nin / $gt / $gte / $lt / $lte。
+    """
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, c) for c in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(matches_where(metadata, c) for c in condition):
+                return False
+            continue
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, operand in condition.items():
+            if op == "$ne":
+                matched = value != operand
+            elif op == "$nin":
+                matched = value not in operand
+            elif value is None:
+                matched = False
+            elif op == "$eq":
+                matched = value == operand
+            elif op == "$in":
+                matched = value in operand
+            elif op in COMPARATORS:
+                try:
+                    matched = COMPARATORS[op](value, operand)
+                except TypeError:
+                    matched = False
+            else:
+                raise ValueError(f"不支持的过滤运算符: {op}")
+            if not matched:
+                return False
+    return True
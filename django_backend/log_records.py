@@ -0,0 +1,199 @@
+import os
+import re
+import mmap
+import threading
+from collections import OrderedDict
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+# 默认的“记录起始行”模式：时间戳或日志级别开头
+DEFAULT_RECORD_START_PATTERNS = [
+    r"^\[?\d{4}[-/]\d{1,2}[-/]\d{1,2}[T ]\d{1,2}:\d{2}",
+    r"^\[?(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+\d{1,2}\s+\d{2}:\d{2}",
+    r"^\[?\d{2}:\d{2}:\d{2}",
+    r"^\[?(?:TRACE|DEBUG|INFO|NOTICE|WARN|WARNING|ERROR|SEVERE|FATAL|CRITICAL)\b",
+]
+
+# 确定性日志记录文档 id 的前缀，见 record_document_id
+RECORD_ID_PREFIX = "log-"
+
+
+def record_document_id(inode: int, offset: Optional[int], line: int) -> str:
+    """
+    日志记录文档的确定性 id：文件 inode + 字节偏移（压缩/已轮转走的文件没有偏移时用行号）。
+    同步入库和 LogTailer 对同一条记录得到相同的 id；文件轮转改名时 inode 不变，
+    新建的同名文件 inode 不同，不会与改名前的记录冲突。
+    """
+    if offset is None:
+        return f"{RECORD_ID_PREFIX}{inode}-L{line}"
+    return f"{RECORD_ID_PREFIX}{inode}-{offset}"
+
+
+# 续行模式：缩进的栈帧、异常链、Python Traceback 等
+CONTINUATION_PATTERNS = [
+    r"^\s+\S",
+    r"^Caused by:",
+    r"^Suppressed:",
+    r"^\.\.\. \d+ (?:more|common frames omitted)",
+    r"^Traceback \(most recent call last\):",
+    r"^During handling of the above exception",
+    r"^The above exception was the direct cause",
+    r"^goroutine \d+ \[",
+]
+
+
+class LogRecordAssembler:
+    """
+    把日志行组装成多行记录（一条日志 + 它的栈帧/异常链）。
+
+    规则：
+    - 命中续行模式的行并入当前记录；
+    - 命中起始模式的行开始新记录；
+    - 两者都不命中时，如果文件中已经出现过起始行（即文件有统一的行首格式），
+      视为上一条记录的一部分（如 Python 异常的最后一行 "ValueError: ..."），
+      否则每行单独成为一条记录；
+    - 空行结束当前记录；单条记录最多 max_lines 行。
+    """
+
+    def __init__(
+        self,
+        start_patterns: Optional[List[str]] = None,
+        max_lines: int = 200,
+    ) -> None:
+        if start_patterns is None:
+            start_patterns = DEFAULT_RECORD_START_PATTERNS
+        self.start_re = (
+            re.compile("|".join(f"(?:{p})" for p in start_patterns))
+            if start_patterns
+            else None
+        )
+        self.continuation_re = re.compile(
+            "|".join(f"(?:{p})" for p in CONTINUATION_PATTERNS)
+        )
+        self.max_lines = max_lines
+
+    def _is_start(self, line: str) -> bool:
+        return bool(self.start_re and self.start_re.match(line))
+
+    def iter_records(
+        self, lines: Iterable[Union[str, bytes]]
+    ) -> Iterator[Tuple[int, int, int, List[str]]]:
+        """
+        逐条产出 (起始行号, 起始字节偏移, 字节长度, 记录内的行列表)，行号从 1 开始。
+        传入以二进制模式读取的行时，偏移/长度为原文件中的字节位置，
+        可用于按偏移懒加载原文；传入 str 时偏移按 UTF-8 编码长度累计。
+        """
+        current: List[str] = []
+        current_start = 0
+        current_offset = 0
+        current_end = 0
+        seen_start = False
+        offset = 0
+
+        for line_no, raw_line in enumerate(lines, 1):
+            if isinstance(raw_line, bytes):
+                line_offset, offset = offset, offset + len(raw_line)
+                raw_line = raw_line.decode("utf-8", errors="replace")
+            else:
+                line_offset, offset = offset, offset + len(raw_line.encode("utf-8"))
+            line = raw_line.rstrip("\r\n")
+            if not line.strip():
+                if current:
+                    yield (
+                        current_start,
+                        current_offset,
+                        current_end - current_offset,
+                        current,
+                    )
+                    current = []
+                continue
+
+            is_start = self._is_start(line)
+            seen_start = seen_start or is_start
+            if current and len(current) < self.max_lines and not is_start:
+                if self.continuation_re.match(line) or seen_start:
+                    current.append(line)
+                    current_end = line_offset + len(line.encode("utf-8"))
+                    continue
+
+            if current:
+                yield (
+                    current_start,
+                    current_offset,
+                    current_end - current_offset,
+                    current,
+                )
+            current = [line]
+            current_start = line_no
+            current_offset = line_offset
+            current_end = line_offset + len(line.encode("utf-8"))
+
+        if current:
+            yield current_start, current_offset, current_end - current_offset, current
+
+
+class LogTextReader:
+    """
+    按 (文件, 字节偏移, 长度) 通过 mmap 懒加载日志原文，并可向前后扩展若干行上下文。
+    打开的 mmap 按 LRU 缓存，超过 max_open 个时关闭最久未用的。
+    """
+
+    def __init__(self, max_open: int = 64) -> None:
+        self.max_open = max_open
+        self._maps: "OrderedDict[str, Tuple[int, float, mmap.mmap]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_map(self, file_path: str) -> Optional[mmap.mmap]:
+        stat = os.stat(file_path)
+        with self._lock:
+            cached = self._maps.get(file_path)
+            if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+                self._maps.move_to_end(file_path)
+                return cached[2]
+            if cached:
+                cached[2].close()
+                del self._maps[file_path]
+            if stat.st_size == 0:
+                return None
+            with open(file_path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[file_path] = (stat.st_size, stat.st_mtime, mapped)
+            while len(self._maps) > self.max_open:
+                _, (_, _, old) = self._maps.popitem(last=False)
+                old.close()
+            return mapped
+
+    def read(
+        self, file_path: str, offset: int, length: int, context_lines: int = 0
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """
+        返回 (记录原文, 含上下文的原文)；context_lines 为 0 时第二项为 None。
+        偏移超出文件范围时返回 (None, None)。
+        """
+        mapped = self._get_map(file_path)
+        if mapped is None or offset + length > len(mapped):
+            return None, None
+        text = mapped[offset : offset + length].decode("utf-8", errors="replace")
+        if context_lines <= 0:
+            return text, None
+
+        start = offset
+        for _ in range(context_lines):
+            if start <= 0:
+                break
+            # start 指向行首，跳过前一行末尾的换行符后继续向前找
+            start = mapped.rfind(b"\n", 0, start - 1) + 1
+        end = offset + length
+        for _ in range(context_lines):
+            newline = mapped.find(b"\n", end + 1)
+            if newline == -1:
+                end = len(mapped)
+                break
+            end = newline
+        context = mapped[start:end].decode("utf-8", errors="replace")
+        return text, context.strip("\r\n")
+
+    def close(self) -> None:
+        with self._lock:
+            for _, _, mapped in self._maps.values():
+                mapped.close()
+            self._maps.clear()
@@ -0,0 +1,106 @@
+import io
+import os
+import re
+import gzip
+import json
+import logging
+from typing import Any, BinaryIO, Iterator, Optional, TextIO, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖，缺失时跳过 .zst 文件
+    zstandard = None
+
+# 压缩后缀 → 压缩格式
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".zst": "zstd", ".zstd": "zstd"}
+
+# 轮转后缀：app.log.1、app.log-20240101、app.log.2024-01-01、app.log.20240101_1200
+ROTATION_SUFFIX = re.compile(
+    r"(?:\.\d{1,4}|[-_.]\d{4}-?\d{2}-?\d{2}(?:[-_T]?\d{2,6})?)$"
+)
+
+# 允许压缩/轮转的格式：按行或按流读取的文本类文件
+STREAMABLE_EXTENSIONS = {".log", ".txt", ".json", ".jsonl", ".csv"}
+
+
+def split_source_name(file_path: str) -> Tuple[str, Optional[str]]:
+    """
+    解析文件名，返回 (逻辑扩展名, 压缩格式)。
+    如 app.log.3.gz → (".log", "gzip")，app.log-20240101 → (".log", None)。
+    去掉压缩/轮转后缀后不是可流式读取的格式时，返回原始扩展名。
+    """
+    name = os.path.basename(file_path)
+    stem, suffix = os.path.splitext(name)
+    compression = COMPRESSION_SUFFIXES.get(suffix.lower())
+    if compression:
+        name = stem
+    base = ROTATION_SUFFIX.sub("", name)
+    ext = os.path.splitext(base)[1].lower()
+    if ext in STREAMABLE_EXTENSIONS and (compression or base != name):
+        return ext, compression
+    if compression:
+        # 不支持压缩的格式（如 .pdf.gz）
+        return suffix.lower(), None
+    return os.path.splitext(name)[1], None
+
+
+def compression_available(compression: Optional[str]) -> bool:
+    return compression != "zstd" or zstandard is not None
+
+
+def open_binary(file_path: str) -> BinaryIO:
+    """以二进制流方式打开文件，压缩文件边读边解压，不落盘、不整体读入内存"""
+    compression = split_source_name(file_path)[1]
+    if compression == "gzip":
+        return gzip.open(file_path, "rb")
+    if compression == "zstd":
+        if zstandard is None:
+            raise ImportError("读取 .zst 文件需要安装 zstandard")
+        raw = open(file_path, "rb")
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            raw, read_across_frames=True, closefd=True
+        )
+        return io.BufferedReader(reader)
+    return open(file_path, "rb")
+
+
+def open_text(file_path: str, encoding: str = "utf-8") -> TextIO:
+    return io.TextIOWrapper(open_binary(file_path), encoding=encoding)
+
+
+def iter_json_values(f: TextIO, block_chars: int = 1 << 16) -> Iterator[Any]:
+    """
+    顶层是数组的 JSON 文件逐个产出数组元素，每次只读入一块文本，不整体载入内存；
+    顶层不是数组时整体解析，产出这一个值。
+    """
+    decoder = json.JSONDecoder()
+    buffer = f.read(block_chars)
+    pos = len(buffer) - len(buffer.lstrip())
+    if not buffer.startswith("[", pos):
+        yield json.loads(buffer + f.read())
+        return
+    pos += 1
+    eof = False
+    while True:
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == "]":
+            return
+        value, end = None, -1
+        if pos < len(buffer):
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                end = -1
+        # 元素可能被块边界截断（数字截断时也能解析成功），读入更多再试
+        if end == -1 or (end == len(buffer) and not eof):
+            if eof:
+                raise ValueError("JSON 数组不完整")
+            block = f.read(max(block_chars, len(buffer) - pos))
+            eof = not block
+            buffer, pos = buffer[pos:] + block, 0
+            continue
+        yield value
+        pos = end
@@ -0,0 +1,404 @@
+import os
+import json
+import time
+import fnmatch
+import logging
+import argparse
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from llama_index.core import Document
+
+from log_metadata import STRUCTURED_KEYS, extract_metadata
+from log_records import LogRecordAssembler, record_document_id
+
+logger = logging.getLogger(__name__)
+
+
+class LogTailer:
+    """
+    实时跟踪 log_path 下的日志文件（类似 tail -F），把新追加的记录以微批写入向量库。
+
+    - 每个文件保存检查点 (inode, offset, line)，重启后从上次位置继续；
+    - 文件 inode 变化视为轮转：先读完旧文件剩余内容，再从新文件开头读取；
+    - 文件变小视为截断（copytruncate），从头开始读取；
+    - 末尾未写完的行不读取；最后一条记录可能还会追加栈帧，
+      空闲 record_idle 秒后才写入。
+    新记录逐条嵌入，不做模板挖掘；下一次 sync_vectorstore 会按文件变更重新解析。
+
+    与 sync_vectorstore 共用入库锁和位置：每个文件的读取和写入在入库锁内完成；
+    同步只解析到清单记录的大小，清单中该文件的条目变化（被同步重新解析）后，
+    跟踪位置回到清单记录的大小。记录的节点 id 由 (inode, 偏移) 确定，
+    写入失败后重读的记录会被跳过，不会重复入库。
+    """
+
+    def __init__(
+        self,
+        log_system,
+        patterns: Optional[List[str]] = None,
+        interval: float = 2.0,
+        batch_size: int = 64,
+        record_idle: float = 5.0,
+        max_read_bytes: int = 4 << 20,
+        checkpoint_path: Optional[str] = None,
+    ) -> None:
+        """
+        :param log_system: TopKLogSystem 实例，新记录通过其 append_documents 写入
+        :param patterns: 跟踪的文件（相对 log_path 的 glob 模式），默认 ["*.log"]
+        :param interval: 轮询间隔（秒）
+        :param batch_size: 每个微批的最大记录数
+        :param record_idle: 文件末尾的记录等待续行的时间（秒）
+        :param max_read_bytes: 每个文件每次轮询最多读取的字节数
+        :param checkpoint_path: 检查点文件，默认放在向量库目录下
+        """
+        self.log_system = log_system
+        self.log_path = log_system.log_path
+        self.patterns = list(patterns or ["*.log"])
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.record_idle = record_idle
+        self.max_read_bytes = max_read_bytes
+        self.checkpoint_path = checkpoint_path or os.path.join(
+            log_system.vector_store_path, "tail_checkpoints.json"
+        )
+        self.assembler = LogRecordAssembler(
+            log_system.ingest_options.get("record_start_patterns")
+        )
+        self.checkpoints: Dict[str, Dict[str, Any]] = self._load_checkpoints()
+        # 相对路径 → 打开的文件句柄及读取状态
+        self._files: Dict[str, Dict[str, Any]] = {}
+        self._generation = log_system.index_generation
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {
+            "polls": 0,
+            "records": 0,
+            "batches": 0,
+            "rotations": 0,
+            "truncations": 0,
+            "errors": 0,
+        }
+
+    # 检查点
+    def _load_checkpoints(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.checkpoint_path):
+            return {}
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"读取跟踪检查点失败 {self.checkpoint_path}: {e}，将从头跟踪")
+            return {}
+
+    def _save_checkpoints(self) -> None:
+        """原子写入，避免进程中断导致检查点损坏"""
+        os.makedirs(os.path.dirname(self.checkpoint_path) or ".", exist_ok=True)
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.checkpoints, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    # 文件状态
+    def _list_files(self) -> List[str]:
+        rel_paths = []
+        for root, dirs, files in os.walk(self.log_path):
+            for file in files:
+                rel_path = os.path.relpath(
+                    os.path.join(root, file), self.log_path
+                ).replace(os.sep, "/")
+                if any(fnmatch.fnmatch(rel_path, p) for p in self.patterns):
+                    rel_paths.append(rel_path)
+        return sorted(rel_paths)
+
+    @staticmethod
+    def _count_lines(f, offset: int, block_size: int = 1 << 20) -> int:
+        f.seek(0)
+        count = 0
+        remaining = offset
+        while remaining > 0:
+            block = f.read(min(block_size, remaining))
+            if not block:
+                break
+            count += block.count(b"\n")
+            remaining -= len(block)
+        return count
+
+    def _open(self, rel_path: str, rotated: bool = False) -> Dict[str, Any]:
+        """
+        打开文件并确定起始位置：
+        检查点（同一 inode 且未截断）与入库清单中已嵌入的大小取较大者；
+        刚轮转出的新文件从头读取。
+        """
+        f = open(os.path.join(self.log_path, rel_path), "rb")
+        stat = os.fstat(f.fileno())
+        offset = 0
+        line = 0
+        entry = None if rotated else self.log_system.manifest.files.get(rel_path)
+        synced = self._synced_key(entry)
+        checkpoint = None if rotated else self.checkpoints.get(rel_path)
+        if (
+            checkpoint
+            and checkpoint.get("inode") == stat.st_ino
+            and checkpoint.get("offset", 0) <= stat.st_size
+            and checkpoint.get("synced", synced) == synced
+        ):
+            # 检查点之后清单没有变化；变化说明同步重新解析过，检查点已失效
+            offset, line = checkpoint["offset"], checkpoint.get("line", 0)
+
+        if entry and offset < entry.get("size", 0) <= stat.st_size:
+            # 这部分已由 sync_vectorstore 整体入库
+            offset = entry["size"]
+            # 对齐到行首，避免从半行开始解析
+            f.seek(offset - 1)
+            if f.read(1) != b"\n":
+                f.readline()
+                offset = f.tell()
+            line = self._count_lines(f, offset)
+
+        return {
+            "file": f,
+            "inode": stat.st_ino,
+            "offset": offset,
+            "line": line,
+            "synced": synced,
+            "pending_offset": None,
+            "pending_since": 0.0,
+        }
+
+    @staticmethod
+    def _synced_key(entry: Optional[Dict[str, Any]]) -> Optional[List[Any]]:
+        """清单条目中标识一次同步入库的部分 [size, sha256]"""
+        if not entry:
+            return None
+        return [entry.get("size"), entry.get("sha256")]
+
+    def _close(self, rel_path: str) -> None:
+        state = self._files.pop(rel_path, None)
+        if state:
+            state["file"].close()
+
+    # 读取与解析
+    def _read_records(
+        self, rel_path: str, state: Dict[str, Any], final: bool = False
+    ) -> Tuple[List[Document], int, int]:
+        """
+        从 state["offset"] 开始读取新内容，返回 (文档列表, 新偏移, 新行号)。
+        final=True 表示文件已轮转走，读完剩余内容（包括没有换行结尾的最后一行）。
+        """
+        f = state["file"]
+        f.seek(state["offset"])
+        data = f.read(self.max_read_bytes)
+        at_eof = len(data) < self.max_read_bytes
+        end = len(data) if final else data.rfind(b"\n") + 1
+        if end == 0:
+            return [], state["offset"], state["line"]
+        lines = data[:end].splitlines(keepends=True)
+        records = list(self.assembler.iter_records(lines))
+
+        consumed = end
+        consumed_lines = len(lines)
+        if records and not final:
+            # 最后一条记录可能还不完整：暂不写入，下次从它的起点重新读取
+            last_line, last_offset = records[-1][0], records[-1][1]
+            if not at_eof:
+                # 本次没读到文件末尾，后面还有内容；只有一条记录时直接写入，保证前进
+                hold = len(records) > 1
+            else:
+                pending_offset = state["offset"] + last_offset
+                if state["pending_offset"] != pending_offset:
+                    state["pending_offset"] = pending_offset
+                    state["pending_since"] = time.time()
+                hold = time.time() - state["pending_since"] < self.record_idle
+            if hold:
+                records = records[:-1]
+                consumed = last_offset
+                consumed_lines = last_line - 1
+
+        documents = []
+        record_keys = ["line", "line_count", "offset", "length"] + STRUCTURED_KEYS
+        for line_no, offset, length, record_lines in records:
+            metadata = {
+                "line": state["line"] + line_no,
+                "line_count": len(record_lines),
+            }
+            metadata.update(extract_metadata(record_lines[0]))
+            if not final:
+                # 已轮转走的文件不能再按原路径和偏移读取，保留原文
+                metadata["offset"] = state["offset"] + offset
+                metadata["length"] = length
+            document = Document(
+                id_=record_document_id(
+                    state["inode"],
+                    None if final else state["offset"] + offset,
+                    state["line"] + line_no,
+                ),
+                text="\n".join(record_lines),
+                metadata=metadata,
+                excluded_embed_metadata_keys=list(record_keys),
+                excluded_llm_metadata_keys=list(record_keys),
+            )
+            self.log_system._tag_source(document, rel_path)
+            documents.append(document)
+        return documents, state["offset"] + consumed, state["line"] + consumed_lines
+
+    def _append(
+        self, rel_path: str, state: Dict[str, Any], final: bool = False
+    ) -> bool:
+        """读取并写入一个文件的新记录，成功后推进检查点；返回是否有新记录"""
+        documents, offset, line = self._read_records(rel_path, state, final)
+        for i in range(0, len(documents), self.batch_size):
+            self.log_system.append_documents(documents[i : i + self.batch_size])
+            self.stats["batches"] += 1
+        self.stats["records"] += len(documents)
+        changed = offset != state["offset"]
+        state["offset"], state["line"] = offset, line
+        if changed or final:
+            self.checkpoints[rel_path] = {
+                "inode": state["inode"],
+                "offset": offset,
+                "line": line,
+                "synced": state["synced"],
+                "updated": time.time(),
+            }
+        return changed
+
+    def _poll_file(self, rel_path: str) -> bool:
+        file_path = os.path.join(self.log_path, rel_path)
+        state = self._files.get(rel_path)
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            stat = None
+
+        rotated = False
+        if state and (stat is None or stat.st_ino != state["inode"]):
+            logger.info(f"日志文件已轮转: {rel_path}，读取旧文件剩余内容")
+            self._append(rel_path, state, final=True)
+            self._close(rel_path)
+            self.checkpoints.pop(rel_path, None)
+            self.stats["rotations"] += 1
+            state = None
+            rotated = True
+        if stat is None:
+            return rotated
+
+        if state is not None and not rotated:
+            entry = self.log_system.manifest.files.get(rel_path)
+            if entry and self._synced_key(entry) != state["synced"]:
+                # 同步重新解析了该文件（已删除并重写其全部向量），从清单记录的大小接续
+                logger.info(f"日志文件已由同步重新入库: {rel_path}，重新定位")
+                self._close(rel_path)
+                self.checkpoints.pop(rel_path, None)
+                state = None
+        if state is None:
+            state = self._open(rel_path, rotated=rotated)
+            self._files[rel_path] = state
+        elif stat.st_size < state["offset"]:
+            logger.info(f"日志文件被截断: {rel_path}，从头开始读取")
+            state["offset"], state["line"] = 0, 0
+            state["pending_offset"] = None
+            self.stats["truncations"] += 1
+        return self._append(rel_path, state) or rotated
+
+    def poll(self) -> int:
+        """轮询一次所有跟踪的文件，返回写入的记录数"""
+        records_before = self.stats["records"]
+        changed = False
+        # 同步可能由其他进程完成，按清单和集合布局文件的变化重新加载
+        self.log_system.reload_if_changed()
+        if self._generation != self.log_system.index_generation:
+            # 全量重建切换了集合：丢弃检查点，按新的入库清单重新定位
+            logger.info("索引已重建，按新的入库清单重新定位跟踪位置")
+            for rel_path in list(self._files):
+                self._close(rel_path)
+            self.checkpoints = {}
+            self._generation = self.log_system.index_generation
+            changed = True
+        current = set(self._list_files())
+        for rel_path in sorted(current | set(self._files)):
+            try:
+                # 读取、写入和推进位置都在入库锁内，不与（其他进程的）同步交错
+                with self.log_system._ingest_lock:
+                    self.log_system.reload_if_changed()
+                    changed = self._poll_file(rel_path) or changed
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"跟踪日志文件失败 {rel_path}: {e}")
+                # 关闭句柄，下次按检查点重新打开
+                self._close(rel_path)
+        for rel_path in set(self._files) - current:
+            self._close(rel_path)
+        if changed:
+            try:
+                self._save_checkpoints()
+            except Exception as e:
+                logger.error(f"保存跟踪检查点失败: {e}")
+        self.stats["polls"] += 1
+        return self.stats["records"] - records_before
+
+    # 运行方式
+    def run_forever(self) -> None:
+        logger.info(f"开始跟踪日志: {self.log_path} {self.patterns}")
+        while not self._stop.is_set():
+            records = self.poll()
+            if records:
+                logger.info(f"跟踪写入 {records} 条新日志记录")
+            self._stop.wait(self.interval)
+        for rel_path in list(self._files):
+            self._close(rel_path)
+
+    def start(self) -> None:
+        """在后台守护线程中运行（Django 进程内使用）"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self.run_forever, name="log-tailer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+
+if __name__ == "__main__":
+    # 独立进程运行：python log_tailer.py --log-path ./data/log
+    # 与 Django 进程使用同一份配置（LOG_SYSTEM_OPTIONS、术语表），入库选项一致，
+    # 启动同步不会因选项不同而重新解析、嵌入全部文件
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "deepseek_project.settings")
+    from django.conf import settings
+
+    from deepseek_api.glossary import GLOSSARY_ENTRIES
+    from topklogsystem import TopKLogSystem
+
+    tailer_options = dict(getattr(settings, "LOG_TAILER", {}))
+    parser = argparse.ArgumentParser(description="实时跟踪日志并写入向量库")
+    parser.add_argument("--log-path", default="./data/log")
+    parser.add_argument("--vector-store-path", default="./data/vector_stores")
+    parser.add_argument("--llm", default="deepseek-r1:7b")
+    parser.add_argument("--embedding-model", default="bge-large:latest")
+    parser.add_argument("--pattern", action="append", dest="patterns")
+    parser.add_argument(
+        "--interval", type=float, default=tailer_options.get("interval", 2.0)
+    )
+    args = parser.parse_args()
+
+    system = TopKLogSystem(
+        log_path=args.log_path,
+        llm=args.llm,
+        embedding_model=args.embedding_model,
+        vector_store_path=args.vector_store_path,
+        glossary=GLOSSARY_ENTRIES,
+        **getattr(settings, "LOG_SYSTEM_OPTIONS", {}),
+    )
+    tailer = LogTailer(
+        system,
+        patterns=args.patterns or tailer_options.get("patterns"),
+        interval=args.interval,
+    )
+    try:
+        tailer.run_forever()
+    except KeyboardInterrupt:
+        tailer.stop()
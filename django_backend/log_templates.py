@@ -0,0 +1,170 @@
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 变量掩码：按顺序替换，先匹配更长/更具体的模式
+MASK_PATTERNS: List[Tuple[str, "re.Pattern"]] = [
+    (
+        "<TS>",
+        re.compile(
+            r"\d{4}[-/]\d{1,2}[-/]\d{1,2}[T ]\d{1,2}:\d{2}:\d{2}(?:[.,]\d+)?"
+            r"(?:Z|[+-]\d{2}:?\d{2})?"
+        ),
+    ),
+    (
+        "<TS>",
+        re.compile(
+            r"\b(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+\d{1,2}\s+"
+            r"\d{2}:\d{2}:\d{2}\b"
+        ),
+    ),
+    ("<TS>", re.compile(r"\b\d{1,2}:\d{2}:\d{2}(?:[.,]\d+)?\b")),
+    (
+        "<UUID>",
+        re.compile(
+            r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-"
+            r"[0-9a-fA-F]{12}\b"
+        ),
+    ),
+    ("<IP>", re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b")),
+    ("<HEX>", re.compile(r"\b0x[0-9a-fA-F]+\b")),
+    ("<HEX>", re.compile(r"\b[0-9a-fA-F]{12,}\b")),
+    # 订单号、请求 ID 之类字母前缀 + 长数字的标识符
+    ("<ID>", re.compile(r"(?<![A-Za-z0-9])[A-Za-z_]+\d{3,}[A-Za-z0-9_]*")),
+    ("<NUM>", re.compile(r"(?<![A-Za-z0-9])[-+]?\d+(?:\.\d+)?")),
+]
+
+# 识别行内时间戳（用于 first_seen / last_seen）
+TIMESTAMP_PATTERN = re.compile(
+    r"\d{4}[-/]\d{1,2}[-/]\d{1,2}[T ]\d{1,2}:\d{2}:\d{2}(?:[.,]\d+)?"
+    r"|\b(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+\d{1,2}\s+"
+    r"\d{2}:\d{2}:\d{2}\b"
+)
+
+WILDCARD = "<*>"
+
+
+def mask_variables(line: str) -> str:
+    """把时间戳、IP、UUID、十六进制串、数字等易变部分替换为占位符"""
+    for placeholder, pattern in MASK_PATTERNS:
+        line = pattern.sub(placeholder, line)
+    return line
+
+
+def extract_timestamp(line: str) -> Optional[str]:
+    match = TIMESTAMP_PATTERN.search(line)
+    return match.group(0) if match else None
+
+
+class LogCluster:
+    """一个日志模板及其统计信息"""
+
+    __slots__ = (
+        "tokens",
+        "count",
+        "first_seen",
+        "last_seen",
+        "first_line",
+        "samples",
+    )
+
+    def __init__(self, tokens: List[str], line_no: int) -> None:
+        self.tokens = tokens
+        self.count = 0
+        self.first_seen: Optional[str] = None
+        self.last_seen: Optional[str] = None
+        self.first_line = line_no
+        self.samples: List[str] = []
+
+    @property
+    def template(self) -> str:
+        return " ".join(self.tokens)
+
+
+class TemplateMiner:
+    """
+    Drain 风格的在线日志模板挖掘。
+
+    先用 mask_variables 掩掉明显的变量，再按 token 数和前 depth 个 token
+    把日志行路由到固定深度的前缀树叶子，叶子内按 token 相似度匹配已有模板；
+    相似度不低于 sim_threshold 时合并，不同位置的 token 泛化为 <*>。
+    """
+
+    def __init__(
+        self,
+        depth: int = 4,
+        sim_threshold: float = 0.4,
+        max_children: int = 100,
+        max_samples: int = 3,
+    ) -> None:
+        self.depth = max(depth, 3)
+        self.sim_threshold = sim_threshold
+        self.max_children = max_children
+        self.max_samples = max_samples
+        self.root: Dict = {}
+        self.clusters: List[LogCluster] = []
+
+    @staticmethod
+    def _has_digit(token: str) -> bool:
+        return any(ch.isdigit() for ch in token)
+
+    def _leaf(self, tokens: List[str]) -> List[LogCluster]:
+        """沿前缀树找到（或创建）tokens 对应的叶子簇列表"""
+        node = self.root.setdefault(len(tokens), {})
+        for token in tokens[: self.depth - 2]:
+            # 含数字的 token 多半是变量，统一走通配分支
+            key = WILDCARD if self._has_digit(token) else token
+            if key not in node:
+                if len(node) >= self.max_children:
+                    key = WILDCARD
+                node = node.setdefault(key, {})
+            else:
+                node = node[key]
+        return node.setdefault(None, [])
+
+    @staticmethod
+    def _similarity(template: List[str], tokens: List[str]) -> Tuple[float, int]:
+        same = 0
+        wildcards = 0
+        for t1, t2 in zip(template, tokens):
+            if t1 == WILDCARD:
+                wildcards += 1
+            elif t1 == t2:
+                same += 1
+        return same / len(template), wildcards
+
+    def add(self, line: str, line_no: int = 0) -> Optional[LogCluster]:
+        line = line.strip()
+        if not line:
+            return None
+        tokens = mask_variables(line).split()
+        leaf = self._leaf(tokens)
+
+        best: Optional[LogCluster] = None
+        best_score = (-1.0, -1)
+        for cluster in leaf:
+            score = self._similarity(cluster.tokens, tokens)
+            if score > best_score:
+                best, best_score = cluster, score
+
+        if best is None or best_score[0] < self.sim_threshold:
+            best = LogCluster(tokens, line_no)
+            leaf.append(best)
+            self.clusters.append(best)
+        else:
+            best.tokens = [
+                t1 if t1 == t2 else WILDCARD for t1, t2 in zip(best.tokens, tokens)
+            ]
+
+        best.count += 1
+        timestamp = extract_timestamp(line)
+        if timestamp:
+            if best.first_seen is None:
+                best.first_seen = timestamp
+            best.last_seen = timestamp
+        if len(best.samples) < self.max_samples:
+            best.samples.append(line)
+        return best
+
+    def add_lines(self, lines: Iterable[str]) -> None:
+        for line_no, line in enumerate(lines, 1):
+            self.add(line, line_no)
@@ -0,0 +1,146 @@
+import logging
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from text_chunking import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# 未配置的模型使用的预算：total 为 prompt 总 token 数（不含生成部分），
+# 其余为总预算扣除系统提示和问题后，各组成部分的份额
+DEFAULT_BUDGET: Dict[str, float] = {
+    "total": 8192,
+    "history": 0.3,
+    "logs": 0.5,
+    "web": 0.2,
+}
+
+
+class BudgetResult(NamedTuple):
+    """裁剪结果：各组成部分保留的条目（可能截断）和 token 统计"""
+
+    items: Dict[str, List[str]]
+    dropped: Dict[str, int]
+    usage: Dict[str, Any]
+
+
+class PromptBudget:
+    """
+    按模型的 token 预算裁剪 prompt 的历史对话、日志上下文和联网结果。
+
+    固定部分（系统提示、指令模板、问题）先扣除，剩余预算按份额分给各组成部分；
+    某部分用不完的额度按份额转给仍超出的部分。每部分的条目按价值从高到低传入，
+    超出额度时从价值最低的一端丢弃；价值最高的一条也放不下时截断到额度内。
+    budgets: 模型名 → 预算，模型名可写完整名称（"qwen3:8b"）或不带标签（"qwen3"），
+    "default" 覆盖 DEFAULT_BUDGET；未写的键沿用默认值。
+    """
+
+    def __init__(
+        self,
+        budgets: Optional[Dict[str, Dict[str, float]]] = None,
+        counter: Callable[[str], int] = count_tokens,
+    ) -> None:
+        budgets = dict(budgets or {})
+        self.default = dict(DEFAULT_BUDGET, **budgets.pop("default", {}))
+        self.budgets = {
+            name.lower(): dict(self.default, **budget)
+            for name, budget in budgets.items()
+        }
+        self.count = counter
+
+    def budget_for(self, model_name: Optional[str]) -> Dict[str, float]:
+        name = (model_name or "").strip().lower()
+        budget = self.budgets.get(name) or self.budgets.get(name.split(":")[0])
+        return budget or self.default
+
+    @staticmethod
+    def allocate(
+        available: int, demands: Dict[str, int], shares: Dict[str, float]
+    ) -> Dict[str, int]:
+        """按份额分配 available 个 token；需求小于份额的部分只取所需，余量再分给其他部分"""
+        allocation = {name: 0 for name in demands}
+        pending = {name for name, demand in demands.items() if demand > 0}
+        remaining = max(0, available)
+        while pending and remaining > 0:
+            total_share = sum(max(shares.get(name, 0.0), 0.0) for name in pending)
+            if total_share <= 0:
+                break
+            satisfied = set()
+            for name in pending:
+                quota = int(remaining * max(shares.get(name, 0.0), 0.0) / total_share)
+                if demands[name] - allocation[name] <= quota:
+                    satisfied.add(name)
+            if not satisfied:
+                # 全部超出：按份额分完剩余额度
+                for name in pending:
+                    share = max(shares.get(name, 0.0), 0.0)
+                    allocation[name] += int(remaining * share / total_share)
+                break
+            for name in satisfied:
+                remaining -= demands[name] - allocation[name]
+                allocation[name] = demands[name]
+            pending -= satisfied
+        return allocation
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """保留开头不超过 max_tokens 的部分（按字符二分查找）"""
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count(text[:middle]) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return text[:low]
+
+    def fit(
+        self,
+        model_name: Optional[str],
+        fixed: Dict[str, str],
+        components: Dict[str, List[str]],
+    ) -> BudgetResult:
+        """
+        :param fixed: 不裁剪的部分，如 {"system": 系统提示, "query": 问题及指令模板}
+        :param components: 组成部分 → 条目文本，按价值从高到低排列
+        """
+        budget = self.budget_for(model_name)
+        usage: Dict[str, Any] = {name: self.count(text) for name, text in fixed.items()}
+        fixed_tokens = sum(usage.values())
+        counts = {
+            name: [self.count(item) for item in items]
+            for name, items in components.items()
+        }
+        total = int(budget["total"])
+        if fixed_tokens > total:
+            logger.warning(
+                f"系统提示和问题已占用 {fixed_tokens} token，超过预算 {total}"
+            )
+        allocation = self.allocate(
+            total - fixed_tokens,
+            {name: sum(tokens) for name, tokens in counts.items()},
+            budget,
+        )
+
+        kept: Dict[str, List[str]] = {}
+        dropped: Dict[str, int] = {}
+        for name, items in components.items():
+            limit, used = allocation[name], 0
+            kept[name] = []
+            for item, tokens in zip(items, counts[name]):
+                if used + tokens > limit:
+                    if not kept[name]:
+                        item = self.truncate(item, limit)
+                        if item:
+                            kept[name].append(item)
+                            used += self.count(item)
+                    break
+                kept[name].append(item)
+                used += tokens
+            dropped[name] = len(items) - len(kept[name])
+            usage[name] = used
+        usage["total"] = sum(usage.values())
+        usage["budget"] = total
+        return BudgetResult(kept, dropped, usage)
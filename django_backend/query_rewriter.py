@@ -0,0 +1,302 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from query_cache import QueryCache
+
+logger = logging.getLogger(__name__)
+
+
+class AhoCorasick:
+    """
+    多模式字符串匹配自动机（Aho-Corasick），模式按小写匹配。
+    构建后一次扫描文本即可找出全部模式的全部出现位置，耗时与模式数量无关。
+    """
+
+    def __init__(self, patterns: Iterable[str]) -> None:
+        self.patterns: List[str] = []
+        # 每个状态的转移表、失败指针、到达该状态时匹配到的模式编号
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._outputs: List[List[int]] = [[]]
+        for pattern in patterns:
+            self._insert(pattern.lower())
+        self._link()
+
+    def _insert(self, pattern: str) -> None:
+        if not pattern:
+            return
+        state = 0
+        for char in pattern:
+            nxt = self._goto[state].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+            state = nxt
+        self._outputs[state].append(len(self.patterns))
+        self.patterns.append(pattern)
+
+    def _link(self) -> None:
+        """按层序计算失败指针，并把失败链上的输出合并到当前状态"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                if self._fail[nxt] == nxt:
+                    self._fail[nxt] = 0
+                self._outputs[nxt] = (
+                    self._outputs[nxt] + self._outputs[self._fail[nxt]]
+                )
+
+    def find(self, text: str) -> List[Tuple[int, int, int]]:
+        """返回全部匹配 (起始位置, 结束位置, 模式编号)，按结束位置排序"""
+        matches = []
+        state = 0
+        for end, char in enumerate(_lower(text), 1):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for index in self._outputs[state]:
+                matches.append((end - len(self.patterns[index]), end, index))
+        return matches
+
+
+def _lower(text: str) -> str:
+    """逐字符转小写；个别字符小写后长度变化时保留原字符，保证位置与原文一致"""
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return "".join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+
+def _is_word_char(char: str) -> bool:
+    """ASCII 字母或数字；空串（文本边界）返回 False"""
+    return char.isascii() and char.isalnum()
+
+
+class CompiledTables(NamedTuple):
+    """编译后的改写表和同义词表，整体替换，检索线程取快照使用"""
+
+    automaton: AhoCorasick
+    # 模式编号 → 改写后的文本，None 表示该模式只用于同义词识别
+    replacements: List[Optional[str]]
+    # 模式编号 → 命中后需要补充的主词；模式本身是主词时记入 present
+    triggers: List[Tuple[str, ...]]
+    present: List[Tuple[str, ...]]
+    # 模式编号 → 改写后文本中已包含的 (需补充的主词, 已出现的主词)
+    replacement_terms: List[Tuple[Set[str], Set[str]]]
+    # 主词的补充顺序（同义词表中的顺序）
+    order: Dict[str, int]
+
+
+class QueryRewriter:
+    """
+    查询改写：口语化/拼写/缩写替换 + 同义词主词补充，一次扫描完成。
+
+    改写表和同义词表编译为一个 Aho-Corasick 自动机，扫描原查询得到全部命中：
+    - 改写词条按最左最长、互不重叠的原则替换；
+    - 同义词命中（包括替换后文本中的命中，编译时预先算好）时，
+      查询中还没有该组主词就在末尾补充主词。
+    英文/数字词条按单词边界匹配，避免 "io" 命中 "connection"；匹配不区分大小写。
+
+    path 指向 JSON 文件 {"rewrites": {...}, "synonyms": {...}} 时，文件中的词条
+    覆盖/补充内置词表；文件修改后在下一次改写时自动重新编译（最多每
+    check_interval 秒检查一次 mtime），不需要重启服务。最近的改写结果缓存在 LRU 中。
+    """
+
+    def __init__(
+        self,
+        rewrites: Dict[str, str],
+        synonyms: Dict[str, List[str]],
+        path: Optional[str] = None,
+        cache_size: int = 4096,
+        check_interval: float = 2.0,
+        on_reload: Optional[Callable[[Dict[str, List[str]]], None]] = None,
+    ) -> None:
+        self.default_rewrites = dict(rewrites)
+        self.default_synonyms = {k: list(v) for k, v in synonyms.items()}
+        self.path = path
+        self.check_interval = check_interval
+        # 同义词表变化后的回调（更新知识库路由和分词词典）
+        self.on_reload = on_reload
+        self.rewrites = self.default_rewrites
+        self.synonyms = self.default_synonyms
+        self.cache = QueryCache(cache_size, ttl=float("inf"))
+        self._lock = threading.Lock()
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._checked_at = 0.0
+        self._tables = self._compile(self.rewrites, self.synonyms)
+        if path:
+            self.reload()
+
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload(self, force: bool = False) -> bool:
+        """文件有变化（或 force）时重新读取并编译词表，返回是否重新编译"""
+        if not self.path:
+            return False
+        with self._lock:
+            self._checked_at = time.monotonic()
+            stamp = self._file_stamp()
+            if stamp == self._stamp and not force:
+                return False
+            rewrites = dict(self.default_rewrites)
+            synonyms = {k: list(v) for k, v in self.default_synonyms.items()}
+            if stamp is not None:
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                    rewrites.update(data.get("rewrites") or {})
+                    synonyms.update(data.get("synonyms") or {})
+                except Exception as e:
+                    # 文件写到一半或格式错误时保留当前词表，文件再次修改后重试
+                    logger.error(f"读取查询改写词表失败 {self.path}: {e}")
+                    self._stamp = stamp
+                    return False
+            self._tables = self._compile(rewrites, synonyms)
+            self.rewrites, self.synonyms = rewrites, synonyms
+            self._stamp = stamp
+            self.cache.clear()
+        logger.info(
+            f"查询改写词表已加载: {len(rewrites)} 条改写, {len(synonyms)} 组同义词"
+        )
+        if self.on_reload is not None:
+            self.on_reload(synonyms)
+        return True
+
+    def _maybe_reload(self) -> None:
+        if self.path and time.monotonic() - self._checked_at >= self.check_interval:
+            self.reload()
+
+    @staticmethod
+    def _compile(
+        rewrites: Dict[str, str], synonyms: Dict[str, List[str]]
+    ) -> CompiledTables:
+        patterns: Dict[str, Dict[str, object]] = {}
+
+        def entry(pattern: str) -> Dict[str, object]:
+            return patterns.setdefault(
+                pattern.lower(),
+                {"replacement": None, "triggers": set(), "present": set()},
+            )
+
+        for key, value in rewrites.items():
+            if key:
+                entry(key)["replacement"] = value
+        order: Dict[str, int] = {}
+        for main_word, syns in synonyms.items():
+            order[main_word] = len(order)
+            if main_word:
+                entry(main_word)["present"].add(main_word)
+            for syn in syns:
+                if syn:
+                    entry(syn)["triggers"].add(main_word)
+
+        items = list(patterns.items())
+        automaton = AhoCorasick(pattern for pattern, _ in items)
+        tables = CompiledTables(
+            automaton,
+            [value["replacement"] for _, value in items],
+            [tuple(value["triggers"]) for _, value in items],
+            [tuple(value["present"]) for _, value in items],
+            [],
+            order,
+        )
+        # 替换文本中的同义词/主词命中与原查询无关，编译时算好
+        for replacement in tables.replacements:
+            if replacement is None:
+                tables.replacement_terms.append((set(), set()))
+                continue
+            triggered: Set[str] = set()
+            present: Set[str] = set()
+            for start, end, index in QueryRewriter._matches(tables, replacement):
+                triggered.update(tables.triggers[index])
+                present.update(tables.present[index])
+            tables.replacement_terms.append((triggered, present))
+        return tables
+
+    @staticmethod
+    def _matches(tables: CompiledTables, text: str) -> List[Tuple[int, int, int]]:
+        """自动机命中中去掉 ASCII 词条在单词中间的命中"""
+        matches = []
+        for start, end, index in tables.automaton.find(text):
+            pattern = tables.automaton.patterns[index]
+            if _is_word_char(pattern[0]) and _is_word_char(text[start - 1 : start]):
+                continue
+            if _is_word_char(pattern[-1]) and _is_word_char(text[end : end + 1]):
+                continue
+            matches.append((start, end, index))
+        return matches
+
+    def rewrite(self, query: str) -> str:
+        """改写查询：替换口语化/拼写/缩写词条，并在末尾补充命中的同义词主词"""
+        self._maybe_reload()
+        tables = self._tables
+        # 缓存值带上编译时的词表，重新加载期间写入的旧结果不会被使用
+        cached = self.cache.get(query)
+        if cached is not None and cached[0] is tables:
+            return cached[1]
+        matches = self._matches(tables, query)
+
+        # 改写词条：按起点升序、长度降序贪心选取互不重叠的命中
+        selected: List[Tuple[int, int, int]] = []
+        covered_until = 0
+        for start, end, index in sorted(matches, key=lambda m: (m[0], m[0] - m[1])):
+            if tables.replacements[index] is not None and start >= covered_until:
+                selected.append((start, end, index))
+                covered_until = end
+
+        parts: List[str] = []
+        triggered: Set[str] = set()
+        present: Set[str] = set()
+        position = 0
+        for start, end, index in selected:
+            parts.append(query[position:start])
+            parts.append(tables.replacements[index])
+            terms = tables.replacement_terms[index]
+            triggered |= terms[0]
+            present |= terms[1]
+            position = end
+        parts.append(query[position:])
+
+        # 同义词：只统计没有被替换掉的原文中的命中
+        spans = iter(selected)
+        span = next(spans, None)
+        for start, end, index in sorted(matches):
+            while span is not None and span[1] <= start:
+                span = next(spans, None)
+            if span is not None and end > span[0]:
+                continue
+            triggered.update(tables.triggers[index])
+            present.update(tables.present[index])
+
+        expansion = sorted(triggered - present, key=tables.order.__getitem__)
+        result = "".join(parts) + "".join(f" {word}" for word in expansion)
+        self.cache.put(query, (tables, result))
+        return result
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "path": self.path,
+            "rewrites": len(self.rewrites),
+            "synonyms": len(self.synonyms),
+            "patterns": len(self._tables.automaton.patterns),
+            "cache": self.cache.stats(),
+        }
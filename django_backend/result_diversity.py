@@ -0,0 +1,110 @@
+import hashlib
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from log_templates import mask_variables
+
+_BIT_SHIFTS = np.arange(64, dtype=np.uint64)
+
+
+def simhash(tokens: Sequence[str]) -> int:
+    """64 位 SimHash：特征为词和相邻词对，按出现次数加权投票"""
+    features = Counter(tokens)
+    features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    if not features:
+        return 0
+    hashes = np.array(
+        [
+            int.from_bytes(
+                hashlib.blake2b(f.encode("utf-8"), digest_size=8).digest(), "little"
+            )
+            for f in features
+        ],
+        dtype=np.uint64,
+    )
+    weights = np.fromiter(features.values(), dtype=np.int64, count=len(features))
+    bits = ((hashes[:, None] >> _BIT_SHIFTS) & np.uint64(1)).astype(np.int64)
+    votes = weights @ (2 * bits - 1)
+    return int(((votes > 0).astype(np.uint64) << _BIT_SHIFTS).sum())
+
+
+def hamming_matrix(fingerprints: Sequence[int]) -> np.ndarray:
+    """两两之间的汉明距离矩阵"""
+    values = np.array(fingerprints, dtype=np.uint64)
+    xor = values[:, None] ^ values[None, :]
+    bits = np.unpackbits(xor.reshape(-1).view(np.uint8))
+    return bits.reshape(len(values), len(values), 64).sum(axis=2)
+
+
+def drop_near_duplicates(
+    results: List[Dict],
+    tokenize: Callable[[str], List[str]],
+    max_distance: int = 3,
+) -> List[Dict]:
+    """
+    去掉近似重复的结果（同一条日志只是时间戳、ID、数字不同）。
+    先用 log_templates.mask_variables 掩码易变部分，再比较 SimHash 的汉明距离；
+    results 需按得分降序排列，保留每组中得分最高的一条，
+    被去掉的条数累加到保留结果的 "duplicates" 中。
+    """
+    if len(results) < 2:
+        return results
+    fingerprints = [
+        simhash(tokenize(mask_variables(item["content"]))) for item in results
+    ]
+    distances = hamming_matrix(fingerprints)
+    kept: List[int] = []
+    for i, item in enumerate(results):
+        close = [j for j in kept if distances[i, j] <= max_distance]
+        if close:
+            target = results[close[0]]
+            target["duplicates"] = (
+                target.get("duplicates", 0) + item.get("duplicates", 0) + 1
+            )
+            continue
+        kept.append(i)
+    return [results[i] for i in kept]
+
+
+def mmr_order(
+    relevance: Sequence[float],
+    embeddings: Sequence[Optional[Sequence[float]]],
+    lambda_mult: float = 0.7,
+    top_k: Optional[int] = None,
+) -> List[int]:
+    """
+    最大边际相关（MMR）重排，返回选中结果的下标顺序。
+    每一步选择 lambda * 相关度 - (1 - lambda) * 与已选结果的最大余弦相似度 最大的候选。
+    :param relevance: 相关度（如融合分），内部做 min-max 归一化
+    :param embeddings: 候选向量，缺失（None）的候选只按相关度参与
+    """
+    n = len(relevance)
+    top_k = n if top_k is None else min(top_k, n)
+    if n == 0 or top_k <= 0:
+        return []
+    scores = np.asarray(relevance, dtype=np.float64)
+    span = scores.max() - scores.min()
+    scores = (scores - scores.min()) / span if span > 0 else np.ones(n)
+
+    dim = next((len(e) for e in embeddings if e is not None), 0)
+    vectors = np.zeros((n, dim), dtype=np.float32)
+    for i, embedding in enumerate(embeddings):
+        if embedding is not None and len(embedding) == dim:
+            vectors[i] = embedding
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+    similarity = vectors @ vectors.T
+
+    selected: List[int] = []
+    max_similarity = np.zeros(n)
+    available = np.ones(n, dtype=bool)
+    for _ in range(top_k):
+        mmr = lambda_mult * scores - (1 - lambda_mult) * max_similarity
+        mmr[~available] = -np.inf
+        best = int(np.argmax(mmr))
+        selected.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, similarity[best])
+    return selected
@@ -0,0 +1,59 @@
+from typing import Dict, List, Optional, Tuple
+
+# 支持的融合策略
+FUSION_METHODS = ("rrf", "weighted")
+
+
+def reciprocal_rank_fusion(
+    legs: Dict[str, List[Tuple[str, float]]],
+    k: int = 60,
+    weights: Optional[Dict[str, float]] = None,
+) -> Dict[str, float]:
+    """
+    倒数排名融合（RRF）：score = Σ weight / (k + rank)，rank 从 1 开始。
+    只依赖各通道内的排名，不受余弦相似度与 BM25 分值量纲不同的影响。
+    :param legs: 通道名 → 按得分降序排列的 [(结果键, 原始分)]
+    """
+    weights = weights or {}
+    fused: Dict[str, float] = {}
+    for leg, ranked in legs.items():
+        weight = weights.get(leg, 1.0)
+        for rank, (key, _) in enumerate(ranked, 1):
+            fused[key] = fused.get(key, 0.0) + weight / (k + rank)
+    return fused
+
+
+def weighted_score_fusion(
+    legs: Dict[str, List[Tuple[str, float]]],
+    weights: Optional[Dict[str, float]] = None,
+) -> Dict[str, float]:
+    """
+    加权求和：各通道分数先做 min-max 归一化到 [0, 1]，再按权重相加。
+    通道只有一个结果（或分数全部相同）时归一化分记为 1。
+    """
+    weights = weights or {}
+    fused: Dict[str, float] = {}
+    for leg, ranked in legs.items():
+        if not ranked:
+            continue
+        weight = weights.get(leg, 1.0)
+        scores = [score for _, score in ranked]
+        low, high = min(scores), max(scores)
+        for key, score in ranked:
+            normalized = (score - low) / (high - low) if high > low else 1.0
+            fused[key] = fused.get(key, 0.0) + weight * normalized
+    return fused
+
+
+def fuse_scores(
+    legs: Dict[str, List[Tuple[str, float]]],
+    method: str = "rrf",
+    k: int = 60,
+    weights: Optional[Dict[str, float]] = None,
+) -> Dict[str, float]:
+    """按 method（"rrf" / "weighted"）融合多路检索结果，返回 结果键 → 融合分"""
+    if method == "rrf":
+        return reciprocal_rank_fusion(legs, k=k, weights=weights)
+    if method == "weighted":
+        return weighted_score_fusion(legs, weights=weights)
+    raise ValueError(f"不支持的融合策略: {method}，可选 {', '.join(FUSION_METHODS)}")
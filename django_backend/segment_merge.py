@@ -0,0 +1,32 @@
+from typing import Dict, List
+
+
+def size_tier(size: int, merge_factor: int, floor_size: int) -> int:
+    """段大小所在的层：小于 floor_size 为第 0 层，之后每大 merge_factor 倍升一层"""
+    tier, bound = 0, max(1, floor_size)
+    while size >= bound:
+        tier += 1
+        bound *= merge_factor
+    return tier
+
+
+def tiered_merge_groups(
+    sizes: List[int], merge_factor: int = 8, floor_size: int = 1024
+) -> List[List[int]]:
+    """
+    分层（log-structured）合并计划：按大小把段分层，某一层攒满 merge_factor 个段时
+    合并这一层，返回需要合并的段下标组（每组按下标升序）。
+    只有大小相近的段才会合并，每条记录在合并中最多被重写约
+    log(总数 / floor_size) / log(merge_factor) 次；合并结果可能进入上一层并使其
+    攒满，调用方合并后重新计划，直到没有需要合并的组。
+    """
+    tiers: Dict[int, List[int]] = {}
+    for position, size in enumerate(sizes):
+        tiers.setdefault(size_tier(size, merge_factor, floor_size), []).append(
+            position
+        )
+    return [
+        positions
+        for _, positions in sorted(tiers.items())
+        if len(positions) >= merge_factor
+    ]
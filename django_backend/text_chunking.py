@@ -0,0 +1,231 @@
+import re
+import logging
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:  # 可选依赖，缺失时使用字符估算
+    tiktoken = None
+
+_encoding = None
+_encoding_failed = False
+
+CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]")
+
+
+def _get_encoding():
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            # 离线环境首次加载编码表可能失败
+            logger.warning(f"加载 tiktoken 编码失败，改用字符估算: {e}")
+            _encoding_failed = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """
+    统计文本 token 数：优先使用 tiktoken (cl100k_base)；
+    不可用时按 CJK 字符 1 token、其他字符约 4 个 1 token 估算。
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+# 结构边界：返回每个小节的起始字符偏移
+MARKDOWN_HEADING = re.compile(r"^#{1,6}\s", re.MULTILINE)
+YAML_TOP_LEVEL = re.compile(r"^(?:---\s*$|[^\s#\-][^:\n]*:)", re.MULTILINE)
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+WHITESPACE = re.compile(r"\s")
+XML_TAG = re.compile(
+    r"<(/?)([A-Za-z_][\w:.\-]*)[^>]*?(/?)>|<!--.*?-->|<\?.*?\?>", re.DOTALL
+)
+
+
+def _xml_boundaries(text: str) -> List[int]:
+    """根元素下每个一级子元素的起始位置"""
+    boundaries = []
+    depth = 0
+    for match in XML_TAG.finditer(text):
+        closing, name, self_closing = match.group(1), match.group(2), match.group(3)
+        if name is None:
+            continue  # 注释或处理指令
+        if closing:
+            depth -= 1
+            continue
+        if depth == 1:
+            boundaries.append(match.start())
+        if not self_closing:
+            depth += 1
+    return boundaries
+
+
+def section_starts(text: str, kind: str) -> List[int]:
+    if kind == "markdown":
+        starts = [m.start() for m in MARKDOWN_HEADING.finditer(text)]
+    elif kind == "yaml":
+        starts = [m.start() for m in YAML_TOP_LEVEL.finditer(text)]
+    elif kind == "xml":
+        starts = _xml_boundaries(text)
+    else:
+        starts = [m.end() for m in PARAGRAPH_BREAK.finditer(text)]
+    return sorted(set([0] + [s for s in starts if 0 < s < len(text)]))
+
+
+def iter_text_windows(
+    lines: Iterable[str], kind: str = "text", window_chars: int = 1 << 20
+) -> Iterator[Tuple[int, str]]:
+    """
+    把按行读取的长文本分成约 window_chars 字符的窗口，产出 (窗口起始字符偏移, 文本)，
+    每个窗口单独切块，内存只保留一个窗口。窗口在小节边界（Markdown 标题前、
+    其他文本的空行后）结束；超过 window_chars 的 4 倍仍没有边界时在行尾结束。
+    """
+    buffer: List[str] = []
+    size = offset = 0
+    for line in lines:
+        if size >= window_chars:
+            if kind == "markdown":
+                boundary = MARKDOWN_HEADING.match(line) is not None
+            else:
+                boundary = not buffer[-1].strip()
+            if boundary or size >= window_chars * 4:
+                yield offset, "".join(buffer)
+                offset += size
+                buffer, size = [], 0
+        buffer.append(line)
+        size += len(line)
+    if buffer:
+        yield offset, "".join(buffer)
+
+
+def _cut_line(
+    text: str, start: int, end: int, tokens: int, piece_tokens: int
+) -> List[Tuple[int, int, int]]:
+    """
+    把超长的一行切成约 piece_tokens 的小片，切点尽量落在空白处，
+    找不到空白（如连续的中文）时按估算字符数切分。
+    """
+    chars_per_piece = max(1, (end - start) * piece_tokens // tokens)
+    pieces: List[Tuple[int, int, int]] = []
+    pos = start
+    while pos < end:
+        cut = min(pos + chars_per_piece, end)
+        if cut < end:
+            # 向前找最近的空白；片内没有空白时向后找，仍没有则硬切
+            space = max(text.rfind(" ", pos + 1, cut), text.rfind("\t", pos + 1, cut))
+            if space == -1:
+                forward = WHITESPACE.search(text, cut, min(cut + chars_per_piece, end))
+                space = forward.start() if forward else -1
+            if space != -1:
+                cut = space + 1
+        pieces.append((pos, cut, count_tokens(text[pos:cut])))
+        pos = cut
+    return pieces
+
+
+def _split_large(
+    text: str, start: int, end: int, chunk_tokens: int, overlap_tokens: int
+) -> List[Tuple[int, int]]:
+    """
+    按行做滑动窗口切分超长小节，相邻块重叠约 overlap_tokens；
+    超长单行先在空白处切成小片，同样参与滑动窗口和重叠。
+    """
+    # 行切分（保留换行符，便于偏移计算）
+    lines: List[Tuple[int, int]] = []
+    pos = start
+    while pos < end:
+        newline = text.find("\n", pos, end)
+        line_end = end if newline == -1 else newline + 1
+        lines.append((pos, line_end))
+        pos = line_end
+
+    # 超长行切成的小片不超过重叠长度，使硬切的片段之间也能保留重叠
+    piece_tokens = max(1, min(overlap_tokens or chunk_tokens, chunk_tokens // 4))
+    pieces: List[Tuple[int, int, int]] = []  # (start, end, tokens)
+    for line_start, line_end in lines:
+        tokens = count_tokens(text[line_start:line_end])
+        if tokens <= chunk_tokens:
+            pieces.append((line_start, line_end, tokens))
+        else:
+            pieces.extend(_cut_line(text, line_start, line_end, tokens, piece_tokens))
+
+    chunks: List[Tuple[int, int]] = []
+    window: List[Tuple[int, int, int]] = []
+    window_tokens = 0
+    # window 开头来自上一块重叠部分的片段数；只有重叠片段时不单独成块
+    carried = 0
+    for piece in pieces:
+        if window and window_tokens + piece[2] > chunk_tokens:
+            if len(window) == carried:
+                window, window_tokens = [], 0
+            else:
+                chunks.append((window[0][0], window[-1][1]))
+                # 保留末尾不超过 overlap_tokens 的片段作为下一块的开头
+                overlap: List[Tuple[int, int, int]] = []
+                overlap_total = 0
+                for prev in reversed(window):
+                    if overlap_total + prev[2] > overlap_tokens:
+                        break
+                    overlap.insert(0, prev)
+                    overlap_total += prev[2]
+                if overlap_total + piece[2] > chunk_tokens:
+                    overlap, overlap_total = [], 0
+                window, window_tokens = overlap, overlap_total
+            carried = len(window)
+        window.append(piece)
+        window_tokens += piece[2]
+    if len(window) > carried:
+        chunks.append((window[0][0], window[-1][1]))
+    return chunks
+
+
+def chunk_text(
+    text: str,
+    kind: str = "text",
+    chunk_tokens: int = 512,
+    overlap_tokens: int = 64,
+) -> List[Tuple[int, int]]:
+    """
+    结构感知的按 token 切块，返回每块在原文中的 (start, end) 字符偏移。
+    kind 为 markdown / yaml / xml / text：先按标题、YAML 顶层键、XML 一级元素
+    或段落切分小节，再把相邻小节合并到不超过 chunk_tokens；
+    超长小节按行滑动窗口切分，相邻块重叠约 overlap_tokens。
+    """
+    if not text.strip():
+        return []
+    if count_tokens(text) <= chunk_tokens:
+        return [(0, len(text))]
+
+    starts = section_starts(text, kind) + [len(text)]
+    chunks: List[Tuple[int, int]] = []
+    current: Optional[Tuple[int, int]] = None
+    current_tokens = 0
+    for section_start, section_end in zip(starts, starts[1:]):
+        tokens = count_tokens(text[section_start:section_end])
+        if tokens > chunk_tokens:
+            # 之前攒下的小节（如只有标题的小节）并入超长小节的第一块，不单独成块
+            split_start = current[0] if current else section_start
+            current, current_tokens = None, 0
+            chunks.extend(
+                _split_large(
+                    text, split_start, section_end, chunk_tokens, overlap_tokens
+                )
+            )
+            continue
+        if current and current_tokens + tokens > chunk_tokens:
+            chunks.append(current)
+            current, current_tokens = None, 0
+        current = (current[0] if current else section_start, section_end)
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return [(s, e) for s, e in chunks if text[s:e].strip()]
@@ -0,0 +1,397 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+from log_metadata import ERROR_LEVELS, normalize_level
+from segment_merge import tiered_merge_groups
+
+logger = logging.getLogger(__name__)
+
+# 索引格式版本，写入 ingest_options；格式变化时递增，已入库文件会重新解析
+TIME_INDEX_VERSION = 2
+# 分层合并的最小层：小于该行数的段都在第 0 层
+MERGE_FLOOR_ROWS = 4096
+
+
+class TimeEntry(NamedTuple):
+    """时间索引中的一条记录"""
+
+    ts: float
+    ts_end: float
+    kb: str
+    source: str
+    node_id: str
+    error: bool
+
+
+class TimeIndex:
+    """
+    按来源文件的有序时间戳索引，用于按时间窗口限定检索候选和统计错误突发。
+
+    每个来源保存若干个不可变的段（{md5(来源)[:16]}_{N}.npz），段内按 ts 排序：
+    ts / ts_end（Unix 秒）、是否错误级别、节点 id 的下标（refs，指向段内去重的 ids）。
+    模板文档每次出现各占一行（ts == ts_end），没有逐次时间戳的模板为首次/末次出现。
+    窗口查询对每个段做两次二分查找：ts <= until 的上界，以及
+    ts >= since - span 的下界（span 为该来源最长的 ts_end - ts），再按 ts_end >= since 过滤。
+    追加写入只新建段，按行数分层合并（见 segment_merge），同一层攒满 merge_factor
+    个段时合并；没有时间戳的记录不进入索引。
+    index.json 记录来源 → 知识库、段列表，段文件写完后才原子替换；
+    其他进程更新 index.json 后，查询和写入前按文件时间戳重新加载。
+    """
+
+    def __init__(self, directory: str, merge_factor: int = 8) -> None:
+        self.directory = directory
+        self.merge_factor = max(2, merge_factor)
+        self._lock = threading.RLock()
+        self._sources: Dict[str, Dict[str, Any]] = {}
+        self._loaded: Dict[str, Dict[str, np.ndarray]] = {}
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._orphans_removed = False
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, "index.json")
+
+    def _index_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self._index_path())
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _refresh(self) -> None:
+        """index.json 被其他进程更新后重新加载来源列表"""
+        if self._index_stamp() == self._stamp:
+            return
+        self._sources = {}
+        self._loaded.clear()
+        self._load()
+
+    def _load(self) -> None:
+        self._stamp = self._index_stamp()
+        try:
+            with open(self._index_path(), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == TIME_INDEX_VERSION:
+                self._sources = data["sources"]
+            else:
+                logger.warning("时间索引格式版本不一致，丢弃旧索引。")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"读取时间索引失败 {self.directory}: {e}，将按空索引处理")
+
+    def _prepare_write(self) -> None:
+        """写入前加载其他进程的更新；第一次写入时清理未登记的段文件"""
+        self._refresh()
+        if self._orphans_removed:
+            return
+        active = {
+            self._segment_name(entry["digest"], n)
+            for entry in self._sources.values()
+            for n in entry["segments"]
+        }
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz") and name not in active:
+                os.remove(os.path.join(self.directory, name))
+        self._orphans_removed = True
+
+    def _save(self) -> None:
+        tmp_path = f"{self._index_path()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"version": TIME_INDEX_VERSION, "sources": self._sources},
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp_path, self._index_path())
+        self._stamp = self._index_stamp()
+
+    @staticmethod
+    def _segment_name(digest: str, segment_id: int) -> str:
+        return f"{digest}_{segment_id}.npz"
+
+    def _segment(self, entry: Dict[str, Any], segment_id: int) -> Dict[str, np.ndarray]:
+        name = self._segment_name(entry["digest"], segment_id)
+        arrays = self._loaded.get(name)
+        if arrays is None:
+            with np.load(os.path.join(self.directory, name)) as data:
+                arrays = {key: data[key] for key in data.files}
+            self._loaded[name] = arrays
+        return arrays
+
+    def _write_segment(
+        self, entry: Dict[str, Any], arrays: Dict[str, np.ndarray]
+    ) -> int:
+        # ids 是去重的节点 id 表，其余数组每行一条记录，按 ts 排序
+        order = np.argsort(arrays["ts"], kind="stable")
+        arrays = {
+            key: value if key == "ids" else value[order]
+            for key, value in arrays.items()
+        }
+        segment_id = entry["next"]
+        entry["next"] += 1
+        name = self._segment_name(entry["digest"], segment_id)
+        with open(os.path.join(self.directory, name), "wb") as f:
+            np.savez(f, **arrays)
+        self._loaded[name] = arrays
+        return segment_id
+
+    @staticmethod
+    def _record_times(record: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+        """记录的 (ts, ts_end) 数组：有 occurrences 时每次出现一行，否则取元数据中的一行"""
+        occurrences = record.get("occurrences")
+        if occurrences is not None:
+            ts = np.asarray(occurrences, dtype=np.float64)
+            return ts, ts
+        metadata = record["metadata"]
+        if metadata.get("ts") is None:
+            return np.empty(0), np.empty(0)
+        return (
+            np.array([metadata["ts"]], dtype=np.float64),
+            np.array([metadata.get("ts_end", metadata["ts"])], dtype=np.float64),
+        )
+
+    def add(self, records: List[Dict[str, Any]]) -> None:
+        """
+        写入一批记录：{"id": 节点 id, "kb": 知识库, "source": 来源文件, "metadata": 元数据,
+        "occurrences": 模板每次出现的时间戳（可选，为空时不进入索引）}
+        """
+        groups: Dict[str, List[Tuple[Dict[str, Any], np.ndarray, np.ndarray]]] = {}
+        for record in records:
+            ts, ts_end = self._record_times(record)
+            if len(ts):
+                groups.setdefault(record["source"], []).append((record, ts, ts_end))
+        if not groups:
+            return
+        with self._lock:
+            self._prepare_write()
+            for source, group in groups.items():
+                entry = self._sources.get(source)
+                if entry is None:
+                    digest = hashlib.md5(source.encode("utf-8")).hexdigest()[:16]
+                    entry = {
+                        "kb": group[0][0]["kb"],
+                        "digest": digest,
+                        "segments": [],
+                        # 与 segments 对应的各段行数，分层合并使用
+                        "rows": [],
+                        "next": 0,
+                        "span": 0.0,
+                    }
+                    self._sources[source] = entry
+                counts = [len(ts) for _, ts, _ in group]
+                ts = np.concatenate([ts for _, ts, _ in group])
+                ts_end = np.concatenate([ts_end for _, _, ts_end in group])
+                error = np.array(
+                    [
+                        normalize_level(r["metadata"].get("level") or "")
+                        in ERROR_LEVELS
+                        for r, _, _ in group
+                    ],
+                    dtype=bool,
+                )
+                arrays = {
+                    "ts": ts,
+                    "ts_end": ts_end,
+                    "error": np.repeat(error, counts),
+                    "refs": np.repeat(np.arange(len(group), dtype=np.uint32), counts),
+                    "ids": np.array([r["id"] for r, _, _ in group], dtype=str),
+                }
+                entry["segments"].append(self._write_segment(entry, arrays))
+                entry["rows"].append(len(ts))
+                entry["span"] = max(entry["span"], float((ts_end - ts).max()))
+                self._maybe_merge(entry)
+            self._save()
+
+    def _maybe_merge(self, entry: Dict[str, Any]) -> None:
+        """按分层计划合并来源的段，合并结果进入上一层后可能再次触发合并"""
+        while True:
+            groups = tiered_merge_groups(
+                entry["rows"], self.merge_factor, MERGE_FLOOR_ROWS
+            )
+            if not groups:
+                return
+            self._merge(entry, [entry["segments"][p] for p in groups[0]])
+
+    def _merge(self, entry: Dict[str, Any], segment_ids: List[int]) -> None:
+        """把来源的若干个段合并为一个，节点 id 表合并去重"""
+        segments = [self._segment(entry, n) for n in segment_ids]
+        ids, inverse = np.unique(
+            np.concatenate([segment["ids"] for segment in segments]),
+            return_inverse=True,
+        )
+        refs, offset = [], 0
+        for segment in segments:
+            refs.append(inverse[segment["refs"].astype(np.int64) + offset])
+            offset += len(segment["ids"])
+        merged = {
+            key: np.concatenate([segment[key] for segment in segments])
+            for key in ("ts", "ts_end", "error")
+        }
+        merged["refs"] = np.concatenate(refs).astype(np.uint32)
+        merged["ids"] = ids
+        merged_id = self._write_segment(entry, merged)
+        kept = [
+            (segment_id, rows)
+            for segment_id, rows in zip(entry["segments"], entry["rows"])
+            if segment_id not in segment_ids
+        ]
+        entry["segments"] = [segment_id for segment_id, _ in kept] + [merged_id]
+        entry["rows"] = [rows for _, rows in kept] + [len(merged["ts"])]
+        self._remove_segments(entry, segment_ids)
+
+    def _remove_segments(self, entry: Dict[str, Any], segment_ids: List[int]) -> None:
+        for segment_id in segment_ids:
+            name = self._segment_name(entry["digest"], segment_id)
+            self._loaded.pop(name, None)
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError as e:
+                logger.warning(f"删除时间索引段失败 {name}: {e}")
+
+    def rename_source(self, old: str, new: str) -> None:
+        """来源改名（日志轮转）：段文件按新来源的摘要改名，记录内容不变"""
+        with self._lock:
+            self._prepare_write()
+            entry = self._sources.pop(old, None)
+            if entry is None:
+                return
+            stale = self._sources.pop(new, None)
+            if stale is not None:
+                self._remove_segments(stale, stale["segments"])
+            digest = hashlib.md5(new.encode("utf-8")).hexdigest()[:16]
+            for segment_id in entry["segments"]:
+                old_name = self._segment_name(entry["digest"], segment_id)
+                new_name = self._segment_name(digest, segment_id)
+                os.replace(
+                    os.path.join(self.directory, old_name),
+                    os.path.join(self.directory, new_name),
+                )
+                arrays = self._loaded.pop(old_name, None)
+                if arrays is not None:
+                    self._loaded[new_name] = arrays
+            entry["digest"] = digest
+            self._sources[new] = entry
+            self._save()
+
+    def delete_source(self, source: str) -> None:
+        with self._lock:
+            self._prepare_write()
+            entry = self._sources.pop(source, None)
+            if entry is None:
+                return
+            self._save()
+            self._remove_segments(entry, entry["segments"])
+
+    def _windows(
+        self,
+        since: float,
+        until: float,
+        knowledge_bases: Optional[Set[str]],
+        errors_only: bool,
+    ) -> Iterator[Tuple[str, Dict[str, Any], Dict[str, np.ndarray], np.ndarray]]:
+        """
+        逐个段给出 (来源, 索引项, 段, 命中行号)：二分查找定出候选行区间后，
+        按 ts_end >= since（及错误级别）过滤；调用方需持有 _lock
+        """
+        for source, entry in self._sources.items():
+            if knowledge_bases is not None and entry["kb"] not in knowledge_bases:
+                continue
+            for segment_id in entry["segments"]:
+                segment = self._segment(entry, segment_id)
+                ts = segment["ts"]
+                start = np.searchsorted(ts, since - entry["span"], side="left")
+                end = np.searchsorted(ts, until, side="right")
+                if start >= end:
+                    continue
+                mask = segment["ts_end"][start:end] >= since
+                if errors_only:
+                    mask &= segment["error"][start:end]
+                yield source, entry, segment, np.nonzero(mask)[0] + start
+
+    def lookup(
+        self,
+        since: float,
+        until: float,
+        knowledge_bases: Optional[Set[str]] = None,
+        errors_only: bool = False,
+    ) -> List[TimeEntry]:
+        """
+        时间区间 [since, until] 与记录区间 [ts, ts_end] 相交的记录，按 ts 排序；
+        模板文档每次出现各返回一条，同一节点 id 可能出现多次。
+        只需要节点 id 时用 node_ids，不为每行创建对象
+        """
+        found: List[TimeEntry] = []
+        with self._lock:
+            self._refresh()
+            windows = self._windows(since, until, knowledge_bases, errors_only)
+            for source, entry, segment, rows in windows:
+                ts, ids, refs = segment["ts"], segment["ids"], segment["refs"]
+                for row in rows:
+                    found.append(
+                        TimeEntry(
+                            float(ts[row]),
+                            float(segment["ts_end"][row]),
+                            entry["kb"],
+                            source,
+                            str(ids[refs[row]]),
+                            bool(segment["error"][row]),
+                        )
+                    )
+        found.sort(key=lambda item: item.ts)
+        return found
+
+    def node_ids(
+        self,
+        since: float,
+        until: float,
+        knowledge_bases: Optional[Set[str]] = None,
+        limit: Optional[int] = None,
+    ) -> Optional[Dict[str, List[str]]]:
+        """
+        时间区间内记录的去重节点 id，按知识库分组（不排序）；
+        去重后超过 limit 条时提前返回 None。
+        每个段先用 np.unique 对 refs 去重，只为不同的节点 id 创建 Python 对象，
+        模板的多次出现不会放大开销
+        """
+        found: Dict[str, List[str]] = {}
+        seen: Set[str] = set()
+        with self._lock:
+            self._refresh()
+            windows = self._windows(since, until, knowledge_bases, False)
+            for _, entry, segment, rows in windows:
+                unique_refs = np.unique(segment["refs"][rows])
+                if limit is not None and len(unique_refs) > limit:
+                    return None
+                names = [str(name) for name in segment["ids"][unique_refs]]
+                ids = found.setdefault(entry["kb"], [])
+                for name in names:
+                    if name not in seen:
+                        seen.add(name)
+                        ids.append(name)
+                if limit is not None and len(seen) > limit:
+                    return None
+        return found
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            self._refresh()
+            return {
+                "sources": len(self._sources),
+                "segments": sum(len(e["segments"]) for e in self._sources.values()),
+            }
+
+    def drop(self) -> None:
+        """删除整个索引目录"""
+        with self._lock:
+            self._sources = {}
+            self._loaded.clear()
+            shutil.rmtree(self.directory, ignore_errors=True)
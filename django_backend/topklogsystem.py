@@ -5,11 +5,31 @@ os.environ["ANONYMIZED_TELEMETRY"] = "false"
 os.environ["DISABLE_TELEMETRY"] = "1"
 os.environ["CHROMA_TELEMETRY_ENABLED"] = "false"
 
+import copy
 import json
+import uuid
+import hashlib
 import logging
 import threading
+import time
 import pandas as pd
-from typing import Any, Dict, List, Optional
+from array import array
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
 
 # langchain
 from langchain.prompts import (
@@ -28,17 +48,105 @@ from langchain_ollama import OllamaLLM, OllamaEmbeddings
 import chromadb
 from llama_index.core import Settings  # 全局
 from llama_index.core import Document
-from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, StorageContext
-from llama_index.vector_stores.chroma import ChromaVectorStore
+from llama_index.core import SimpleDirectoryReader
+from llama_index.core.ingestion import run_transformations
+from llama_index.core.schema import MetadataMode
 
 # 日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 import re
+import string
 from docx import Document as DocxDocument
 from PyPDF2 import PdfReader
 
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from flat_index import FLAT_DTYPES
+from index_jobs import IndexBuildCancelled, IndexBuildJob
+from ingest_lock import IngestLock
+from ingest_manifest import IngestManifest
+from knowledge_bases import (
+    VECTOR_BACKENDS,
+    BaseKnowledgeBaseStore,
+    FlatKnowledgeBaseStore,
+    KnowledgeBaseRouter,
+    KnowledgeBaseStore,
+    VectorHit,
+)
+from keyword_index import KEYWORD_INDEX_VERSION
+from keyword_tokenizer import KeywordTokenizer
+from log_metadata import (
+    STRUCTURED_KEYS,
+    build_where,
+    extract_metadata,
+    matches_where,
+    normalize_level,
+    parse_duration,
+    parse_time_bound,
+    parse_timestamp,
+    time_range,
+)
+from log_records import (
+    RECORD_ID_PREFIX,
+    LogRecordAssembler,
+    LogTextReader,
+    record_document_id,
+)
+from log_sources import (
+    compression_available,
+    iter_json_values,
+    open_binary,
+    open_text,
+    split_source_name,
+)
+from log_templates import TemplateMiner
+from prompt_budget import PromptBudget
+from query_cache import QueryCache
+from query_rewriter import QueryRewriter
+from result_diversity import drop_near_duplicates, mmr_order
+from result_fusion import FUSION_METHODS, fuse_scores
+from text_chunking import chunk_text, iter_text_windows
+from time_index import TIME_INDEX_VERSION, TimeEntry
+from vector_quantization import QUANTIZATIONS
+
+# CSV 中默认提升为元数据的列：元数据键 → 候选列名（大小写不敏感）
+DEFAULT_CSV_METADATA_COLUMNS = {
+    "timestamp": ["timestamp", "time", "datetime", "date", "时间", "时间戳"],
+    "level": ["level", "severity", "loglevel", "级别", "日志级别"],
+    "component": ["component", "module", "组件", "模块"],
+    "event_id": ["eventid", "event_id", "事件id", "事件ID"],
+    "host": ["host", "hostname", "主机", "主机名"],
+    "service": ["service", "app", "application", "服务", "服务名"],
+}
+
+# 支持入库的文件扩展名（.log/.txt/.json/.jsonl/.csv 另外支持 .gz/.zst 压缩和轮转后缀，
+# 如 app.log.1、app.log.3.gz，见 log_sources.split_source_name）
+SUPPORTED_EXTENSIONS = [
+    ".txt",
+    ".md",
+    ".json",
+    ".jsonl",
+    ".csv",
+    ".log",
+    ".xml",
+    ".yaml",
+    ".yml",
+    ".docx",
+    ".pdf",
+]
+
+# 懒加载原文的 .log 记录在向量库中只保存开头这么多字符，
+# 日志文件被截断/轮转导致偏移失效时作为兜底文本返回
+LAZY_TEXT_SNIPPET_CHARS = 160
+
+# 模板文档每次出现的时间戳（Unix 秒）所在的元数据键：只写入时间索引，
+# 写入向量库和关键词索引前从节点元数据中取出
+TEMPLATE_OCCURRENCES_KEY = "occurrences"
+
+# 估算压缩日志解压后大小时使用的压缩比（文本日志 gzip/zstd 通常在 5~15 倍）
+COMPRESSION_RATIO = 10
+
 
 class TopKLogSystem:
     def __init__(
@@ -46,6 +154,41 @@ class TopKLogSystem:
         log_path: str,
         llm: str,
         embedding_model: str,
+        vector_store_path: str = "./data/vector_stores",
+        incremental: bool = False,
+        parse_workers: int = 1,
+        parse_worker_max_bytes: int = 32 * 1024 * 1024,
+        ingest_batch_size: int = 256,
+        embedding_cache_path: Optional[str] = "./data/embedding_cache/embeddings.sqlite3",
+        embedding_cache_size: int = 2_000_000,
+        template_mining: Optional[List[str]] = None,
+        record_start_patterns: Optional[List[str]] = None,
+        csv_templates: Optional[Dict[str, str]] = None,
+        csv_metadata_columns: Optional[Dict[str, List[str]]] = None,
+        csv_drop_columns: Optional[List[str]] = None,
+        chunk_tokens: int = 512,
+        chunk_overlap: int = 64,
+        lazy_log_text: bool = True,
+        background_build: bool = False,
+        kb_depth: int = 2,
+        search_workers: int = 8,
+        fusion: str = "rrf",
+        fusion_k: int = 60,
+        fusion_weights: Optional[Dict[str, float]] = None,
+        query_cache_size: int = 1024,
+        query_cache_ttl: float = 600.0,
+        dedupe_distance: Optional[int] = 3,
+        mmr_lambda: Optional[float] = None,
+        vector_backend: str = "chroma",
+        flat_dtype: str = "float16",
+        flat_quantization: Optional[str] = None,
+        pq_subspaces: int = 64,
+        quantization_train_size: int = 20000,
+        rerank_factor: int = 4,
+        time_candidate_limit: int = 20000,
+        query_rewrite_path: Optional[str] = None,
+        prompt_budgets: Optional[Dict[str, Dict[str, float]]] = None,
+        glossary: Optional[Dict[str, str]] = None,
     ) -> None:
         # ...existing code...
 
@@ -125,9 +268,29 @@ class TopKLogSystem:
             "延迟": ["延迟", "latency", "lag", "卡顿", "慢"],
             "宕机": ["宕机", "down", "unavailable", "挂了", "崩溃"],
         }
+        # 关键词索引分词器：中文按二元组切分，同义词/术语表中的词条整词匹配；
+        # 入库与查询共用这一个实例。术语表在首次入库前传入，启动同步就按完整词典分词
+        self.tokenizer = KeywordTokenizer(self._domain_terms(glossary))
 
         # 初始化嵌入模型 (BGE-Large)
         self.embedding_model = OllamaEmbeddings(model=embedding_model)
+        # 嵌入缓存：入库和检索共用，未变化/重复的文本不再请求 Ollama
+        self.embedding_cache = None
+        if embedding_cache_path:
+            self.embedding_cache = EmbeddingCache(
+                embedding_cache_path, max_entries=embedding_cache_size
+            )
+            self.embedding_model = CachedEmbeddings(
+                self.embedding_model, embedding_model, self.embedding_cache
+            )
+        self._embedding_model_name = embedding_model
+        # 进程内的查询向量缓存和检索结果缓存（LRU + TTL），重复提问和重新生成直接命中；
+        # 结果缓存的键包含索引版本，任何入库、删除、重建后自动失效
+        self.query_embedding_cache = QueryCache(query_cache_size, query_cache_ttl)
+        self.result_cache = QueryCache(query_cache_size, query_cache_ttl)
+        # 按模型的 prompt token 预算：历史对话、日志上下文、联网结果超出额度时
+        # 从价值最低的条目开始裁剪，见 PromptBudget
+        self.prompt_budget = PromptBudget(prompt_budgets)
         self._default_llm_name = llm
         self._llm_cache: Dict[str, OllamaLLM] = {}
         self._llm_lock = threading.RLock()
@@ -138,25 +301,130 @@ class TopKLogSystem:
         Settings.embed_model = self.embedding_model
 
         self.log_path = log_path
-        self.log_index = None
-        self.vector_store = None
+        self.vector_store_path = vector_store_path
+        # incremental=True 时，启动时对比入库清单，只嵌入新增/变更文件
+        self.incremental = incremental
+        # 文档解析进程数，1 表示在当前进程内顺序解析
+        self.parse_workers = max(1, parse_workers)
+        # 子进程把整个文件的文档一次性返回；超过该大小（压缩文件按估算的解压后大小）
+        # 的文件改在当前进程内流式解析，在途文件占用的内存不随文件大小增长
+        self.parse_worker_max_bytes = parse_worker_max_bytes
+        # 流式入库每批嵌入/写入的文档数
+        self.ingest_batch_size = max(1, ingest_batch_size)
+        # 传给各文件处理函数的解析选项（需可 pickle，会发送到解析子进程）
+        self.ingest_options: Dict[str, Any] = {
+            # 对这些扩展名的文件做日志模板挖掘，每个模板只嵌入一个文档，如 [".log", ".csv"]
+            "template_mining": list(template_mining or []),
+            # .log 多行记录的起始行正则，None 使用 log_records 中的默认模式；
+            # 不匹配起始模式的续行（栈帧、Caused by 等）并入上一条记录
+            "record_start_patterns": record_start_patterns,
+            # 知识库目录（相对 log_path）→ 行文本模板，如 {"综合类": "[{级别}] {服务}: {消息}"}
+            "csv_templates": dict(csv_templates or {}),
+            # 元数据键 → 候选列名，命中的列提升为 Chroma 元数据
+            "csv_metadata_columns": (
+                dict(csv_metadata_columns)
+                if csv_metadata_columns is not None
+                else dict(DEFAULT_CSV_METADATA_COLUMNS)
+            ),
+            # 不进入嵌入文本的列，如行号、原始时间戳
+            "csv_drop_columns": list(csv_drop_columns or []),
+            # 文本/YAML/XML/PDF 的切块大小与相邻块重叠（token 数）
+            "chunk_tokens": chunk_tokens,
+            "chunk_overlap": chunk_overlap,
+            # .log 记录只在向量库中保存 (source, 字节偏移, 长度) 和开头的一小段文本，
+            # 原文在检索时按偏移读取；值为保存的片段字符数，0 表示保存全文
+            "lazy_log_text": LAZY_TEXT_SNIPPET_CHARS if lazy_log_text else 0,
+            # 关键词倒排索引版本，版本变化（或旧索引没有倒排索引）时重新解析已入库文件
+            "keyword_index": KEYWORD_INDEX_VERSION,
+            # 时间戳索引版本，同上
+            "time_index": TIME_INDEX_VERSION,
+            # 分词词典（同义词、术语表）的摘要，词典变化时按新词典重新分词
+            "keyword_dictionary": self.tokenizer.dictionary_digest(),
+        }
+        # 按偏移懒加载日志原文（mmap）
+        self.log_reader = LogTextReader()
+        # 同步入库与实时追加（LogTailer）互斥，避免删除旧向量时写入新记录；
+        # 锁文件同时在进程间互斥，多个 worker 进程不会同时写入同一个向量库
+        self._ingest_lock = IngestLock(os.path.join(vector_store_path, "ingest.lock"))
+        # 同步/重建任务的进程间互斥锁：启动时只有拿到它的进程执行同步
+        self._build_lock = IngestLock(os.path.join(vector_store_path, "build.lock"))
+        # active_collection.json 的 (mtime_ns, size)，其他进程切换布局后据此重新打开
+        self._active_stamp: Optional[Tuple[int, int]] = None
+        self._reload_lock = threading.Lock()
+        # background_build=True 时启动同步在后台任务中执行，构造函数立即返回
+        self.background_build = background_build
+        self._build_job: Optional[IndexBuildJob] = None
+        self._job_lock = threading.Lock()
+        # 全量重建切换集合后加一，LogTailer 据此重新定位
+        self.index_generation = 0
+        self.manifest = IngestManifest.load(
+            os.path.join(vector_store_path, "ingest_manifest.json")
+        )
+        # 按知识库（log_path 下前 kb_depth 级目录）拆分集合，检索时按查询路由
+        self.kb_depth = max(1, kb_depth)
+        self.router = KnowledgeBaseRouter(self.synonyms, glossary)
+        # 改写表和同义词表编译为多模式自动机，一次扫描完成替换和同义词补充；
+        # query_rewrite_path 指向的 JSON 词表修改后自动重新加载，不需要重启
+        self.query_rewriter = QueryRewriter(
+            self.query_rewrite_map,
+            self.synonyms,
+            path=query_rewrite_path,
+            on_reload=self._on_synonyms_reload,
+        )
+        # 多个知识库并行检索
+        self._search_pool = ThreadPoolExecutor(
+            max_workers=max(1, search_workers), thread_name_prefix="kb-search"
+        )
+        # 混合检索的融合策略："rrf"（倒数排名融合）或 "weighted"（归一化分加权求和）；
+        # fusion_weights 为各通道权重，如 {"vector": 1.0, "keyword": 0.5}
+        if fusion not in FUSION_METHODS:
+            raise ValueError(f"不支持的融合策略: {fusion}")
+        self.fusion = fusion
+        self.fusion_k = fusion_k
+        self.fusion_weights = dict(fusion_weights or {})
+        # 检索结果后处理：SimHash 汉明距离不超过 dedupe_distance 的视为近似重复（None 关闭）；
+        # mmr_lambda 不为 None 时做 MMR 重排，越小越偏向多样性
+        self.dedupe_distance = dedupe_distance
+        self.mmr_lambda = mmr_lambda
+        # 向量后端："chroma"（每个知识库一个 Chroma 集合）或 "flat"（进程内内存映射的
+        # 平铺矩阵，NumPy 精确检索，多个 worker 进程通过页缓存共享）；切换后启动时全量重建
+        if vector_backend not in VECTOR_BACKENDS:
+            raise ValueError(f"不支持的向量后端: {vector_backend}")
+        if flat_dtype not in FLAT_DTYPES:
+            raise ValueError(f"不支持的向量精度: {flat_dtype}")
+        self.vector_backend = vector_backend
+        self.flat_dtype = flat_dtype
+        # flat 后端的向量压缩："int8"（每维 1 字节）或 "pq"（每条 pq_subspaces 字节），
+        # 行数达到 quantization_train_size 后抽样训练；检索时压缩编码粗排取
+        # top_k * rerank_factor 个候选再精确重打分，rerank_factor 越大召回越高
+        if flat_quantization is not None:
+            if flat_quantization not in QUANTIZATIONS:
+                raise ValueError(f"不支持的向量压缩方式: {flat_quantization}")
+            if vector_backend != "flat":
+                raise ValueError("flat_quantization 只适用于 vector_backend='flat'")
+        self.flat_quantization = flat_quantization
+        self.pq_subspaces = pq_subspaces
+        self.quantization_train_size = quantization_train_size
+        self.rerank_factor = rerank_factor
+        # 按时间窗口检索时，时间戳索引命中的候选不超过该条数则只在候选上做向量打分，
+        # 超过时退回在向量库内按 where 过滤
+        self.time_candidate_limit = time_candidate_limit
+        self.store: Optional[BaseKnowledgeBaseStore] = None
         self._build_vectorstore()
     def _rewrite_query(self, query: str) -> str:
         """
-        对用户输入进行标准化、纠错、扩展。
+        对用户输入进行标准化、纠错、扩展：口语化/拼写/缩写替换，
+        并在末尾补充命中的同义词主词（提升召回），见 QueryRewriter。
         """
-        # 1. 口语化/拼写/缩写 替换
-        for k, v in self.query_rewrite_map.items():
-            if k.lower() in query.lower():
-                query = re.sub(re.escape(k), v, query, flags=re.IGNORECASE)
-
-        # 2. 同义词扩展（可选：将同义词替换为主词，或在末尾补充同义词，提升召回）
-        # 这里采用补充主词的方式
-        for main_word, syns in self.synonyms.items():
-            for syn in syns:
-                if syn.lower() in query.lower() and main_word not in query:
-                    query += f" {main_word}"
-        return query
+        return self.query_rewriter.rewrite(query)
+
+    def _on_synonyms_reload(self, synonyms: Dict[str, List[str]]) -> None:
+        """词表文件重新加载后，知识库路由和关键词分词词典随同义词表更新"""
+        self.synonyms = synonyms
+        self.router.set_synonyms(synonyms)
+        self._set_tokenizer_terms(self.router.glossary)
+        # 同 set_glossary：路由和分词变化后，已缓存的检索结果不再有效
+        self.result_cache.clear()
     """
     基于 DeepSeek-R1:7B 的日志分析系统
 
@@ -173,234 +441,1720 @@ class TopKLogSystem:
 
     # 构建向量数据库的核心函数
     def _build_vectorstore(self):
-        vector_store_path = "./data/vector_stores"
+        vector_store_path = self.vector_store_path
+        existed = os.path.exists(vector_store_path)
 
-        # 检查 vector_stores 文件夹是否存在
-        if os.path.exists(vector_store_path):
-            logger.info(f"向量数据库文件夹已存在，加载现有索引: {vector_store_path}")
+        # 多个进程（Django worker）同时首次启动时只由一个进程创建集合布局，
+        # 其他进程拿到锁后打开它创建的布局
+        with self._ingest_lock:
+            # 检查 vector_stores 文件夹是否存在
+            if existed or os.path.exists(self._active_store_path()):
+                logger.info(f"向量数据库文件夹已存在，加载现有索引: {vector_store_path}")
 
-            try:
-                # 1. 连接到现有的 ChromaDB
-                chroma_client = chromadb.PersistentClient(path=vector_store_path)
+                try:
+                    # 连接到现有的 ChromaDB，按 active_collection.json 加载当前的集合布局
+                    chroma_client = chromadb.PersistentClient(path=vector_store_path)
+                    self.store = self._open_store(chroma_client)
+                    self._active_stamp = self._active_store_stamp()
+                    logger.info(
+                        f"成功从现有数据库加载索引，知识库: {self.store.knowledge_bases()}"
+                    )
 
-                # 2. 获取集合
-                log_collection = chroma_client.get_collection("log_collection")
+                except Exception as e:
+                    logger.error(
+                        f"加载现有向量数据库失败: {e}. 系统将无法进行日志检索。"
+                    )
+                    return
 
-                # 3. 实例化 LlamaIndex 的 VectorStore
-                log_vector_store = ChromaVectorStore(chroma_collection=log_collection)
+                rebuild = (
+                    self.store.is_legacy
+                    or self.store.depth != self.kb_depth
+                    or self.store.backend != self.vector_backend
+                    or self.store.quantization != self.flat_quantization
+                )
+                if rebuild:
+                    # 旧的单集合布局、知识库层级、向量后端或压缩方式变化，无法增量迁移；
+                    # 重建期间仍使用旧集合检索
+                    logger.warning(
+                        "向量数据库的集合布局与配置不一致，将全量重建为按知识库划分的集合。"
+                    )
+                elif not self.incremental:
+                    return
+            else:
+                logger.info(f"向量数据库文件夹不存在，开始构建: {vector_store_path}")
+                os.makedirs(vector_store_path, exist_ok=True)
 
-                # 4.从 VectorStore 加载索引
-                self.log_index = VectorStoreIndex.from_vector_store(
-                    vector_store=log_vector_store
+                chroma_client = chromadb.PersistentClient(path=vector_store_path)
+                self.store = self._create_store(
+                    chroma_client, self._new_store_prefix(), self.kb_depth
                 )
-                self.vector_store = log_vector_store
+                self._write_active_store(self.store)
+                # 全量构建等价于对空清单做一次增量同步
+                rebuild = False
 
-                logger.info("成功从现有数据库加载索引。")
+        self._initial_sync(rebuild=rebuild)
 
-            except Exception as e:
-                logger.error(f"加载现有向量数据库失败: {e}. 系统将无法进行日志检索。")
+    def _initial_sync(self, rebuild: bool = False) -> None:
+        """
+        启动时的同步：background_build=True 时放到后台任务中，不阻塞构造函数。
+        多个进程同时启动时只有拿到构建锁的进程执行，其他进程跳过，
+        之后按清单和集合布局文件的变化加载它的结果（见 reload_if_changed）。
+        """
+        if self.background_build:
+            self.start_index_build(rebuild=rebuild, wait=False)
+            return
+        if rebuild:
+            report = self.rebuild_vectorstore(wait=False)
+        else:
+            report = self.sync_vectorstore(wait=False)
+        if report.get("skipped"):
+            return
+        if report["documents"]:
+            logger.info(f"日志库索引构建完成，共 {report['documents']} 条日志")
+        elif not self.store.count():
+            logger.info("未加载到任何日志文档，向量数据库未更新")
+
+    def _active_store_path(self) -> str:
+        return os.path.join(self.vector_store_path, "active_collection.json")
+
+    def _active_store_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self._active_store_path())
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload_if_changed(self) -> None:
+        """
+        其他进程（另一个 worker 的同步/重建）写入后重新加载：集合布局切换时
+        重新打开当前布局，入库清单变化时重新读取清单并刷新知识库列表。
+        只读取文件状态，不获取入库锁，检索时调用不会被其他进程的同步阻塞。
+        """
+        if self.store is None:
+            return
+        with self._reload_lock:
+            stamp = self._active_store_stamp()
+            if stamp is not None and stamp != self._active_stamp:
+                chroma_client = chromadb.PersistentClient(path=self.vector_store_path)
+                self.store = self._open_store(chroma_client)
+                self._active_stamp = stamp
+                # 通知 LogTailer 等按新清单重新定位
+                self.index_generation += 1
+                logger.info(f"其他进程已切换集合布局，重新打开 {self.store.prefix}_*")
+            if self.manifest.changed_on_disk():
+                self.manifest = IngestManifest.load(self.manifest.path)
+                self.store.refresh()
+
+    def _open_store(self, chroma_client) -> BaseKnowledgeBaseStore:
+        """
+        active_collection.json 记录当前集合布局：
+        {"prefix", "depth", "backend", "quantization"} 为按知识库划分的集合
+        （没有 backend 的为 Chroma）；
+        {"name"} 或文件不存在为旧的单集合。
+        """
+        try:
+            with open(self._active_store_path(), "r", encoding="utf-8") as f:
+                active = json.load(f)
+        except FileNotFoundError:
+            active = {"name": "log_collection"}
+        if "prefix" in active:
+            return self._create_store(
+                chroma_client,
+                active["prefix"],
+                active.get("depth", self.kb_depth),
+                backend=active.get("backend", "chroma"),
+                quantization=active.get("quantization"),
+            )
+        return self._create_store(
+            chroma_client,
+            "",
+            self.kb_depth,
+            legacy_name=active["name"],
+            backend="chroma",
+        )
 
-            return  # 结束函数
+    def _create_store(
+        self,
+        chroma_client,
+        prefix: str,
+        depth: int,
+        legacy_name: Optional[str] = None,
+        backend: Optional[str] = None,
+        quantization: Optional[str] = None,
+    ) -> BaseKnowledgeBaseStore:
+        """
+        创建集合布局；backend 为空时按配置创建新布局（向量后端和压缩方式都取配置），
+        否则按 active_collection.json 中记录的后端和压缩方式打开已有布局。
+        """
+        if backend is None:
+            backend, quantization = self.vector_backend, self.flat_quantization
+        if backend == "flat":
+            return FlatKnowledgeBaseStore(
+                os.path.join(self.vector_store_path, "flat", prefix),
+                prefix,
+                depth,
+                keyword_dir=self._keyword_dir(prefix),
+                tokenizer=self.tokenizer,
+                time_dir=self._time_dir(prefix),
+                dtype=self.flat_dtype,
+                quantization=quantization,
+                pq_subspaces=self.pq_subspaces,
+                train_size=self.quantization_train_size,
+                rerank_factor=self.rerank_factor,
+            )
+        return KnowledgeBaseStore(
+            chroma_client,
+            prefix,
+            depth,
+            legacy_name=legacy_name,
+            keyword_dir=self._keyword_dir(legacy_name or prefix),
+            tokenizer=self.tokenizer,
+            time_dir=self._time_dir(legacy_name or prefix),
+        )
+
+    def _keyword_dir(self, name: str) -> str:
+        """集合布局对应的关键词倒排索引目录，随布局一起切换和删除"""
+        return os.path.join(self.vector_store_path, "keyword_index", name)
+
+    def _time_dir(self, name: str) -> str:
+        """集合布局对应的时间戳索引目录"""
+        return os.path.join(self.vector_store_path, "time_index", name)
+
+    def _write_active_store(self, store: BaseKnowledgeBaseStore) -> None:
+        tmp_path = f"{self._active_store_path()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "prefix": store.prefix,
+                    "depth": store.depth,
+                    "backend": store.backend,
+                    "quantization": store.quantization,
+                },
+                f,
+            )
+        os.replace(tmp_path, self._active_store_path())
+        self._active_stamp = self._active_store_stamp()
 
-        logger.info(f"向量数据库文件夹不存在，开始构建: {vector_store_path}")
-        os.makedirs(vector_store_path, exist_ok=True)
+    @staticmethod
+    def _new_store_prefix() -> str:
+        return f"kb{int(time.time())}"
+
+    def _domain_terms(self, glossary: Optional[Dict[str, str]] = None) -> List[str]:
+        """分词词典：同义词组的全部词条和术语表词条"""
+        terms = list(self.synonyms)
+        for syns in self.synonyms.values():
+            terms.extend(syns)
+        terms.extend(glossary or {})
+        return terms
+
+    def _set_tokenizer_terms(self, glossary: Optional[Dict[str, str]]) -> None:
+        """更新分词词典；词典摘要随之更新，下次同步按新词典重新分词已入库文件"""
+        self.tokenizer.set_terms(self._domain_terms(glossary))
+        self.ingest_options["keyword_dictionary"] = self.tokenizer.dictionary_digest()
+
+    def set_glossary(self, glossary: Dict[str, str]) -> None:
+        """设置术语表，用于把查询中的术语路由到相关知识库，术语同时加入分词词典"""
+        self.router.set_glossary(glossary)
+        self._set_tokenizer_terms(glossary)
+        # 路由和分词变化后，已缓存的检索结果不再有效
+        self.result_cache.clear()
+
+    def knowledge_base_stats(self) -> Dict[str, int]:
+        """各知识库的向量条数"""
+        return self.store.counts() if self.store else {}
+
+    def vector_index_stats(self) -> Dict[str, Any]:
+        """向量后端、压缩方式及各知识库索引的行数和占用字节数"""
+        if self.store is None:
+            return {}
+        return {
+            "backend": self.store.backend,
+            "quantization": self.store.quantization,
+            "knowledge_bases": self.store.index_stats(),
+        }
 
-        chroma_client = chromadb.PersistentClient(path=vector_store_path)
-        log_collection = chroma_client.get_or_create_collection("log_collection")
+    # 后台索引构建任务
+    def start_index_build(
+        self, rebuild: bool = False, wait: bool = True
+    ) -> Dict[str, Any]:
+        """
+        在后台线程中启动索引构建，立即返回任务状态。
+        :param rebuild: False 为增量同步；True 为全量重建到新集合，完成后再切换，
+            构建期间查询继续使用旧索引
+        :param wait: 其他进程正在构建时是否等待；False 时任务直接结束（报告 skipped）
+        已有任务在运行时抛出 RuntimeError。
+        """
+        with self._job_lock:
+            if self._build_job and self._build_job.is_running():
+                raise RuntimeError("已有索引构建任务在运行")
+            if rebuild:
+                target = partial(self.rebuild_vectorstore, wait=wait)
+            else:
+                target = partial(self.sync_vectorstore, wait=wait)
+            self._build_job = IndexBuildJob(
+                "rebuild" if rebuild else "sync", target
+            )
+            self._build_job.start()
+            return self._build_job.snapshot()
+
+    def index_build_status(self) -> Optional[Dict[str, Any]]:
+        """最近一次索引构建任务的状态，从未启动过时返回 None"""
+        job = self._build_job
+        return job.snapshot() if job else None
+
+    def cancel_index_build(self) -> bool:
+        """请求取消正在运行的构建任务；已入库的文件保留，其余文件下次同步时处理"""
+        job = self._build_job
+        if not job or not job.is_running():
+            return False
+        job.cancel()
+        return True
+
+    def sync_vectorstore(
+        self,
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+        cancel_event: Optional[threading.Event] = None,
+        wait: bool = True,
+    ) -> Dict[str, Any]:
+        """
+        增量同步知识库目录与向量数据库：
+        - 新增/变更的文件：重新解析并嵌入（变更文件在重新解析前删除旧向量）
+        - 已删除的文件：从所属知识库的集合中删除其向量
+        - 改名的文件（如日志轮转，按内容哈希匹配）：向量改到新路径名下，不重新嵌入
+        :param progress_callback: 每写入一个批次回调一次，参数见 _ingest_files
+        :param cancel_event: 置位后在当前文件处理完成前停止，未处理的文件下次同步
+        :param wait: 其他进程正在同步/重建时是否等待；False 时直接返回 skipped 报告
+        返回变更报告 {"added", "modified", "removed", "renamed", "unchanged",
+        "failed", "documents", "cancelled"}。
+        """
+        if not self._build_lock.acquire(blocking=wait):
+            logger.info("其他进程正在构建索引，本进程跳过同步。")
+            return dict(self._empty_report(), skipped=True)
+        try:
+            with self._ingest_lock:
+                if self.store is None:
+                    logger.warning("向量数据库未初始化，跳过增量同步。")
+                    return self._empty_report()
+                # 先加载其他进程已完成的同步结果，避免重复嵌入
+                self.reload_if_changed()
+                return self._sync_vectorstore(
+                    self.store, self.manifest, progress_callback, cancel_event
+                )
+        finally:
+            self._build_lock.release()
 
-        log_vector_store = ChromaVectorStore(chroma_collection=log_collection)
-        self.vector_store = log_vector_store  # 保持一致性
+    def rebuild_vectorstore(
+        self,
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+        cancel_event: Optional[threading.Event] = None,
+        wait: bool = True,
+    ) -> Dict[str, Any]:
+        """
+        全量重建：把全部文件解析、嵌入到一组新的知识库集合，完成后切换并删除旧集合。
+        构建期间查询和实时追加仍使用旧集合；取消时删除新集合，旧索引不受影响。
+        :param wait: 同 sync_vectorstore
+        """
+        if not self._build_lock.acquire(blocking=wait):
+            logger.info("其他进程正在构建索引，本进程跳过全量重建。")
+            return dict(self._empty_report(), skipped=True)
+        try:
+            return self._rebuild_vectorstore(progress_callback, cancel_event)
+        finally:
+            self._build_lock.release()
 
-        log_storage_context = StorageContext.from_defaults(
-            vector_store=log_vector_store
+    def _rebuild_vectorstore(
+        self,
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+        cancel_event: Optional[threading.Event] = None,
+    ) -> Dict[str, Any]:
+        chroma_client = chromadb.PersistentClient(path=self.vector_store_path)
+        store = self._create_store(
+            chroma_client, self._new_store_prefix(), self.kb_depth
         )
-        if log_documents := self._load_documents(self.log_path):
-            self.log_index = VectorStoreIndex.from_documents(
-                log_documents,
-                storage_context=log_storage_context,
-                show_progress=True,
+        # 新集合的清单先只保存在内存中，切换时再写入
+        manifest = IngestManifest(self.manifest.path)
+        try:
+            report = self._sync_vectorstore(
+                store, manifest, progress_callback, cancel_event
             )
-            logger.info(f"日志库索引构建完成，共 {len(log_documents)} 条日志")
-        else:
-            logger.info("未加载到任何日志文档，向量数据库未更新")
+        except Exception:
+            store.drop()
+            raise
+        if report["cancelled"]:
+            store.drop()
+            logger.info("全量重建已取消，继续使用原索引。")
+            return report
+
+        with self._ingest_lock:
+            old_store = self.store
+            manifest.save()
+            self._write_active_store(store)
+            self.manifest = manifest
+            self.store = store
+            # 通知 LogTailer 等按新清单重新定位
+            self.index_generation += 1
+        if old_store is not None:
+            old_store.drop()
+        logger.info(f"全量重建完成，已切换到集合 {store.prefix}_*")
+        return report
+
+    @staticmethod
+    def _empty_report() -> Dict[str, Any]:
+        return {
+            "added": [],
+            "modified": [],
+            "removed": [],
+            "renamed": [],
+            "unchanged": 0,
+            "failed": [],
+            "documents": 0,
+            "cancelled": False,
+        }
+
+    def _sync_vectorstore(
+        self,
+        store: BaseKnowledgeBaseStore,
+        manifest: IngestManifest,
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+        cancel_event: Optional[threading.Event] = None,
+    ) -> Dict[str, Any]:
+        report = self._empty_report()
+        rel_paths = [
+            os.path.relpath(p, self.log_path).replace(os.sep, "/")
+            for p in self._list_source_files(self.log_path)
+        ]
+
+        if not manifest.exists() and store.count() > 0:
+            # 旧版本构建的向量库没有清单，也没有 source 元数据，无法按文件删除。
+            # 以当前文件为基线，此后的变更才走增量。
+            logger.warning("向量数据库缺少入库清单，以当前文件作为基线，不重新嵌入。")
+            diff = manifest.scan(self.log_path, rel_paths)
+            for rel_path in diff["added"]:
+                manifest.commit(rel_path)
+            manifest.options = dict(self.ingest_options)
+            manifest.save()
+            report["unchanged"] = len(rel_paths)
+            return report
+
+        # 解析选项（模板挖掘等）变化后，已入库文件全部按变更处理
+        options_changed = bool(manifest.files) and (
+            manifest.options != self.ingest_options
+        )
+        if options_changed:
+            logger.info("入库解析选项已变化，将重新解析全部已入库文件。")
+        diff = manifest.scan(self.log_path, rel_paths, force=options_changed)
+        report["unchanged"] = len(diff["unchanged"])
+
+        # 0. 改名的文件直接改写来源，不重新嵌入（解析选项变化时仍需重新解析）
+        if not options_changed:
+            self._apply_renames(store, manifest, diff, report)
+
+        # 1. 删除已移除文件的向量（变更/新增文件的旧向量在重新解析前删除）
+        for rel_path in diff["removed"]:
+            try:
+                store.delete_source(rel_path)
+            except Exception as e:
+                logger.error(f"删除文件向量失败 {rel_path}: {e}")
+                continue
+            manifest.forget(rel_path)
+            report["removed"].append(rel_path)
+
+        # 2. 流式解析、嵌入新增/变更文件，每个批次写入后即提交清单
+        changed = diff["added"] + diff["modified"]
+
+        def on_file_done(rel_path: str) -> None:
+            manifest.commit(rel_path)
+            key = "added" if rel_path in diff["added"] else "modified"
+            report[key].append(rel_path)
+
+        # 只解析到扫描时的大小：清单记录的大小与已入库内容一致，
+        # LogTailer 从这里接续，之后追加的记录既不重复也不遗漏
+        limits = {
+            os.path.join(self.log_path, p): manifest.pending(p)["size"]
+            for p in changed
+            if manifest.pending(p)
+        }
+        stats = self._ingest_files(
+            [os.path.join(self.log_path, p) for p in changed],
+            on_file_done=on_file_done,
+            progress_callback=progress_callback,
+            cancel_event=cancel_event,
+            store=store,
+            limits=limits,
+        )
+        report["documents"] = stats["documents"]
+        report["failed"] = stats["failed"]
+        report["cancelled"] = stats["cancelled"]
+        for rel_path in report["failed"]:
+            # 失败文件的旧向量已删除，移出清单以便下次同步重试
+            manifest.forget(rel_path)
+        manifest.options = dict(self.ingest_options)
+        if manifest is self.manifest:
+            manifest.save()
+
+        logger.info(
+            f"增量同步{'已取消' if report['cancelled'] else '完成'}: "
+            f"新增 {len(report['added'])}，变更 {len(report['modified'])}，"
+            f"删除 {len(report['removed'])}，改名 {len(report['renamed'])}，"
+            f"未变 {report['unchanged']}，"
+            f"失败 {len(report['failed'])}，嵌入文档 {report['documents']} 条"
+        )
+        return report
+
+    @staticmethod
+    def _apply_renames(
+        store: BaseKnowledgeBaseStore,
+        manifest: IngestManifest,
+        diff: Dict[str, List[str]],
+        report: Dict[str, Any],
+    ) -> None:
+        """
+        把内容哈希匹配上的 (旧路径, 新路径) 在向量库中改名，并从 diff 中移除，
+        剩下的文件按普通的新增/变更/删除处理。
+        轮转是链式的（app.log.1 → app.log.2，app.log → app.log.1），
+        目标路径自身也要改名时先处理它；互相改名成环的不处理，按变更重新嵌入。
+        """
+        pending = {
+            old: new
+            for old, new in manifest.match_renames(diff)
+            if store.knowledge_base_of(old) == store.knowledge_base_of(new)
+        }
+        ordered: List[Tuple[str, str]] = []
+        while pending:
+            ready = [old for old, new in pending.items() if new not in pending]
+            if not ready:
+                break
+            for old in ready:
+                ordered.append((old, pending.pop(old)))
+
+        for old, new in ordered:
+            try:
+                # 目标路径原有的向量已过期（链式轮转时已先改走，这里为空操作）
+                store.delete_source(new)
+                store.rename_source(old, new)
+            except Exception as e:
+                # 中途失败时两边的向量都会在后续的删除/重新解析中清理
+                logger.error(f"文件改名失败 {old} → {new}: {e}，将重新嵌入")
+                continue
+            manifest.rename(old, new)
+            for key in ("added", "modified"):
+                if new in diff[key]:
+                    diff[key].remove(new)
+            if old in diff["removed"]:
+                diff["removed"].remove(old)
+            report["renamed"].append([old, new])
+
+    def _ingest_files(
+        self,
+        files: List[str],
+        on_file_done: Optional[Callable[[str], None]] = None,
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+        cancel_event: Optional[threading.Event] = None,
+        store: Optional[BaseKnowledgeBaseStore] = None,
+        limits: Optional[Dict[str, int]] = None,
+    ) -> Dict[str, Any]:
+        """
+        流式入库流水线：解析 → 攒批 → 嵌入 → 写入 Chroma。
+        内存中最多只保留一个批次的文档（并行解析时另有至多 workers * 2 个
+        不超过 parse_worker_max_bytes 的在途文件），峰值内存与语料总量和单个文件大小无关。每个文件开始解析前先删除它已有的向量。
+        :param on_file_done: 文件的全部文档都已写入后回调（参数为相对路径）
+        :param progress_callback: 每写入一个批次回调一次，参数为进度字典：
+            files_total / files_done / documents / batches / failed / elapsed
+        :param cancel_event: 置位后丢弃当前文件未完成的部分并停止
+        :param store: 写入目标，默认为当前的知识库集合
+        :param limits: 文件路径 → 最多解析的字节数（未压缩的 .log），见 _process_log
+        """
+        store = store or self.store
+        stats: Dict[str, Any] = {
+            "files_total": len(files),
+            "files_done": 0,
+            "documents": 0,
+            "batches": 0,
+            "failed": [],
+            "elapsed": 0.0,
+            "cancelled": False,
+        }
+        start_time = time.time()
+        batch: List[Document] = []
+        # 文档已全部进入批次、等待批次落盘的文件
+        waiting_files: List[str] = []
+
+        def cancelled() -> bool:
+            return bool(cancel_event and cancel_event.is_set())
+
+        def flush() -> None:
+            if batch:
+                self._insert_batch(batch, store)
+                stats["documents"] += len(batch)
+                stats["batches"] += 1
+                batch.clear()
+            for rel_path in waiting_files:
+                stats["files_done"] += 1
+                if on_file_done:
+                    on_file_done(rel_path)
+            waiting_files.clear()
+            stats["elapsed"] = time.time() - start_time
+            if progress_callback:
+                progress_callback(dict(stats, failed=list(stats["failed"])))
+
+        def discard(rel_path: str) -> None:
+            # 丢弃该文件尚未落盘的文档，并删除已写入的部分
+            batch[:] = [d for d in batch if d.metadata.get("source") != rel_path]
+            try:
+                store.delete_source(rel_path)
+            except Exception as delete_error:
+                logger.error(f"清理文件的向量失败 {rel_path}: {delete_error}")
+
+        parsed_files = self._iter_parsed_files(
+            self.log_path,
+            files,
+            self.parse_workers,
+            self.ingest_options,
+            self.parse_worker_max_bytes,
+            limits,
+        )
+        for file_path, file_documents in parsed_files:
+            if cancelled():
+                stats["cancelled"] = True
+                break
+            rel_path = os.path.relpath(file_path, self.log_path).replace(os.sep, "/")
+            try:
+                if file_documents is None:
+                    raise ValueError("解析失败")
+                # 新增文件也删一次：上次同步中途退出时可能已写入了部分批次
+                store.delete_source(rel_path)
+                for document in file_documents:
+                    batch.append(document)
+                    if len(batch) >= self.ingest_batch_size:
+                        flush()
+                        if cancelled():
+                            raise IndexBuildCancelled()
+            except IndexBuildCancelled:
+                discard(rel_path)
+                stats["cancelled"] = True
+                break
+            except Exception as e:
+                logger.error(f"文件入库失败 {rel_path}: {e}")
+                stats["failed"].append(rel_path)
+                discard(rel_path)
+                continue
+            waiting_files.append(rel_path)
+        parsed_files.close()
+        flush()
+        store.flush()
+        return stats
+
+    def append_documents(self, documents: List[Document]) -> None:
+        """
+        把新文档（如实时跟踪到的日志记录）直接追加到向量库，不更新入库清单。
+        日志记录的节点 id 由来源和偏移确定，已写入过的记录跳过，重复追加是幂等的。
+        """
+        if self.store is None:
+            raise RuntimeError("向量数据库未初始化")
+        if not documents:
+            return
+        with self._ingest_lock:
+            self._insert_batch(documents, skip_existing=True)
+            self.store.flush()
+
+    @staticmethod
+    def _record_node_id(node) -> Optional[str]:
+        """
+        日志记录节点的确定性 id：由来源、记录文档的确定性 id（见 record_document_id）
+        和节点在记录中的起始位置生成；其他文档返回 None，沿用随机 id。
+        """
+        doc_id = node.ref_doc_id or ""
+        if not doc_id.startswith(RECORD_ID_PREFIX):
+            return None
+        key = f"{node.metadata.get('source', '')}\0{doc_id}\0{node.start_char_idx}"
+        return str(uuid.UUID(hashlib.sha1(key.encode("utf-8")).hexdigest()[:32]))
+
+    def _insert_batch(
+        self,
+        documents: List[Document],
+        store: Optional[BaseKnowledgeBaseStore] = None,
+        skip_existing: bool = False,
+    ) -> None:
+        """
+        对一个批次的文档做切分和嵌入，然后按来源写入各知识库集合（默认当前集合）。
+        :param skip_existing: 跳过 id 已在向量库中的节点（重复追加的日志记录）
+        """
+        store = store or self.store
+        nodes = run_transformations(documents, Settings.transformations)
+        for node in nodes:
+            node_id = self._record_node_id(node)
+            if node_id is not None:
+                node.id_ = node_id
+        occurrences = self._pop_occurrences(nodes)
+        if skip_existing:
+            seen = store.existing_ids(nodes)
+            unique = []
+            for node in nodes:
+                if node.node_id not in seen:
+                    seen.add(node.node_id)
+                    unique.append(node)
+            if len(unique) < len(nodes):
+                logger.info(f"跳过已写入的记录 {len(nodes) - len(unique)} 条")
+            nodes = unique
+            if not nodes:
+                return
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        embeddings = Settings.embed_model.get_text_embedding_batch(texts)
+        snippet_chars = self.ingest_options.get("lazy_log_text")
+        # 关键词索引需要原文分词，在截短节点文本之前取出
+        keyword_texts = [node.get_content() for node in nodes]
+        for node, embedding in zip(nodes, embeddings):
+            node.embedding = embedding
+            if snippet_chars and "offset" in node.metadata:
+                # 原文可按偏移从日志文件读回，向量库中只保存开头一段作为兜底
+                content = node.get_content()
+                if len(content) > snippet_chars:
+                    node.set_content(content[:snippet_chars] + " …")
+        store.add(nodes, keyword_texts, occurrences)
+
+    @staticmethod
+    def _pop_occurrences(nodes: List) -> Dict[str, Any]:
+        """
+        取出模板节点每次出现的时间戳（节点 id → 时间戳），不写入向量库元数据。
+        模板文本被切成多个节点时只由第一个节点携带，其余节点不进入时间索引，
+        同一次出现不会重复计数。
+        """
+        occurrences: Dict[str, Any] = {}
+        seen_documents = set()
+        for node in nodes:
+            times = node.metadata.pop(TEMPLATE_OCCURRENCES_KEY, None)
+            if node.metadata.get("kind") != "template":
+                continue
+            if node.ref_doc_id in seen_documents:
+                occurrences[node.node_id] = ()
+            elif times is not None:
+                occurrences[node.node_id] = times
+            seen_documents.add(node.ref_doc_id)
+        return occurrences
+
+    @staticmethod
+    def _list_source_files(data_path: str) -> List[str]:
+        """递归列出 data_path 下所有支持的文件（含压缩/轮转的日志），按路径排序"""
+        file_paths = []
+        for root, dirs, files in os.walk(data_path):
+            for file in files:
+                ext, compression = split_source_name(file)
+                if ext not in SUPPORTED_EXTENSIONS:
+                    continue
+                if not compression_available(compression):
+                    logger.warning(f"缺少 {compression} 解压依赖，跳过文件: {file}")
+                    continue
+                file_paths.append(os.path.join(root, file))
+        return sorted(file_paths)
 
     # 函数用来读取文档,添加可读取文档类型,并支持遍历子文件夹下的文件
     @staticmethod
-    def _load_documents(data_path: str) -> List[Document]:
+    def _load_documents(
+        data_path: str,
+        files: Optional[List[str]] = None,
+        failed: Optional[List[str]] = None,
+        workers: int = 1,
+        options: Optional[Dict[str, Any]] = None,
+    ) -> List[Document]:
         """
         递归遍历 data_path 下所有文件（包括子文件夹），加载支持的文档类型。
+        会把全部文档一次性放进内存，入库请使用流式的 _ingest_files。
+        :param files: 仅加载指定的文件，默认加载全部
+        :param failed: 可选列表，解析失败的文件路径会追加到其中
+        :param workers: 解析进程数，大于 1 时使用进程池并行解析
+        :param options: 解析选项，见 __init__ 中的 ingest_options
+        每个文档的 metadata["source"] 为相对 data_path 的文件路径，用于按文件删除向量。
         """
         if not os.path.exists(data_path):
             logger.warning(f"数据路径不存在: {data_path}")
             return []
+        if files is None:
+            files = TopKLogSystem._list_source_files(data_path)
         documents = []
-        # 使用 os.walk 递归遍历所有文件
-        for root, dirs, files in os.walk(data_path):
-            for file in files:
-                ext = os.path.splitext(file)[1]
-                if ext not in [
-                    ".txt",
-                    ".md",
-                    ".json",
-                    ".jsonl",
-                    ".csv",
-                    ".log",
-                    ".xml",
-                    ".yaml",
-                    ".yml",
-                    ".docx",
-                    ".pdf",
-                ]:
+        for file_path, file_documents in TopKLogSystem._iter_parsed_files(
+            data_path, files, workers, options
+        ):
+            try:
+                if file_documents is None:
+                    raise ValueError("解析失败")
+                documents.extend(file_documents)
+            except Exception as e:
+                logger.error(f"加载文档失败 {file_path}: {e}")
+                if failed is not None:
+                    failed.append(file_path)
+        return documents
+
+    @staticmethod
+    def _iter_parsed_files(
+        data_path: str,
+        files: List[str],
+        workers: int = 1,
+        options: Optional[Dict[str, Any]] = None,
+        max_worker_bytes: Optional[int] = None,
+        limits: Optional[Dict[str, int]] = None,
+    ) -> Iterator[Tuple[str, Optional[Iterable[Document]]]]:
+        """
+        逐个产出 (file_path, documents)，顺序与 files 一致；解析失败时 documents 为 None。
+        workers <= 1 时 documents 是惰性生成器，边读文件边产出，
+        解析错误会在迭代时抛出，由调用方按文件隔离处理。
+        workers > 1 时把文件分发到进程池（PDF/DOCX 解析是 CPU 密集型），
+        同时在途的任务数限制为 workers * 2，避免结果堆积占满内存；
+        超过 max_worker_bytes 的大文件不进入进程池，同样以惰性生成器在当前进程解析。
+        :param limits: 文件路径 → 最多解析的字节数
+        """
+        limits = limits or {}
+        if workers <= 1 or len(files) <= 1:
+            for file_path in files:
+                yield file_path, TopKLogSystem._iter_file_documents(
+                    file_path, data_path, options, limits.get(file_path)
+                )
+            return
+
+        def submit(file_path: str):
+            # 大文件返回 None，轮到它时在当前进程内流式解析
+            if max_worker_bytes and (
+                TopKLogSystem._parsed_size_estimate(file_path) > max_worker_bytes
+            ):
+                return None
+            return executor.submit(
+                TopKLogSystem._parse_file,
+                file_path,
+                data_path,
+                options,
+                limits.get(file_path),
+            )
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            file_iter = iter(files)
+            for file_path in islice(file_iter, workers * 2):
+                pending.append((file_path, submit(file_path)))
+            while pending:
+                file_path, future = pending.popleft()
+                next_path = next(file_iter, None)
+                if next_path is not None:
+                    pending.append((next_path, submit(next_path)))
+                if future is None:
+                    yield file_path, TopKLogSystem._iter_file_documents(
+                        file_path, data_path, options, limits.get(file_path)
+                    )
                     continue
-                file_path = os.path.join(root, file)
                 try:
-                    if ext == ".csv":
-                        documents.extend(TopKLogSystem._process_csv(file_path))
-                    elif ext in [".json", ".jsonl"]:
-                        documents.extend(TopKLogSystem._process_json(file_path, ext))
-                    elif ext in [".yaml", ".yml"]:
-                        documents.extend(TopKLogSystem._process_yaml(file_path))
-                    elif ext == ".xml":
-                        documents.extend(TopKLogSystem._process_xml(file_path))
-                    elif ext == ".log":
-                        documents.extend(TopKLogSystem._process_log(file_path))
-                    elif ext == ".docx":
-                        documents.extend(TopKLogSystem._process_docx(file_path))
-                    elif ext == ".pdf":
-                        documents.extend(TopKLogSystem._process_pdf(file_path))
-                    else:
-                        documents.extend(TopKLogSystem._process_text(file_path))
+                    file_documents = future.result()
                 except Exception as e:
+                    # 子进程异常退出等情况，同样只影响当前文件
                     logger.error(f"加载文档失败 {file_path}: {e}")
-        return documents
+                    file_documents = None
+                yield file_path, file_documents
 
-    # 各种文件类型的处理函数
     @staticmethod
-    def _process_csv(file_path: str) -> List[Document]:
-        documents = []
+    def _parsed_size_estimate(file_path: str) -> int:
+        """解析时要读入的字节数估算：压缩文件按 COMPRESSION_RATIO 倍估算解压后大小"""
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            return 0
+        if split_source_name(file_path)[1]:
+            return size * COMPRESSION_RATIO
+        return size
+
+    @staticmethod
+    def _parse_file(
+        file_path: str,
+        data_path: str,
+        options: Optional[Dict[str, Any]] = None,
+        max_bytes: Optional[int] = None,
+    ) -> Optional[List[Document]]:
+        """完整解析单个文件；出错时记录日志并返回 None（在子进程中执行）"""
+        try:
+            return list(
+                TopKLogSystem._iter_file_documents(
+                    file_path, data_path, options, max_bytes
+                )
+            )
+        except Exception as e:
+            logger.error(f"加载文档失败 {file_path}: {e}")
+            return None
+
+    @staticmethod
+    def _iter_file_documents(
+        file_path: str,
+        data_path: str,
+        options: Optional[Dict[str, Any]] = None,
+        max_bytes: Optional[int] = None,
+    ) -> Iterator[Document]:
+        """
+        按文件类型分发到对应的处理函数，逐个产出标记了来源的文档。
+        :param max_bytes: 日志文件最多解析的字节数，见 _process_log
+        """
+        options = options or {}
+        ext = split_source_name(file_path)[0]
+        source = os.path.relpath(file_path, data_path).replace(os.sep, "/")
+        if ext in options.get("template_mining", []):
+            file_documents = TopKLogSystem._process_templates(
+                file_path, ext, options, source, max_bytes
+            )
+        elif ext == ".csv":
+            file_documents = TopKLogSystem._process_csv(file_path, options, source)
+        elif ext in [".json", ".jsonl"]:
+            file_documents = TopKLogSystem._process_json(file_path, ext)
+        elif ext in [".yaml", ".yml"]:
+            file_documents = TopKLogSystem._process_yaml(file_path, options)
+        elif ext == ".xml":
+            file_documents = TopKLogSystem._process_xml(file_path, options)
+        elif ext == ".log":
+            file_documents = TopKLogSystem._process_log(file_path, options, max_bytes)
+        elif ext == ".docx":
+            file_documents = TopKLogSystem._process_docx(file_path)
+        elif ext == ".pdf":
+            file_documents = TopKLogSystem._process_pdf(file_path, options)
+        else:
+            file_documents = TopKLogSystem._process_text(file_path, options)
+        for document in file_documents:
+            TopKLogSystem._tag_source(document, source)
+            yield document
+
+    @staticmethod
+    def _tag_source(document: Document, source: str) -> None:
+        """记录文档来源文件；来源只用于管理，不参与嵌入和提示词"""
+        document.metadata["source"] = source
+        document.excluded_embed_metadata_keys.append("source")
+        document.excluded_llm_metadata_keys.append("source")
+
+    # 各种文件类型的处理函数（生成器，逐条产出文档，避免整文件的文档列表驻留内存）
+    @staticmethod
+    def _process_csv(
+        file_path: str, options: Optional[Dict[str, Any]] = None, source: str = ""
+    ) -> Iterator[Document]:
+        """
+        按 pandas 分块向量化地生成行文本：
+        - 行文本按列拼接，可为知识库目录配置模板（csv_templates）；
+        - csv_metadata_columns 中的列提升为 Chroma 元数据（不参与嵌入文本）；
+        - csv_drop_columns 中的列不进入嵌入文本。
+        """
+        options = options or {}
         chunk_size = 1000
-        for chunk in pd.read_csv(file_path, chunksize=chunk_size, on_bad_lines="skip"):
-            for row in chunk.itertuples(index=False):
-                content = str(row).replace("Pandas", " ")
-                documents.append(Document(text=content))
-        return documents
+        template = TopKLogSystem._csv_template_for(
+            source, options.get("csv_templates") or {}
+        )
+        drop_columns = set(options.get("csv_drop_columns") or [])
+        metadata_columns = options.get("csv_metadata_columns") or {}
+
+        with open_binary(file_path) as f:
+            yield from TopKLogSystem._iter_csv_documents(
+                pd.read_csv(
+                    f,
+                    chunksize=chunk_size,
+                    on_bad_lines="skip",
+                    dtype=str,
+                    keep_default_na=False,
+                    encoding="utf-8-sig",
+                ),
+                template,
+                drop_columns,
+                metadata_columns,
+            )
 
     @staticmethod
-    def _process_json(file_path: str, ext: str) -> List[Document]:
-        documents = []
-        with open(file_path, "r", encoding="utf-8") as f:
+    def _iter_csv_documents(
+        chunks: Iterable[pd.DataFrame],
+        template: Optional[str],
+        drop_columns: set,
+        metadata_columns: Dict[str, List[str]],
+    ) -> Iterator[Document]:
+        """把 read_csv 的各个分块逐行转换为文档"""
+        for chunk in chunks:
+            chunk.columns = [str(c).strip() for c in chunk.columns]
+            chunk = chunk.fillna("")
+            texts = TopKLogSystem._render_csv_chunk(chunk, template, drop_columns)
+
+            # 解析需要提升为元数据的列（列名大小写不敏感）
+            lower_columns = {c.lower(): c for c in chunk.columns}
+            promoted = {}
+            for key, candidates in metadata_columns.items():
+                for candidate in candidates:
+                    column = lower_columns.get(candidate.lower())
+                    if column is not None:
+                        promoted[key] = chunk[column].str.strip().tolist()
+                        break
+            if "level" in promoted:
+                promoted["level"] = [normalize_level(v) for v in promoted["level"]]
+            if "timestamp" in promoted:
+                # 数值时间戳用于按时间范围过滤
+                promoted["ts"] = [parse_timestamp(v) for v in promoted["timestamp"]]
+                promoted["ts_end"] = promoted["ts"]
+            keys = list(promoted)
+
+            for i, text in enumerate(texts.tolist()):
+                if not text:
+                    continue
+                yield Document(
+                    text=text,
+                    metadata={
+                        k: promoted[k][i]
+                        for k in keys
+                        if promoted[k][i] is not None and promoted[k][i] != ""
+                    },
+                    excluded_embed_metadata_keys=list(keys),
+                    excluded_llm_metadata_keys=list(keys),
+                )
+
+    @staticmethod
+    def _csv_template_for(source: str, templates: Dict[str, str]) -> Optional[str]:
+        """按文件所在目录匹配最具体（最长）的模板配置"""
+        folder = os.path.dirname(source)
+        best_key = None
+        for key in templates:
+            key_path = key.strip("/")
+            # 空键作为所有目录的默认模板
+            if not key_path or folder == key_path or folder.startswith(key_path + "/"):
+                if best_key is None or len(key_path) > len(best_key.strip("/")):
+                    best_key = key
+        return templates[best_key] if best_key is not None else None
+
+    @staticmethod
+    def _render_csv_chunk(
+        chunk: pd.DataFrame, template: Optional[str], drop_columns: set
+    ) -> pd.Series:
+        """整列拼接生成一个分块内所有行的文本，避免逐行 Python 格式化"""
+        if template:
+            text = pd.Series("", index=chunk.index)
+            for literal, field, _, _ in string.Formatter().parse(template):
+                if literal:
+                    text = text + literal
+                if field is not None:
+                    if field in chunk.columns:
+                        text = text + chunk[field].str.strip()
+                    else:
+                        logger.warning(f"CSV 模板字段不存在: {field}")
+            return text.str.strip()
+
+        columns = [c for c in chunk.columns if c not in drop_columns]
+        text = pd.Series("", index=chunk.index)
+        for column in columns:
+            values = chunk[column].str.strip()
+            part = (column + ": " + values).where(values != "", "")
+            text = text + part + " | "
+        # 去掉空列留下的多余分隔符
+        return text.str.replace(r"(?: \| )+", " | ", regex=True).str.strip(" |")
+
+    @staticmethod
+    def _process_json(file_path: str, ext: str) -> Iterator[Document]:
+        with open_text(file_path) as f:
             if ext == ".json":
-                data = json.load(f)
-                documents.append(Document(text=json.dumps(data, ensure_ascii=False)))
+                # 顶层数组按元素流式解析，每个元素一个文档（与 .jsonl 一致）
+                for data in iter_json_values(f):
+                    yield Document(text=json.dumps(data, ensure_ascii=False))
             elif ext == ".jsonl":
                 for line in f:
                     data = json.loads(line.strip())
-                    documents.append(
-                        Document(text=json.dumps(data, ensure_ascii=False))
-                    )
-        return documents
+                    yield Document(text=json.dumps(data, ensure_ascii=False))
 
     @staticmethod
-    def _process_yaml(file_path: str) -> List[Document]:
-        documents = []
+    def _chunk_documents(
+        content: str,
+        kind: str,
+        options: Optional[Dict[str, Any]] = None,
+        offset: int = 0,
+        first_index: int = 0,
+        **metadata: Any,
+    ) -> Iterator[Document]:
+        """
+        按 token 切块，每块一个文档；元数据记录块序号和在原文中的字符偏移，
+        检索命中时只把相关片段放进提示词。
+        :param offset: content 在整个文件中的起始字符偏移（分窗口切块时使用）
+        :param first_index: 第一块的序号
+        """
+        options = options or {}
+        chunk_keys = ["chunk_index", "chunk_start", "chunk_end"] + list(metadata)
+        spans = chunk_text(
+            content,
+            kind,
+            chunk_tokens=options.get("chunk_tokens", 512),
+            overlap_tokens=options.get("chunk_overlap", 64),
+        )
+        for index, (start, end) in enumerate(spans, first_index):
+            yield Document(
+                text=content[start:end].strip(),
+                metadata={
+                    "chunk_index": index,
+                    "chunk_start": offset + start,
+                    "chunk_end": offset + end,
+                    **metadata,
+                },
+                excluded_embed_metadata_keys=list(chunk_keys),
+                excluded_llm_metadata_keys=list(chunk_keys),
+            )
+
+    @staticmethod
+    def _process_yaml(
+        file_path: str, options: Optional[Dict[str, Any]] = None
+    ) -> Iterator[Document]:
         with open(file_path, "r", encoding="utf-8") as f:
             content = f.read()
-            documents.append(Document(text=content))
-        return documents
+        # 按顶层键切块
+        yield from TopKLogSystem._chunk_documents(content, "yaml", options)
 
     @staticmethod
-    def _process_xml(file_path: str) -> List[Document]:
-        documents = []
+    def _process_xml(
+        file_path: str, options: Optional[Dict[str, Any]] = None
+    ) -> Iterator[Document]:
         with open(file_path, "r", encoding="utf-8") as f:
             content = f.read()
-            documents.append(Document(text=content))
-        return documents
+        # 按根元素下的一级子元素切块
+        yield from TopKLogSystem._chunk_documents(content, "xml", options)
 
     @staticmethod
-    def _process_log(file_path: str) -> List[Document]:
-        documents = []
-        with open(file_path, "r", encoding="utf-8") as f:
-            for line in f:
-                documents.append(Document(text=line.strip()))
-        return documents
+    def _process_log(
+        file_path: str,
+        options: Optional[Dict[str, Any]] = None,
+        max_bytes: Optional[int] = None,
+    ) -> Iterator[Document]:
+        """
+        按多行记录切分日志：一条日志连同其栈帧/异常链作为一个文档。
+        以二进制读取，元数据记录记录在文件中的字节偏移和长度，供检索时懒加载原文。
+        压缩文件边解压边解析；其偏移位于解压后的流中，无法 mmap，不记录偏移。
+        :param max_bytes: 未压缩文件只解析到该字节数所在的行（含）为止，
+            之后追加的内容由 LogTailer 从同一位置接续
+        """
+        options = options or {}
+        assembler = LogRecordAssembler(options.get("record_start_patterns"))
+        record_keys = ["line", "line_count", "offset", "length"] + STRUCTURED_KEYS
+        compressed = split_source_name(file_path)[1] is not None
+        inode = os.stat(file_path).st_ino
+        with open_binary(file_path) as f:
+            raw_lines: Iterable[bytes] = f
+            if max_bytes is not None and not compressed:
+                raw_lines = TopKLogSystem._lines_until(f, max_bytes)
+            for line_no, offset, length, lines in assembler.iter_records(raw_lines):
+                metadata = {"line": line_no, "line_count": len(lines)}
+                # 时间戳、级别、主机、服务，用于检索时在 Chroma 中过滤
+                metadata.update(extract_metadata(lines[0]))
+                if not compressed:
+                    metadata["offset"] = offset
+                    metadata["length"] = length
+                yield Document(
+                    id_=record_document_id(
+                        inode, None if compressed else offset, line_no
+                    ),
+                    text="\n".join(lines),
+                    metadata=metadata,
+                    excluded_embed_metadata_keys=list(record_keys),
+                    excluded_llm_metadata_keys=list(record_keys),
+                )
 
     @staticmethod
-    def _process_docx(file_path: str) -> List[Document]:
-        documents = []
+    def _lines_until(f, max_bytes: int) -> Iterator[bytes]:
+        """逐行读取，跨过 max_bytes 的那一行读完后停止"""
+        position = 0
+        for line in f:
+            if position >= max_bytes:
+                return
+            yield line
+            position += len(line)
+
+    @staticmethod
+    def _process_templates(
+        file_path: str,
+        ext: str,
+        options: Optional[Dict[str, Any]] = None,
+        source: str = "",
+        max_bytes: Optional[int] = None,
+    ) -> Iterator[Document]:
+        """
+        日志模板挖掘：把大量只在 ID/IP/时间戳上不同的日志记录归并为模板，
+        每个模板产出一个文档，元数据中保留出现次数、首末次时间和少量样例；
+        每次出现的时间戳放在 TEMPLATE_OCCURRENCES_KEY 中，写入时间索引后不入向量库。
+        """
+        miner = TemplateMiner()
+        # 模板首次出现的记录位置（.log），用于检索时展开原文上下文
+        first_spans: Dict[int, Tuple[int, int]] = {}
+        # 模板每次出现的时间戳，按 8 字节一个紧凑保存
+        occurrences: Dict[int, array] = {}
+        if ext == ".csv":
+            documents = enumerate(
+                TopKLogSystem._process_csv(file_path, options, source), 1
+            )
+        else:
+            documents = (
+                (document.metadata["line"], document)
+                for document in TopKLogSystem._process_log(
+                    file_path, options, max_bytes
+                )
+            )
+        for line_no, document in documents:
+            # 多行记录（含栈帧）整体参与模板匹配
+            cluster = miner.add(document.text, line_no)
+            if cluster is None:
+                continue
+            if cluster.count == 1 and "offset" in document.metadata:
+                first_spans[id(cluster)] = (
+                    document.metadata["offset"],
+                    document.metadata["length"],
+                )
+            if document.metadata.get("ts") is not None:
+                occurrences.setdefault(id(cluster), array("d")).append(
+                    document.metadata["ts"]
+                )
+
+        template_keys = [
+            "kind",
+            "template_count",
+            "first_seen",
+            "last_seen",
+            "first_line",
+            "samples",
+            "first_offset",
+            "first_length",
+            TEMPLATE_OCCURRENCES_KEY,
+        ] + STRUCTURED_KEYS
+        for cluster in miner.clusters:
+            # 级别/主机/服务取自首个样例，时间范围为首次到末次出现
+            first_sample = cluster.samples[0] if cluster.samples else ""
+            metadata = extract_metadata(first_sample)
+            metadata.pop("ts", None)
+            metadata.pop("ts_end", None)
+            first_ts = parse_timestamp(cluster.first_seen or "")
+            last_ts = parse_timestamp(cluster.last_seen or "")
+            if first_ts is not None and last_ts is not None:
+                metadata["ts"], metadata["ts_end"] = first_ts, last_ts
+            metadata.update(
+                {
+                    "kind": "template",
+                    "template_count": cluster.count,
+                    "first_seen": cluster.first_seen or "",
+                    "last_seen": cluster.last_seen or "",
+                    "first_line": cluster.first_line,
+                    # 样例可能是多行记录，用 JSON 数组保存
+                    "samples": json.dumps(cluster.samples, ensure_ascii=False),
+                }
+            )
+            if id(cluster) in first_spans:
+                metadata["first_offset"], metadata["first_length"] = first_spans[
+                    id(cluster)
+                ]
+            if id(cluster) in occurrences:
+                metadata[TEMPLATE_OCCURRENCES_KEY] = occurrences[id(cluster)]
+            yield Document(
+                text=cluster.template,
+                metadata=metadata,
+                excluded_embed_metadata_keys=list(template_keys),
+                excluded_llm_metadata_keys=list(template_keys),
+            )
+
+    @staticmethod
+    def _process_docx(file_path: str) -> Iterator[Document]:
         doc = DocxDocument(file_path)
         for paragraph in doc.paragraphs:
             if paragraph.text.strip():
-                documents.append(Document(text=paragraph.text.strip()))
-        return documents
+                yield Document(text=paragraph.text.strip())
 
     @staticmethod
-    def _process_pdf(file_path: str) -> List[Document]:
-        documents = []
+    def _process_pdf(
+        file_path: str, options: Optional[Dict[str, Any]] = None
+    ) -> Iterator[Document]:
         reader = PdfReader(file_path)
-        for page in reader.pages:
+        for page_no, page in enumerate(reader.pages, 1):
             text = page.extract_text()
             if text:
-                documents.append(Document(text=text.strip()))
-        return documents
+                # 偏移相对于该页文本
+                yield from TopKLogSystem._chunk_documents(
+                    text, "text", options, page=page_no
+                )
 
     @staticmethod
-    def _process_text(file_path: str) -> List[Document]:
-        documents = []
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
-            documents.append(Document(text=content))
-        return documents
-
-    def retrieve_logs(self, query: str, top_k: int = 10, use_keyword: bool = True, filter_func=None) -> List[Dict]:
+    def _process_text(
+        file_path: str, options: Optional[Dict[str, Any]] = None
+    ) -> Iterator[Document]:
+        # Markdown 按标题切块，其他文本按段落切块；按窗口流式读取，不整体载入
+        kind = "markdown" if file_path.endswith(".md") else "text"
+        index = 0
+        with open_text(file_path) as f:
+            for offset, content in iter_text_windows(f, kind):
+                for document in TopKLogSystem._chunk_documents(
+                    content, kind, options, offset=offset, first_index=index
+                ):
+                    index += 1
+                    yield document
+
+    def retrieve_logs(
+        self,
+        query: str,
+        top_k: int = 10,
+        use_keyword: bool = True,
+        filter_func=None,
+        context_lines: int = 0,
+        knowledge_bases: Optional[List[str]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict]:
         """
         增强版检索：向量检索+关键词检索融合，支持分数重排序和可选过滤。
         :param query: 检索内容
         :param top_k: 返回条数
         :param use_keyword: 是否融合关键词检索
         :param filter_func: 可选过滤函数，接收一条日志dict，返回bool
+        :param context_lines: 从原日志文件中为每条命中展开前后各 N 行，放在结果的 "context" 中
+        :param knowledge_bases: 指定检索的知识库（完整名称、类别或目录名），
+            为空时按查询内容路由；多个知识库并行检索后合并
+        :param filters: 声明式过滤条件 {"levels", "services", "hosts", "since", "until"}，
+            转换为 Chroma where 子句在索引内过滤，见 log_metadata.build_where；
+            {"around": 故障时间点, "window": "15m"} 检索该时间点前后的日志，
+            候选先按时间戳索引二分查找限定，再在候选上做向量打分
+        每条结果的 "score" 为融合分，"scores" 为各通道原始分（vector 余弦相似度、
+        keyword BM25），"source" 为 vector / keyword / hybrid（两路都命中），
+        "duplicates" 为被合并掉的近似重复条数。
+        """
+        return self.retrieve_logs_batch(
+            [query],
+            top_k=top_k,
+            use_keyword=use_keyword,
+            filter_func=filter_func,
+            context_lines=context_lines,
+            knowledge_bases=knowledge_bases,
+            filters=filters,
+        )[0]
+
+    def retrieve_logs_batch(
+        self,
+        queries: List[str],
+        top_k: int = 10,
+        use_keyword: bool = True,
+        filter_func=None,
+        context_lines: int = 0,
+        knowledge_bases: Optional[List[str]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Dict]]:
         """
-        if not self.log_index:
+        批量检索，参数含义同 retrieve_logs，对每个查询生效，按输入顺序返回各自的结果。
+        未命中结果缓存的查询一次批量嵌入；每个知识库只做一次多查询向量检索
+        （Chroma 一次 collection.query，flat 后端一次矩阵乘），再逐条融合关键词结果。
+        """
+        self.reload_if_changed()
+        store = self.store
+        if store is None:
             logger.warning("Log index 未初始化，跳过检索。")
-            return []
+            return [[] for _ in queries]
+        results: List[Optional[List[Dict]]] = [None] * len(queries)
+        # filter_func 无法作为缓存键，传入时不使用结果缓存
+        cache_keys: List[Optional[tuple]] = [None] * len(queries)
+        if filter_func is None:
+            for i, query in enumerate(queries):
+                cache_keys[i] = (
+                    EmbeddingCache.normalize(query),
+                    top_k,
+                    use_keyword,
+                    context_lines,
+                    tuple(knowledge_bases or ()),
+                    json.dumps(filters or {}, sort_keys=True, ensure_ascii=False),
+                    store.prefix,
+                    store.version,
+                )
+                cached = self.result_cache.get(cache_keys[i])
+                if cached is not None:
+                    results[i] = copy.deepcopy(cached)
+        pending = [i for i, result in enumerate(results) if result is None]
+        if not pending:
+            return results
         try:
-            # 1. 向量检索
-            retriever = self.log_index.as_retriever(similarity_top_k=top_k * 2 if use_keyword else top_k)
-            vector_results = retriever.retrieve(query)
-            vector_set = set()
-            formatted_vector = []
-            for result in vector_results:
-                key = result.text.strip()
-                vector_set.add(key)
-                formatted_vector.append({"content": key, "score": float(result.score), "source": "vector"})
-
-            # 2. 关键词检索（简单实现：全文包含query关键词，或分词后包含）
-            keyword_results = []
-            if use_keyword:
-                # 直接遍历所有日志（如数据量大可优化为倒排索引）
-                all_logs = self.log_index.docstore.docs.values() if hasattr(self.log_index, 'docstore') else []
-                qwords = set(query.lower().split())
-                for doc in all_logs:
-                    text = getattr(doc, 'text', str(doc)).strip()
-                    if text in vector_set:
-                        continue  # 避免重复
-                    # 简单分词匹配
-                    if any(word in text.lower() for word in qwords):
-                        keyword_results.append({"content": text, "score": 0.5, "source": "keyword"})
-
-            # 3. 融合与重排序
-            all_results = formatted_vector + keyword_results
-            # 分数归一化/加权（可根据需要调整）
-            all_results.sort(key=lambda x: x["score"], reverse=True)
-
-            # 4. 可选过滤
-            if filter_func:
-                all_results = [item for item in all_results if filter_func(item)]
-
-            # 5. 截断top_k
-            return all_results[:top_k]
+            available = store.knowledge_bases()
+            targets: Dict[int, List[str]] = {}
+            for i in pending:
+                if knowledge_bases:
+                    targets[i] = self.router.resolve(knowledge_bases, available)
+                else:
+                    targets[i] = self.router.route(queries[i], available)
+
+            where = build_where(filters)
+            candidates = self._time_candidates(store, filters, targets)
+
+            # 1. 向量检索：查询向量一次批量计算，按知识库分组后每个知识库检索一次
+            # 开启近似重复合并时多取候选：大量命中是同一条重复日志时，
+            # 合并后仍能凑满 top_k 条
+            if self.dedupe_distance is not None:
+                similarity_top_k = top_k * 4
+            else:
+                similarity_top_k = top_k * 2 if use_keyword else top_k
+            embeddings = dict(
+                zip(pending, self._query_embeddings([queries[i] for i in pending]))
+            )
+            groups: Dict[str, List[int]] = {}
+            for i in pending:
+                for kb in targets[i]:
+                    groups.setdefault(kb, []).append(i)
+
+            def search(kb: str) -> Tuple[str, List[int], List[List[VectorHit]]]:
+                indices = groups[kb]
+                vectors = [embeddings[i] for i in indices]
+                if candidates is None:
+                    hits = store.search(kb, vectors, similarity_top_k, where)
+                elif candidates.get(kb):
+                    hits = store.search_ids(
+                        kb, vectors, candidates[kb], similarity_top_k, where
+                    )
+                else:
+                    hits = [[] for _ in indices]
+                return kb, indices, hits
+
+            if len(groups) == 1:
+                batches = [search(next(iter(groups)))]
+            else:
+                batches = list(self._search_pool.map(search, groups))
+            vector_results: Dict[int, List[Tuple[str, VectorHit]]] = {
+                i: [] for i in pending
+            }
+            for kb, indices, hits in batches:
+                for i, query_hits in zip(indices, hits):
+                    vector_results[i].extend((kb, hit) for hit in query_hits)
+
+            for i in pending:
+                if not targets[i]:
+                    results[i] = []
+                    continue
+                results[i] = self._merge_results(
+                    store,
+                    queries[i],
+                    targets[i],
+                    vector_results[i],
+                    use_keyword,
+                    similarity_top_k,
+                    top_k,
+                    context_lines,
+                    filter_func,
+                    where,
+                )
+                if cache_keys[i] is not None:
+                    self.result_cache.put(cache_keys[i], copy.deepcopy(results[i]))
         except Exception as e:
             logger.error(f"日志检索失败: {e}")
+            for i in pending:
+                if results[i] is None:
+                    results[i] = []
+        return results
+
+    def _time_candidates(
+        self,
+        store: BaseKnowledgeBaseStore,
+        filters: Optional[Dict[str, Any]],
+        targets: Dict[int, List[str]],
+    ) -> Optional[Dict[str, List[str]]]:
+        """
+        过滤条件限定了时间范围时，按时间戳索引取出各知识库在范围内的节点 id；
+        未限定时间、没有时间索引或候选超过 time_candidate_limit 时返回 None，
+        退回在向量库内按 where 过滤。
+        """
+        since, until = time_range(filters)
+        if store.times is None or (since is None and until is None):
+            return None
+        knowledge_bases = {kb for kbs in targets.values() for kb in kbs}
+        return store.times.node_ids(
+            since if since is not None else float("-inf"),
+            until if until is not None else float("inf"),
+            knowledge_bases,
+            limit=self.time_candidate_limit,
+        )
+
+    def _merge_results(
+        self,
+        store: BaseKnowledgeBaseStore,
+        query: str,
+        targets: List[str],
+        vector_results: List[Tuple[str, VectorHit]],
+        use_keyword: bool,
+        similarity_top_k: int,
+        top_k: int,
+        context_lines: int,
+        filter_func=None,
+        where: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict]:
+        """单个查询的向量结果与关键词结果合并、融合打分、去重、过滤和重排，返回前 top_k 条"""
+        vector_results.sort(key=lambda hit: hit[1].score, reverse=True)
+
+        # 按原文去重合并两路结果：content → 结果，各通道记录 (content, 原始分) 排名
+        results: Dict[str, Dict[str, Any]] = {}
+        legs: Dict[str, List[Tuple[str, float]]] = {"vector": [], "keyword": []}
+        # content → (知识库, 节点 id)，MMR 重排时按 id 读取向量
+        node_refs: Dict[str, Tuple[str, str]] = {}
+
+        def collect(
+            leg: str, metadata: Dict, node_id: str, text: str, score: float
+        ) -> None:
+            content, context = self._resolve_log_text(metadata, text, context_lines)
+            key = content.strip()
+            item = results.get(key)
+            # 同一条记录被切成多个节点时，懒加载后的原文相同，只保留一次
+            if not key or (item is not None and leg in item["scores"]):
+                return
+            legs[leg].append((key, score))
+            if item is None:
+                item = {
+                    "content": key,
+                    "source": leg,
+                    "metadata": metadata,
+                    "scores": {},
+                }
+                if context:
+                    item["context"] = context
+                results[key] = item
+                node_refs[key] = (metadata["knowledge_base"], node_id)
+            elif item["source"] != leg:
+                item["source"] = "hybrid"
+            item["scores"][leg] = score
+
+        for kb, hit in vector_results:
+            metadata = dict(hit.metadata)
+            metadata["knowledge_base"] = kb
+            collect("vector", metadata, hit.node_id, hit.text, hit.score)
+
+        # 2. 关键词检索：查询持久化的倒排索引（BM25 打分）；
+        # 倒排索引不支持元数据过滤，有过滤条件时多取候选再按 where 在内存中过滤
+        if use_keyword and store.keywords is not None:
+            keyword_hits = store.keywords.search(
+                query,
+                set(targets),
+                limit=similarity_top_k * 5 if where else similarity_top_k,
+            )
+            keyword_hits = [
+                hit for hit in keyword_hits if matches_where(hit["metadata"], where)
+            ][:similarity_top_k]
+            for hit in keyword_hits:
+                metadata = dict(hit["metadata"])
+                metadata["knowledge_base"] = hit["kb"]
+                collect("keyword", metadata, hit["id"], hit["text"], hit["score"])
+
+        # 3. 融合：RRF 或归一化加权，各通道原始分保留在 "scores" 中便于调参
+        fused = fuse_scores(
+            legs, self.fusion, k=self.fusion_k, weights=self.fusion_weights
+        )
+        for key, item in results.items():
+            item["score"] = fused.get(key, 0.0)
+        all_results = sorted(results.values(), key=lambda x: x["score"], reverse=True)
+
+        # 4. 去掉近似重复：只是时间戳、ID、数字不同的同一条日志只保留一条
+        if self.dedupe_distance is not None:
+            all_results = drop_near_duplicates(
+                all_results, self.tokenizer.tokenize, self.dedupe_distance
+            )
+
+        # 5. 可选过滤
+        if filter_func:
+            all_results = [item for item in all_results if filter_func(item)]
+
+        # 6. 可选的 MMR 重排，在相关度和多样性之间取舍
+        if self.mmr_lambda is not None and len(all_results) > 1:
+            all_results = self._mmr_rerank(all_results, node_refs, top_k)
+
+        # 7. 截断top_k
+        return all_results[:top_k]
+
+    def error_bursts(
+        self,
+        since: Any,
+        until: Any,
+        knowledge_bases: Optional[List[str]] = None,
+        gap: Any = "1m",
+        limit: int = 5,
+        samples: int = 3,
+    ) -> List[Dict[str, Any]]:
+        """
+        "T1 到 T2 之间发生了什么"：按时间戳索引取出区间内的错误级别日志，
+        相邻两条的间隔超过 gap 即切分为一次突发，取条数最多的 limit 次，按时间顺序返回。
+        :param since: 起始时间，时间字符串、Unix 秒或相对时间 "30m"
+        :param until: 结束时间
+        :param knowledge_bases: 限定的知识库，为空时统计全部知识库
+        :param gap: 切分突发的最大间隔，秒数或 "30s" / "1m" 形式的时长
+        :param samples: 每次突发附带的样例日志条数
+        每次突发包含起止时间、条数、每分钟条数、各来源文件的条数和样例日志。
+        """
+        start, end = parse_time_bound(since), parse_time_bound(until)
+        if start is None or end is None:
+            raise ValueError("需要同时指定 since 和 until")
+        if start > end:
+            raise ValueError("since 不能晚于 until")
+        max_gap = parse_duration(gap)
+        store = self.store
+        if store is None or store.times is None:
+            logger.warning("时间索引未初始化，跳过错误突发统计。")
             return []
+        kbs = None
+        if knowledge_bases:
+            kbs = set(self.router.resolve(knowledge_bases, store.knowledge_bases()))
+        entries = store.times.lookup(start, end, kbs, errors_only=True)
+
+        # 模板文档每次出现各是一条记录，突发的条数按出现次数计；没有逐次时间戳的
+        # 模板覆盖 [首次, 末次] 出现区间，按与查询区间相交部分的起点归入突发
+        bursts: List[List[TimeEntry]] = []
+        burst_end = float("-inf")
+        for entry in entries:
+            ts = max(entry.ts, start)
+            if not bursts or ts - burst_end > max_gap:
+                bursts.append([])
+                burst_end = ts
+            bursts[-1].append(entry)
+            burst_end = max(burst_end, min(entry.ts_end, end))
+        densest = sorted(bursts, key=len, reverse=True)[: max(0, limit)]
+        densest.sort(key=lambda burst: burst[0].ts)
+        return [
+            self._describe_burst(store, burst, start, end, samples)
+            for burst in densest
+        ]
+
+    def _describe_burst(
+        self,
+        store: BaseKnowledgeBaseStore,
+        burst: List[TimeEntry],
+        since: float,
+        until: float,
+        samples: int,
+    ) -> Dict[str, Any]:
+        first = max(burst[0].ts, since)
+        last = max(min(entry.ts_end, until) for entry in burst)
+        sources: Dict[str, int] = {}
+        for entry in burst:
+            sources[entry.source] = sources.get(entry.source, 0) + 1
+        sample_logs = []
+        # 同一模板多次出现时只取一条作为样例
+        picked: List[TimeEntry] = []
+        picked_ids: Set[str] = set()
+        for entry in burst:
+            if len(picked) >= samples:
+                break
+            if entry.node_id not in picked_ids:
+                picked_ids.add(entry.node_id)
+                picked.append(entry)
+        ids_by_kb: Dict[str, List[str]] = {}
+        for entry in picked:
+            ids_by_kb.setdefault(entry.kb, []).append(entry.node_id)
+        documents: Dict[str, VectorHit] = {}
+        for kb, ids in ids_by_kb.items():
+            try:
+                documents.update(store.documents(kb, ids))
+            except Exception as e:
+                logger.warning(f"读取突发样例日志失败 {kb}: {e}")
+        for entry in picked:
+            hit = documents.get(entry.node_id)
+            if hit is None:
+                continue
+            metadata = dict(hit.metadata)
+            metadata["knowledge_base"] = entry.kb
+            content, _ = self._resolve_log_text(metadata, hit.text)
+            sample_logs.append({"content": content.strip(), "metadata": metadata})
+        return {
+            "start": first,
+            "end": last,
+            "start_time": datetime.fromtimestamp(first).isoformat(),
+            "end_time": datetime.fromtimestamp(last).isoformat(),
+            "count": len(burst),
+            "rate_per_min": round(len(burst) * 60 / max(last - first, 60.0), 2),
+            "sources": sources,
+            "samples": sample_logs,
+        }
+
+    def _mmr_rerank(
+        self,
+        results: List[Dict],
+        node_refs: Dict[str, Tuple[str, str]],
+        top_k: int,
+    ) -> List[Dict]:
+        """按节点 id 从各知识库集合读取候选向量，用 MMR 选出 top_k 条"""
+        ids_by_kb: Dict[str, List[str]] = {}
+        for item in results:
+            kb, node_id = node_refs[item["content"]]
+            ids_by_kb.setdefault(kb, []).append(node_id)
+        vectors: Dict[str, Any] = {}
+        for kb, ids in ids_by_kb.items():
+            try:
+                vectors.update(self.store.embeddings(kb, ids))
+            except Exception as e:
+                logger.warning(f"读取候选向量失败 {kb}: {e}")
+        order = mmr_order(
+            [item["score"] for item in results],
+            [vectors.get(node_refs[item["content"]][1]) for item in results],
+            self.mmr_lambda,
+            top_k,
+        )
+        return [results[i] for i in order]
+
+    def _query_embeddings(self, queries: List[str]) -> List[List[float]]:
+        """查询向量：先查进程内 LRU，未命中的查询一次批量嵌入"""
+        keys = [
+            (self._embedding_model_name, EmbeddingCache.normalize(query))
+            for query in queries
+        ]
+        embeddings = [self.query_embedding_cache.get(key) for key in keys]
+        missing: Dict[Tuple[str, str], str] = {}
+        for key, query, embedding in zip(keys, queries, embeddings):
+            if embedding is None:
+                missing.setdefault(key, query)
+        if not missing:
+            return embeddings
+        texts = list(missing.values())
+        if len(texts) == 1:
+            vectors = [Settings.embed_model.get_query_embedding(texts[0])]
+        else:
+            # CachedEmbeddings 按查询类型读写持久缓存；未包装缓存时直接批量请求模型
+            if isinstance(self.embedding_model, CachedEmbeddings):
+                vectors = self.embedding_model.embed_queries(texts)
+            else:
+                vectors = self.embedding_model.embed_documents(texts)
+        computed = dict(zip(missing, vectors))
+        for key, vector in computed.items():
+            self.query_embedding_cache.put(key, vector)
+        return [
+            embedding if embedding is not None else computed[key]
+            for key, embedding in zip(keys, embeddings)
+        ]
+
+    def _resolve_log_text(
+        self, metadata: Dict, text: str, context_lines: int = 0
+    ) -> Tuple[str, Optional[str]]:
+        """
+        按元数据中的 (source, offset, length) 从日志文件懒加载原文，返回 (原文, 上下文)。
+        模板文档保留模板文本，只用首次出现位置展开上下文。
+        文件已被截断/删除/轮转导致偏移失效时记录警告，退回向量库中保存的文本
+        （懒加载记录只保存了开头 LAZY_TEXT_SNIPPET_CHARS 个字符，结果可能不完整）。
+        """
+        source = metadata.get("source")
+        if metadata.get("kind") == "template":
+            offset, length = metadata.get("first_offset"), metadata.get("first_length")
+            if context_lines <= 0:
+                return text, None
+        else:
+            offset, length = metadata.get("offset"), metadata.get("length")
+        if not source or offset is None or length is None:
+            return text, None
+
+        file_path = os.path.join(self.log_path, source)
+        entry = self.manifest.files.get(source)
+        try:
+            # 只追加写入不影响已有偏移；文件变小说明已被改写，偏移不再可信
+            if entry and os.path.getsize(file_path) < entry.get("size", 0):
+                raise ValueError("文件已变化")
+            content, context = self.log_reader.read(
+                file_path, int(offset), int(length), context_lines
+            )
+            if content is None:
+                raise ValueError("偏移超出文件范围")
+        except (OSError, ValueError) as e:
+            logger.warning(f"按偏移读取日志原文失败 {source}: {e}")
+            return text, None
+        if metadata.get("kind") == "template":
+            return text, context
+        return content, context
+
+    def embedding_cache_stats(self) -> Optional[Dict[str, float]]:
+        """嵌入缓存的命中/未命中计数，未启用缓存时返回 None"""
+        if self.embedding_cache is None:
+            return None
+        return self.embedding_cache.stats()
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """各级缓存的条目数和命中率"""
+        return {
+            "query_embeddings": self.query_embedding_cache.stats(),
+            "retrieval_results": self.result_cache.stats(),
+            "query_rewrites": self.query_rewriter.cache.stats(),
+            "embedding_store": self.embedding_cache_stats(),
+        }
 
     # (修改) context 现在是一个字典
     def _get_or_create_llm(self, model_name: Optional[str]) -> OllamaLLM:
@@ -422,12 +2176,20 @@ class TopKLogSystem:
         context: Dict,
         history: List[Dict] = None,
         model_name: Optional[str] = None,
+        rewrite: bool = True,
+        usage: Optional[Dict[str, Any]] = None,
     ):
-        # 新增：先对 query 做标准化/纠错/扩展
-        query = self._rewrite_query(query)
-        prompt_messages = self._build_prompt(query, context, history)
-
+        """
+        流式生成回复。usage 传入字典时填入 prompt 各部分的 token 数
+        （system / query / history / logs / web / total / budget）和被裁剪的条数 dropped。
+        """
+        # 新增：先对 query 做标准化/纠错/扩展；调用方已改写过时传 rewrite=False
+        if rewrite:
+            query = self._rewrite_query(query)
         llm_to_use = self._get_or_create_llm(model_name)
+        prompt_messages = self._build_prompt(
+            query, context, history, model_name=llm_to_use.model, usage=usage
+        )
 
         # 更新当前使用的 LLM，确保后续依赖 Settings.llm 的流程保持一致
         with self._llm_lock:
@@ -442,9 +2204,30 @@ class TopKLogSystem:
             logger.error(f"LLM调用失败: {e}")
             yield f"生成响应时出错: {str(e)}"
 
+    @staticmethod
+    def _format_log_scores(log: Dict[str, Any]) -> str:
+        """
+        提示词中的相关度：给出各通道的原始分（向量余弦相似度、关键词 BM25），
+        RRF 融合分约为 1/(60+名次)，数值本身对模型没有意义，只在缺少通道分时使用
+        """
+        scores = log.get("scores") or {}
+        parts = []
+        if scores.get("vector") is not None:
+            parts.append(f"向量相似度 {scores['vector']:.2f}")
+        if scores.get("keyword") is not None:
+            parts.append(f"关键词 BM25 {scores['keyword']:.1f}")
+        if not parts:
+            parts.append(f"Score: {log.get('score', 0.0):.2f}")
+        return "，".join(parts)
+
     # (修改) context 现在是一个字典, 并更新 Prompt
     def _build_prompt(
-        self, query: str, context: Dict, history: List[Dict] = None
+        self,
+        query: str,
+        context: Dict,
+        history: List[Dict] = None,
+        model_name: Optional[str] = None,
+        usage: Optional[Dict[str, Any]] = None,
     ) -> List:
 
         system_message = SystemMessagePromptTemplate.from_template(
@@ -473,25 +2256,57 @@ class TopKLogSystem:
             """
         )
 
-        # (修改) 2. 准备日志上下文 (Log DB)
-        log_context_str = "## [可用工具 1: 日志数据库 (Log DB)]\n"
+        # (修改) 2. 准备日志上下文 (Log DB)，每条日志单独成段，便于按预算裁剪
+        log_header = "## [可用工具 1: 日志数据库 (Log DB)]\n"
         log_data = context.get("log_context", [])  # 从字典获取
-        if not log_data:
-            log_context_str += "（未从日志数据库检索到相关内容）\n"
-        else:
+        log_items: List[str] = []
+        if log_data:
             for i, log in enumerate(log_data, 1):
-                # 确保 score 是浮点数以便格式化
-                score = log.get("score", 0.0)
-                log_context_str += f"日志 {i} (Score: {score:.2f}): {log['content']}\n"
+                scores = self._format_log_scores(log)
+                log_context_str = f"日志 {i} ({scores}): {log['content']}\n"
+                metadata = log.get("metadata") or {}
+                if metadata.get("kind") == "template":
+                    # 模板文档：补充出现次数、时间范围和样例，方便模型判断影响面
+                    log_context_str += (
+                        f"    (出现 {metadata.get('template_count', 0)} 次，"
+                        f"首次 {metadata.get('first_seen') or '未知'}，"
+                        f"末次 {metadata.get('last_seen') or '未知'})\n"
+                    )
+                    for sample in json.loads(metadata.get("samples") or "[]"):
+                        log_context_str += f"    样例: {sample}\n"
+                elif "chunk_start" in metadata:
+                    # 文档切块：标注片段位置，便于模型区分同一文件的不同片段
+                    location = f"{metadata.get('source', '')}"
+                    if metadata.get("page"):
+                        location += f" 第 {metadata['page']} 页"
+                    log_context_str += (
+                        f"    (片段: {location} "
+                        f"[{metadata['chunk_start']}:{metadata['chunk_end']}])\n"
+                    )
+                if log.get("duplicates"):
+                    # 近似重复的日志已合并，只保留条数
+                    log_context_str += (
+                        f"    (另有 {log['duplicates']} 条仅时间戳/ID/数值不同的相似日志)\n"
+                    )
+                if log.get("context"):
+                    # 原日志文件中命中记录前后的若干行
+                    log_context_str += (
+                        f"    上下文 ({metadata.get('source', '')}):\n"
+                        + "\n".join(
+                            f"    | {line}" for line in log["context"].splitlines()
+                        )
+                        + "\n"
+                    )
+                log_items.append(log_context_str)
 
         # (新增) 3. 准备联网搜索上下文 (Web Search)
-        web_context_str = "## [可用工具 2: 联网搜索 (Web Search)]\n"
+        web_header = "## [可用工具 2: 联网搜索 (Web Search)]\n"
         web_data = context.get("web_context", [])
-        if not web_data:
-            web_context_str += "（未启用或未从联网搜索检索到相关内容）\n"
-        else:
-            for i, web_result in enumerate(web_data, 1):
-                web_context_str += f"网页 {i} (Source: {web_result.get('source', 'N/A')}): {web_result['content']}\n"
+        web_items = [
+            f"网页 {i} (Source: {web_result.get('source', 'N/A')}): "
+            f"{web_result['content']}\n"
+            for i, web_result in enumerate(web_data or [], 1)
+        ]
 
         # (修改) 4. 更新用户模板
         user_message_template = HumanMessagePromptTemplate.from_template(
@@ -549,7 +2364,7 @@ class TopKLogSystem:
             ]
         )
 
-        formatted_history = []
+        formatted_history: List[Any] = []
         if history:
             for msg in history:
                 if msg["role"] == "user":
@@ -566,6 +2381,45 @@ class TopKLogSystem:
                     # 兼容旧格式 (如果存在)
                     formatted_history.append(AIMessage(content=msg["content"]))
 
+        # 5. token 预算：系统提示和问题不裁剪；日志和网页按相关度排序，从末尾丢弃，
+        # 历史对话从最早的消息开始丢弃
+        fitted = self.prompt_budget.fit(
+            model_name,
+            {
+                "system": system_message.format().content,
+                "query": user_message_template.format(
+                    log_context=log_header, web_context=web_header, query=query
+                ).content,
+            },
+            {
+                "history": [msg.content for msg in reversed(formatted_history)],
+                "logs": log_items,
+                "web": web_items,
+            },
+        )
+        kept_history = fitted.items["history"][::-1]
+        formatted_history = [
+            msg.__class__(content=content)
+            for msg, content in zip(
+                formatted_history[len(formatted_history) - len(kept_history) :],
+                kept_history,
+            )
+        ]
+        log_context_str = log_header + "".join(fitted.items["logs"])
+        if not log_data:
+            log_context_str += "（未从日志数据库检索到相关内容）\n"
+        elif fitted.dropped["logs"]:
+            log_context_str += (
+                f"（另有 {fitted.dropped['logs']} 条相关度较低的日志因上下文长度限制未列出）\n"
+            )
+        web_context_str = web_header + "".join(fitted.items["web"])
+        if not web_data:
+            web_context_str += "（未启用或未从联网搜索检索到相关内容）\n"
+        if usage is not None:
+            usage.update(fitted.usage, dropped=fitted.dropped)
+        if any(fitted.dropped.values()):
+            logger.info(f"prompt 超出 token 预算，已裁剪: {fitted.dropped}")
+
         # (修改) 传递 web_context
         return prompt_template.format_prompt(
             chat_history=formatted_history,
@@ -602,6 +2456,7 @@ class TopKLogSystem:
             combined_context,
             history,
             model_name=model_name,
+            rewrite=False,
         ):
             yield chunk
 
@@ -0,0 +1,173 @@
+from typing import Dict, Optional, Union
+
+import numpy as np
+
+# 支持的压缩方式
+QUANTIZATIONS = ("int8", "pq")
+
+
+class ScalarQuantizer:
+    """
+    int8 标量量化：每一维按训练样本的分位数范围线性映射到 0~255，每维 1 字节。
+    近似内积 q·x ≈ (q * scale)·code + q·low，直接在编码上做矩阵乘。
+    """
+
+    name = "int8"
+
+    def __init__(self, low: np.ndarray, scale: np.ndarray) -> None:
+        self.low = low.astype(np.float32)
+        self.scale = scale.astype(np.float32)
+
+    @classmethod
+    def train(cls, sample: np.ndarray, clip: float = 0.001) -> "ScalarQuantizer":
+        """按 [clip, 1 - clip] 分位数确定每一维的范围，少量离群值被截断"""
+        low = np.quantile(sample, clip, axis=0)
+        high = np.quantile(sample, 1 - clip, axis=0)
+        scale = np.maximum(high - low, 1e-6) / 255.0
+        return cls(low, scale)
+
+    @property
+    def code_size(self) -> int:
+        return len(self.low)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((vectors - self.low) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def prepare(self, queries: np.ndarray) -> Dict[str, np.ndarray]:
+        return {"weights": queries * self.scale, "bias": queries @ self.low}
+
+    def scores(self, prepared: Dict[str, np.ndarray], codes: np.ndarray) -> np.ndarray:
+        weights = prepared["weights"]
+        return weights @ codes.astype(np.float32).T + prepared["bias"][:, None]
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {"low": self.low, "scale": self.scale}
+
+    @classmethod
+    def from_arrays(cls, arrays) -> "ScalarQuantizer":
+        return cls(arrays["low"], arrays["scale"])
+
+
+class ProductQuantizer:
+    """
+    乘积量化（PQ）：向量切成 subspaces 段，每段用 k-means 训练 256 个中心，
+    每条向量只保存各段最近中心的编号（每段 1 字节）。
+    检索时每个查询先算出各段与全部中心的内积表，编码查表求和即为近似内积（ADC）。
+    """
+
+    name = "pq"
+
+    def __init__(self, centroids: np.ndarray) -> None:
+        # (subspaces, 中心数, 每段维度)
+        self.centroids = centroids.astype(np.float32)
+
+    @classmethod
+    def train(
+        cls,
+        sample: np.ndarray,
+        subspaces: int = 64,
+        iterations: int = 12,
+        seed: int = 0,
+    ) -> "ProductQuantizer":
+        dim = sample.shape[1]
+        if dim % subspaces:
+            raise ValueError(f"向量维度 {dim} 不能被 PQ 分段数 {subspaces} 整除")
+        rng = np.random.default_rng(seed)
+        clusters = min(256, len(sample))
+        step = dim // subspaces
+        centroids = np.stack(
+            [
+                cls._kmeans(
+                    sample[:, j * step : (j + 1) * step], clusters, iterations, rng
+                )
+                for j in range(subspaces)
+            ]
+        )
+        return cls(centroids)
+
+    @staticmethod
+    def _kmeans(
+        data: np.ndarray, clusters: int, iterations: int, rng: np.random.Generator
+    ) -> np.ndarray:
+        centers = data[rng.choice(len(data), clusters, replace=False)].copy()
+        for _ in range(iterations):
+            labels = ProductQuantizer._nearest(data, centers)
+            counts = np.bincount(labels, minlength=clusters)
+            sums = np.zeros_like(centers)
+            np.add.at(sums, labels, data)
+            empty = counts == 0
+            centers[~empty] = sums[~empty] / counts[~empty, None]
+            # 空簇重新取随机样本点
+            if empty.any():
+                centers[empty] = data[rng.choice(len(data), int(empty.sum()))]
+        return centers
+
+    @staticmethod
+    def _nearest(data: np.ndarray, centers: np.ndarray) -> np.ndarray:
+        distances = (centers**2).sum(axis=1)[None, :] - 2 * data @ centers.T
+        return distances.argmin(axis=1)
+
+    @property
+    def subspaces(self) -> int:
+        return self.centroids.shape[0]
+
+    @property
+    def code_size(self) -> int:
+        return self.subspaces
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        step = self.centroids.shape[2]
+        codes = np.empty((len(vectors), self.subspaces), dtype=np.uint8)
+        for j in range(self.subspaces):
+            part = vectors[:, j * step : (j + 1) * step]
+            codes[:, j] = self._nearest(part, self.centroids[j])
+        return codes
+
+    def prepare(self, queries: np.ndarray) -> Dict[str, np.ndarray]:
+        step = self.centroids.shape[2]
+        parts = queries.reshape(len(queries), self.subspaces, step)
+        # (查询数, subspaces, 中心数) 的内积表
+        return {"tables": np.einsum("qjd,jkd->qjk", parts, self.centroids)}
+
+    def scores(self, prepared: Dict[str, np.ndarray], codes: np.ndarray) -> np.ndarray:
+        tables = prepared["tables"]
+        scores = np.zeros((len(tables), len(codes)), dtype=np.float32)
+        for j in range(self.subspaces):
+            scores += tables[:, j, codes[:, j]]
+        return scores
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {"centroids": self.centroids}
+
+    @classmethod
+    def from_arrays(cls, arrays) -> "ProductQuantizer":
+        return cls(arrays["centroids"])
+
+
+Quantizer = Union[ScalarQuantizer, ProductQuantizer]
+
+
+def train_quantizer(name: str, sample: np.ndarray, subspaces: int = 64) -> Quantizer:
+    """在训练样本（已归一化的向量）上训练 int8 或 PQ 量化器"""
+    if name == "int8":
+        return ScalarQuantizer.train(sample)
+    if name == "pq":
+        return ProductQuantizer.train(sample, subspaces=subspaces)
+    raise ValueError(f"不支持的向量压缩方式: {name}，可选 {', '.join(QUANTIZATIONS)}")
+
+
+def save_quantizer(path: str, quantizer: Quantizer) -> None:
+    with open(path, "wb") as f:
+        np.savez(f, name=np.array(quantizer.name), **quantizer.to_arrays())
+
+
+def load_quantizer(path: str) -> Optional[Quantizer]:
+    try:
+        with np.load(path) as arrays:
+            name = str(arrays["name"])
+            if name == "int8":
+                return ScalarQuantizer.from_arrays(arrays)
+            return ProductQuantizer.from_arrays(arrays)
+    except FileNotFoundError:
+        return None